@@ -5,6 +5,8 @@ from modules.auth import (
 )
 from modules import dashboard, ingresos, egresos, subir, reportes, configuracion, edicion, login, visor, subir_gemini
 from modules.data_loader import load_data, refresh_data
+from modules.metricas import iniciar_rerun, medir, panel_metricas
+from modules.perfilado import perfilar
 
 
 st.set_page_config(
@@ -14,6 +16,28 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+def mostrar_pagina(menu):
+    if menu == "📊 Dashboard":
+        dashboard.render(st.session_state["movimientos_df"], st.session_state["extractos_df"])
+    elif menu == "💰 Ingresos":
+        ingresos.render(st.session_state["movimientos_df"])
+    elif menu == "💸 Egresos":
+        egresos.render(st.session_state["movimientos_df"])
+    elif menu == "📄 Subida de Extractos":
+        subir.render(st.session_state["movimientos_df"])
+    elif menu == "📄 Subida de Extractos Gemini":
+        subir_gemini.render(st.session_state["movimientos_df"])
+    elif menu == "📑 Visor de PDFs":
+        visor.render(st.session_state["movimientos_df"])
+    elif menu == "📈 Reportes":
+        reportes.render(st.session_state["movimientos_df"], st.session_state["extractos_df"])
+    elif menu == "📝 Edición Manual":
+        edicion.render(st.session_state["movimientos_df"])
+    elif menu == "⚙️ Configuración":
+        configuracion.render(st.session_state["movimientos_df"])
+
+
 init_session_state()
 
 if not st.session_state["authentication_status"]:
@@ -32,29 +56,21 @@ else:
         "📈 Reportes",
         "📝 Edición Manual",
     ]
+    if st.session_state.get("role") == "admin":
+        menu_options.append("⚙️ Configuración")
     menu = st.sidebar.radio("Navegación", menu_options)
+    iniciar_rerun(menu)
     st.sidebar.divider()
     if st.sidebar.button("🚪 Cerrar sesión"):
         logout()
     if st.sidebar.button("🔁 Recargar datos"):
         refresh_data()
-    movimientos_df, extractos_df = load_data()
+    with medir("datos.load_data", "datos"):
+        movimientos_df, extractos_df = load_data()
     if movimientos_df.empty:
         st.info("No hay movimientos registrados en la base de datos.")
     else:
-        if menu == "📊 Dashboard":
-            dashboard.render(st.session_state["movimientos_df"], st.session_state["extractos_df"])
-        elif menu == "💰 Ingresos":
-            ingresos.render(st.session_state["movimientos_df"])
-        elif menu == "💸 Egresos":
-            egresos.render(st.session_state["movimientos_df"])
-        elif menu == "📄 Subida de Extractos":
-            subir.render(st.session_state["movimientos_df"])
-        elif menu == "📄 Subida de Extractos Gemini":
-            subir_gemini.render(st.session_state["movimientos_df"])
-        elif menu == "📑 Visor de PDFs":
-            visor.render(st.session_state["movimientos_df"])
-        elif menu == "📈 Reportes":
-            reportes.render(st.session_state["movimientos_df"], st.session_state["extractos_df"])
-        elif menu == "📝 Edición Manual":
-            edicion.render(st.session_state["movimientos_df"])
+        with medir(f"página.{menu}", "página"), perfilar(menu):
+            mostrar_pagina(menu)
+    if st.session_state.get("role") == "admin":
+        panel_metricas()
@@ -0,0 +1,456 @@
+"""
+Benchmark de las agregaciones y filtros del Dashboard y de Reportes con datos sintéticos.
+Corre fuera de Streamlit y sin red: la carga pasa por `_fetch` contra una hoja de cálculo falsa
+en memoria. Cada corrida se agrega a un historial JSON lines con el commit, para comparar.
+
+Uso:
+    python -m modules.benchmark                          # 10k, 100k y 1M filas
+    python -m modules.benchmark --filas 100000 --solo cubo indice
+    python -m modules.benchmark --comparar               # contra la última corrida de otro commit
+    python -m modules.benchmark --paginas                # además, el render completo con AppTest
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import gspread
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules import data_loader, sheets_utils
+from modules.busqueda import IndiceBusqueda
+from modules.conciliacion import conciliar_extractos
+from modules.cubo import CuboAgregado
+from modules.diferencias import movimientos_en_extractos
+from modules.indice import IndiceMovimientos
+from modules.parsear import agregar_contraparte
+from modules.recurrentes import detectar_recurrentes
+from modules.reportes import totales_por_contraparte
+from modules.saldos import SaldosDiarios
+from modules.tabla import ordenar
+from modules.transferencias import emparejar_transferencias
+
+TAMANOS = (10_000, 100_000, 1_000_000)
+REPETICIONES = 3
+HISTORIAL = Path(os.environ.get("BENCHMARK_HISTORIAL", ".cache/benchmarks/historial.jsonl"))
+# Más lento que la corrida de referencia en esta proporción se marca como regresión
+UMBRAL_REGRESION = 1.2
+# ...y por lo menos estos segundos (debajo de esto la diferencia es ruido del reloj)
+REGRESION_MIN_S = 0.002
+FECHA_FIN = pd.Timestamp("2025-06-30")
+ANIOS = 3
+
+# Banco -> peso en el total de movimientos
+BANCOS = {"Chase": 0.35, "Mercury": 0.25, "Truist": 0.2, "Wise USD": 0.15, "Wise EUR": 0.05}
+# (plantilla de descripción, categoría, tipo, monto típico); {n} es un número variable
+CONTRAPARTES = [
+    ("AMAZON MKTPLACE PMTS AMZN.COM/BILL WA {n}", "Shopping", "egreso", 80),
+    ("SQ *BLUE BOTTLE COFFEE SAN FRANCISCO CA {n}", "Meals", "egreso", 15),
+    ("UBER *TRIP HELP.UBER.COM CA {n}", "Travel", "egreso", 25),
+    ("DELTA AIR LINES ATLANTA GA {n}", "Travel", "egreso", 450),
+    ("PAYPAL *ADOBE INC {n}", "Software", "egreso", 60),
+    ("ORIG CO NAME:GUSTO ORIG ID:{n} DESC DATE: CO ENTRY DESCR:PAYROLL", "Payroll", "egreso", 4200),
+    ("Zelle payment to CONTRACTOR {n}", "Contractors", "egreso", 1500),
+    ("Sent money to Freelancer Ltd {n}", "Contractors", "egreso", 900),
+    ("ORIG CO NAME:STRIPE ORIG ID:{n} DESC DATE: CO ENTRY DESCR:TRANSFER", "Sales", "ingreso", 2500),
+    ("Received money from Client Corp {n}", "Sales", "ingreso", 3200),
+    ("Wise charges for: {n}", "Fees", "egreso", 4),
+    ("MONTHLY SERVICE FEE {n}", "Fees", "egreso", 12),
+]
+# Suscripciones mensuales de monto fijo (para la detección de recurrentes)
+SUSCRIPCIONES = [
+    ("SLACK T0123ABC DUBLIN", "Software", 87.5),
+    ("GOOGLE *WORKSPACE CC@GOOGLE.COM", "Software", 144.0),
+    ("AWS EMEA AWS.AMAZON.CO", "Cloud", 612.4),
+    ("GITHUB, INC. GITHUB.COM CA", "Software", 21.0),
+]
+# Fracción de movimientos que son patas de transferencias internas (pares egreso/ingreso)
+FRACCION_TRANSFERENCIAS = 0.04
+
+
+# --- Datos sintéticos ---
+
+def generar_movimientos(n, semilla=0):
+    """
+    `n` movimientos con forma de la hoja "movimientos": mezcla de bancos, contrapartes con
+    descripciones realistas, montos log-normales, fechas repartidas en `ANIOS` años, pares de
+    transferencias internas y suscripciones mensuales.
+    """
+    rng = np.random.default_rng(semilla)
+    inicio = FECHA_FIN - pd.DateOffset(years=ANIOS)
+    dias = (FECHA_FIN - inicio).days
+    bancos = np.array(list(BANCOS))
+    pesos = np.array(list(BANCOS.values()))
+
+    n_transferencias = int(n * FRACCION_TRANSFERENCIAS) // 2
+    n_suscripciones = min(len(SUSCRIPCIONES) * ANIOS * 12, n // 10)
+    n_comunes = n - 2 * n_transferencias - n_suscripciones
+
+    # Movimientos comunes
+    plantillas = np.array([c[0] for c in CONTRAPARTES])
+    k = rng.integers(0, len(CONTRAPARTES), n_comunes)
+    numeros = rng.integers(1000, 99999, n_comunes).astype(str)
+    comunes = pd.DataFrame({
+        "fecha": inicio + pd.to_timedelta(rng.integers(0, dias, n_comunes), unit="D"),
+        "banco": rng.choice(bancos, n_comunes, p=pesos),
+        "monto": np.round(np.array([c[3] for c in CONTRAPARTES])[k] * rng.lognormal(0, 0.5, n_comunes), 2),
+        "tipo": np.array([c[2] for c in CONTRAPARTES])[k],
+        "descripción": pd.Series(plantillas[k]).str.replace("{n}", "", regex=False).to_numpy() + numeros,
+        "categoría": np.array([c[1] for c in CONTRAPARTES])[k],
+    })
+
+    # Transferencias internas: egreso en un banco e ingreso del mismo monto en otro, 0-2 días después
+    origen = rng.choice(bancos[:4], n_transferencias)
+    destino = np.where(origen == "Chase", "Mercury", "Chase")
+    fecha = inicio + pd.to_timedelta(rng.integers(0, dias - 3, n_transferencias), unit="D")
+    monto = np.round(rng.lognormal(8, 1, n_transferencias), 2)
+    transferencias = pd.concat([
+        pd.DataFrame({"fecha": fecha, "banco": origen, "monto": monto, "tipo": "egreso",
+                      "descripción": "Online Transfer to " + pd.Series(destino).to_numpy(), "categoría": "Internal Transfer"}),
+        pd.DataFrame({"fecha": fecha + pd.to_timedelta(rng.integers(0, 3, n_transferencias), unit="D"), "banco": destino,
+                      "monto": monto, "tipo": "ingreso", "descripción": "Online Transfer from " + pd.Series(origen).to_numpy(),
+                      "categoría": "Internal Transfer"}),
+    ])
+
+    # Suscripciones: el mismo día de cada mes, en el mismo banco
+    meses = pd.date_range(inicio, FECHA_FIN, freq="MS")
+    s = np.arange(n_suscripciones) % len(SUSCRIPCIONES)
+    suscripciones = pd.DataFrame({
+        "fecha": meses[(np.arange(n_suscripciones) // len(SUSCRIPCIONES)) % len(meses)] + pd.to_timedelta(s * 3 + 2, unit="D"),
+        "banco": "Mercury",
+        "monto": np.array([x[2] for x in SUSCRIPCIONES])[s],
+        "tipo": "egreso",
+        "descripción": np.array([x[0] for x in SUSCRIPCIONES])[s],
+        "categoría": np.array([x[1] for x in SUSCRIPCIONES])[s],
+    })
+
+    movs = pd.concat([comunes, transferencias, suscripciones], ignore_index=True)
+    movs = movs.iloc[rng.permutation(len(movs))].reset_index(drop=True)
+    mes = movs["fecha"].dt.strftime("%Y-%m")
+    return pd.DataFrame({
+        "id": [f"bench_{i}" for i in range(len(movs))],
+        # Como llegan de Sheets: fechas en texto
+        "fecha": movs["fecha"].dt.strftime("%Y-%m-%d"),
+        "banco": movs["banco"],
+        "monto": movs["monto"],
+        "tipo": movs["tipo"],
+        "descripción": movs["descripción"],
+        "categoría": movs["categoría"],
+        "extracto_id": movs["banco"].str.replace(" ", "_") + "_" + mes,
+        "origen_dato": movs["banco"].str.replace(" ", "_") + "_" + mes + ".pdf",
+        "version": 1,
+    })
+
+
+def generar_extractos(movimientos_df, saldo_inicial=10_000.0):
+    """Un extracto por banco y mes con saldos coherentes con los movimientos (concilian)."""
+    movs = movimientos_df.assign(
+        fecha=pd.to_datetime(movimientos_df["fecha"]),
+        neto=np.where(movimientos_df["tipo"] == "ingreso", 1, -1) * movimientos_df["monto"],
+    )
+    movs["mes"] = movs["fecha"].dt.to_period("M")
+    por_mes = movs.groupby(["banco", "mes"]).agg(
+        total_ingresos=("neto", lambda x: x[x > 0].sum()), total_egresos=("neto", lambda x: -x[x < 0].sum()),
+        neto=("neto", "sum"),
+    ).reset_index()
+    por_mes["saldo_final"] = saldo_inicial + por_mes.groupby("banco")["neto"].cumsum()
+    por_mes["saldo_inicial"] = por_mes["saldo_final"] - por_mes["neto"]
+    extracto_id = por_mes["banco"].str.replace(" ", "_") + "_" + por_mes["mes"].astype(str)
+    return pd.DataFrame({
+        "extracto_id": extracto_id,
+        "banco": por_mes["banco"],
+        "fecha_inicio": por_mes["mes"].dt.start_time.dt.strftime("%Y-%m-%d"),
+        "fecha_fin": por_mes["mes"].dt.end_time.dt.strftime("%Y-%m-%d"),
+        "saldo_inicial": por_mes["saldo_inicial"].round(2),
+        "saldo_final": por_mes["saldo_final"].round(2),
+        "total_ingresos": por_mes["total_ingresos"].round(2),
+        "total_egresos": por_mes["total_egresos"].round(2),
+        "archivo_fuente": extracto_id + ".pdf",
+    })
+
+
+# --- Google Sheets falso ---
+
+class HojaFalsa:
+    """Lo que usa `get_as_dataframe` de una hoja: título, tamaño y `spreadsheet.values_get`."""
+
+    def __init__(self, libro, titulo, df):
+        self.spreadsheet = libro
+        self.title = titulo
+        # Como los devuelve la API: filas de celdas, la primera es el encabezado
+        self.valores = [list(map(str, df.columns))] + df.astype(object).where(df.notna(), "").to_numpy().tolist()
+        self.row_count = len(self.valores)
+        self.col_count = len(df.columns)
+
+
+class LibroFalso:
+    def __init__(self, hojas):
+        self.hojas = {nombre: HojaFalsa(self, nombre, df) for nombre, df in hojas.items()}
+
+    def worksheet(self, nombre):
+        if nombre not in self.hojas:
+            raise gspread.exceptions.WorksheetNotFound(nombre)
+        return self.hojas[nombre]
+
+    def values_get(self, rango, params=None):
+        return {"values": self.hojas[rango.strip("'")].valores}
+
+
+class ClienteFalso:
+    def __init__(self, hojas):
+        self.libro = LibroFalso(hojas)
+
+    def open_by_key(self, _):
+        return self.libro
+
+
+@contextlib.contextmanager
+def sheets_falso(cliente):
+    """Reemplaza el cliente de Sheets (y el id de la planilla en los secrets) por `cliente`."""
+    with mock.patch.object(sheets_utils, "get_google_sheets_client", lambda: cliente), \
+            mock.patch.object(st.secrets, "_secrets", {"google": {"spreadsheet_id": "benchmark"}}):
+        yield cliente
+
+
+# --- Casos ---
+
+class Contexto:
+    """Datos y estructuras derivadas de un tamaño, construidos una sola vez para las consultas."""
+
+    def __init__(self, n, semilla=0):
+        self.n = n
+        self.movimientos = generar_movimientos(n, semilla)
+        self.extractos = generar_extractos(self.movimientos)
+        self.movimientos = agregar_contraparte(self.movimientos)
+        self.indice = IndiceMovimientos(self.movimientos)
+        self.cubo = CuboAgregado(self.movimientos)
+        self.saldos = SaldosDiarios(self.movimientos, self.extractos)
+        self.busqueda = IndiceBusqueda(self.movimientos)
+        fin = self.indice.fecha_max
+        # Filtros típicos: todo el período y el último mes de un banco
+        self.todo = {"fecha_ini": self.indice.fecha_min, "fecha_fin": fin, "bancos": None, "categorias": None}
+        self.mes = {"fecha_ini": fin - pd.Timedelta(days=30), "fecha_fin": fin, "bancos": ["Chase"], "categorias": None}
+
+
+def _carga(ctx):
+    """`_fetch` completo (lectura, parseo de get_as_dataframe y contraparte) contra la hoja falsa."""
+    cliente = ClienteFalso({"movimientos": ctx.movimientos.drop(columns="contraparte"), "extractos": ctx.extractos})
+
+    def cargar():
+        with sheets_falso(cliente):
+            data_loader._fetch.clear()
+            return data_loader._fetch()
+    return cargar
+
+
+def _dashboard_totales(ctx, filtros):
+    ctx.cubo.totales_por_tipo(**filtros)
+    ctx.cubo.por_banco_y_tipo(**filtros)
+    ctx.cubo.por_mes_y_tipo(**filtros)
+    ctx.cubo.por_categoria(tipos=["egreso"], **filtros)
+
+
+def _reportes_contrapartes(ctx):
+    for tipo in ("ingreso", "egreso"):
+        totales_por_contraparte(ctx.indice.consultar(tipos=[tipo], **ctx.todo)).head(5)
+
+
+# nombre -> función que recibe el contexto y devuelve lo que se mide (sin argumentos)
+CASOS = {
+    "construir.indice": lambda ctx: lambda: IndiceMovimientos(ctx.movimientos),
+    "construir.cubo": lambda ctx: lambda: CuboAgregado(ctx.movimientos),
+    "construir.saldos": lambda ctx: lambda: SaldosDiarios(ctx.movimientos, ctx.extractos),
+    "construir.busqueda": lambda ctx: lambda: IndiceBusqueda(ctx.movimientos),
+    "construir.contraparte": lambda ctx: lambda: agregar_contraparte(ctx.movimientos.drop(columns="contraparte")),
+    "dashboard.filtro_todo": lambda ctx: lambda: ctx.indice.consultar(**ctx.todo),
+    "dashboard.filtro_banco_mes": lambda ctx: lambda: ctx.indice.consultar(**ctx.mes),
+    "dashboard.totales_todo": lambda ctx: lambda: _dashboard_totales(ctx, ctx.todo),
+    "dashboard.totales_banco_mes": lambda ctx: lambda: _dashboard_totales(ctx, ctx.mes),
+    "dashboard.saldos": lambda ctx: lambda: ctx.saldos.consultar(ctx.todo["fecha_ini"], ctx.todo["fecha_fin"]),
+    "dashboard.busqueda": lambda ctx: lambda: ctx.busqueda.buscar("amaz mkt"),
+    "dashboard.ordenar_monto": lambda ctx: lambda: ordenar(ctx.movimientos, np.arange(ctx.n), "monto", False),
+    "reportes.mensual": lambda ctx: lambda: ctx.cubo.por_mes_y_tipo(**ctx.todo),
+    "reportes.contrapartes": lambda ctx: lambda: _reportes_contrapartes(ctx),
+    "reportes.conciliacion": lambda ctx: lambda: conciliar_extractos(ctx.extractos, ctx.movimientos),
+    "reportes.movimientos_en_extractos": lambda ctx: lambda: movimientos_en_extractos(ctx.extractos, ctx.movimientos),
+    "reportes.transferencias": lambda ctx: lambda: emparejar_transferencias(ctx.movimientos),
+    "reportes.recurrentes": lambda ctx: lambda: detectar_recurrentes(ctx.movimientos),
+    "carga.sheets": _carga,
+}
+
+
+def _cronometrar(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def medir_caso(nombre, ctx, repeticiones=REPETICIONES):
+    tiempos = _cronometrar(CASOS[nombre](ctx), repeticiones)
+    return {"min_s": round(min(tiempos), 5), "mediana_s": round(float(np.median(tiempos)), 5), "repeticiones": repeticiones}
+
+
+# --- Render completo (AppTest) ---
+
+_PAGINA = {}
+
+
+def _app_benchmark():
+    import streamlit as st
+    from modules import benchmark
+    st.session_state.setdefault("movimientos_df", benchmark._PAGINA["movimientos"])
+    st.session_state.setdefault("extractos_df", benchmark._PAGINA["extractos"])
+    benchmark._PAGINA["render"](st.session_state["movimientos_df"], st.session_state["extractos_df"])
+
+
+def medir_paginas(ctx, repeticiones=REPETICIONES):
+    """Primer render y reruns de Dashboard y Reportes con AppTest (incluye el costo del arnés)."""
+    from streamlit.testing.v1 import AppTest
+    from modules import benchmark, dashboard, reportes
+
+    resultados = {}
+    for nombre, modulo in (("pagina.dashboard", dashboard), ("pagina.reportes", reportes)):
+        # El script de AppTest importa modules.benchmark, que no es este módulo si se corre con -m
+        benchmark._PAGINA.update(movimientos=ctx.movimientos, extractos=ctx.extractos.copy(), render=modulo.render)
+        app = AppTest.from_function(_app_benchmark, default_timeout=600)
+        inicio = time.perf_counter()
+        app.run()
+        primero = time.perf_counter() - inicio
+        if app.exception:
+            raise RuntimeError(f"{nombre}: {app.exception[0].message}")
+        reruns = _cronometrar(app.run, repeticiones)
+        resultados[f"{nombre}.primer_render"] = {"min_s": round(primero, 5), "mediana_s": round(primero, 5), "repeticiones": 1}
+        resultados[f"{nombre}.rerun"] = {
+            "min_s": round(min(reruns), 5), "mediana_s": round(float(np.median(reruns)), 5), "repeticiones": repeticiones,
+        }
+    return resultados
+
+
+# --- Historial ---
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parent.parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def entorno():
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "cambios_sin_commit": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "maquina": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPU)",
+    }
+
+
+def guardar_corrida(corrida, historial=HISTORIAL):
+    historial = Path(historial)
+    historial.parent.mkdir(parents=True, exist_ok=True)
+    with historial.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(corrida, ensure_ascii=False) + "\n")
+
+
+def leer_historial(historial=HISTORIAL):
+    historial = Path(historial)
+    if not historial.exists():
+        return []
+    corridas = []
+    for linea in historial.read_text(encoding="utf-8").splitlines():
+        try:
+            corridas.append(json.loads(linea))
+        except ValueError:
+            continue
+    return corridas
+
+
+def referencia(anteriores, corrida):
+    """
+    De las corridas `anteriores` que midieron alguno de los mismos tamaños, la última de otro
+    commit (o, si no hay, la última).
+    """
+    anteriores = [c for c in anteriores if set(c["resultados"]) & set(corrida["resultados"])]
+    otro_commit = [c for c in anteriores if c["entorno"].get("commit") != corrida["entorno"].get("commit")]
+    return (otro_commit or anteriores or [None])[-1]
+
+
+def comparar(corrida, base):
+    """Tabla caso/filas con la mediana actual, la de referencia y la proporción; marca regresiones."""
+    filas = []
+    for n, casos in corrida["resultados"].items():
+        for caso, medida in casos.items():
+            anterior = base["resultados"].get(n, {}).get(caso) if base else None
+            fila = {"filas": int(n), "caso": caso, "mediana_s": medida["mediana_s"]}
+            if anterior:
+                fila["referencia_s"] = anterior["mediana_s"]
+                fila["proporcion"] = round(medida["mediana_s"] / max(anterior["mediana_s"], 1e-9), 2)
+                fila["regresion"] = (
+                    fila["proporcion"] > UMBRAL_REGRESION
+                    and medida["mediana_s"] - anterior["mediana_s"] > REGRESION_MIN_S
+                )
+            filas.append(fila)
+    return pd.DataFrame(filas)
+
+
+# --- CLI ---
+
+def ejecutar(tamanos=TAMANOS, casos=None, repeticiones=REPETICIONES, paginas=False, semilla=0, salida=print):
+    corrida = {"fecha": datetime.datetime.now().isoformat(timespec="seconds"), "entorno": entorno(), "resultados": {}}
+    for n in tamanos:
+        inicio = time.perf_counter()
+        ctx = Contexto(n, semilla)
+        salida(f"--- {n:,} filas (datos y derivados en {time.perf_counter() - inicio:.1f}s) ---")
+        resultados = {}
+        for nombre in casos or CASOS:
+            resultados[nombre] = medir_caso(nombre, ctx, repeticiones)
+            salida(f"{nombre:<36} mediana {resultados[nombre]['mediana_s']:9.4f}s  mín {resultados[nombre]['min_s']:9.4f}s")
+        if paginas:
+            for nombre, medida in medir_paginas(ctx, repeticiones).items():
+                resultados[nombre] = medida
+                salida(f"{nombre:<36} mediana {medida['mediana_s']:9.4f}s  mín {medida['min_s']:9.4f}s")
+        corrida["resultados"][str(n)] = resultados
+    return corrida
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de Dashboard y Reportes con datos sintéticos")
+    parser.add_argument("--filas", type=int, nargs="+", default=list(TAMANOS), metavar="N")
+    parser.add_argument("--solo", nargs="+", metavar="PREFIJO", help="Solo los casos que contienen alguno (p. ej. cubo dashboard.)")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--paginas", action="store_true", help="Medir también el render de las páginas con AppTest")
+    parser.add_argument("--historial", default=str(HISTORIAL))
+    parser.add_argument("--no-guardar", action="store_true", help="No agregar la corrida al historial")
+    parser.add_argument("--comparar", action="store_true", help="Comparar con la última corrida de otro commit")
+    args = parser.parse_args()
+
+    casos = [c for c in CASOS if not args.solo or any(p in c for p in args.solo)]
+    anteriores = leer_historial(args.historial)
+    corrida = ejecutar(args.filas, casos, args.repeticiones, args.paginas)
+    if not args.no_guardar:
+        guardar_corrida(corrida, args.historial)
+        print(f"Corrida guardada en {args.historial}")
+    if args.comparar:
+        base = referencia(anteriores, corrida)
+        if base is None:
+            print("No hay corridas anteriores para comparar.")
+        else:
+            tabla = comparar(corrida, base)
+            print(f"Referencia: {base['fecha']} (commit {base['entorno'].get('commit')})")
+            print(tabla.to_string(index=False))
+            if tabla.get("regresion", pd.Series(dtype=bool)).fillna(False).any():
+                sys.exit(1)
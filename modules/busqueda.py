@@ -0,0 +1,158 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.data_loader import obtener_derivado
+
+COLUMNAS_INDEXADAS = ["descripción", "banco", "categoría", "origen_dato"]
+# Cada anexado/edición crea un segmento nuevo; al pasar de este número se compactan en uno
+SEGMENTOS_MAX = 8
+_PATRON_TOKEN = re.compile(r"[0-9a-z]+")
+
+
+def tokens(texto):
+    """Palabras de `texto` en minúsculas y sin acentos ("Categoría 5" -> ["categoria", "5"])."""
+    texto = str(texto).lower()
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return _PATRON_TOKEN.findall(texto)
+
+
+def _expandir(codigos, grupos):
+    """
+    Para cada grupo k de `grupos` (índices de valores distintos), las filas cuyo código es k.
+    Devuelve (grupo repetido por fila, fila) sin recorrer fila por fila.
+    """
+    orden = np.argsort(codigos, kind="stable")
+    cuenta = np.bincount(codigos[codigos >= 0], minlength=int(grupos.max()) + 1 if len(grupos) else 0)
+    comienzo = np.concatenate(([0], np.cumsum(cuenta)))[:-1]
+    repeticiones = cuenta[grupos]
+    desfase = np.concatenate(([0], np.cumsum(repeticiones)))[:-1]
+    posiciones = np.repeat(comienzo[grupos] - desfase, repeticiones) + np.arange(int(repeticiones.sum()))
+    return np.repeat(np.arange(len(grupos)), repeticiones), orden[posiciones]
+
+
+class _Segmento:
+    """
+    Índice invertido de un bloque de filas en formato CSR: `tokens` ordenados, y las filas del
+    token i son `filas[inicio[i]:inicio[i + 1]]`. Como los tokens están ordenados, todos los
+    que empiezan por un prefijo forman un rango contiguo y sus filas también.
+    """
+
+    def __init__(self, tokens, codigos, filas):
+        # tokens: vocabulario ordenado; codigos/filas: pares (posición en tokens, fila) sin orden.
+        # Dentro de un token las filas no necesitan orden: la consulta marca una máscara
+        orden = np.argsort(codigos, kind="stable")
+        self.tokens = tokens
+        self.filas = np.asarray(filas, dtype=np.int64)[orden]
+        self.inicio = np.concatenate(([0], np.cumsum(np.bincount(codigos, minlength=len(tokens)))))
+
+    @classmethod
+    def desde_filas(cls, movimientos_df, desplazamiento):
+        """
+        Tokeniza cada valor distinto de cada columna una sola vez (los textos se repiten mucho:
+        bancos, categorías, archivos, proveedores) y expande sus tokens a las filas.
+        """
+        columnas = []
+        for col in COLUMNAS_INDEXADAS:
+            if col not in movimientos_df.columns:
+                continue
+            codigos, valores = pd.factorize(movimientos_df[col].fillna("").astype(str))
+            valor_de_token, token = [], []
+            for k, valor in enumerate(valores):
+                distintos = set(tokens(valor))
+                token.extend(distintos)
+                valor_de_token.extend([k] * len(distintos))
+            if token:
+                columnas.append((codigos, np.array(valor_de_token, dtype=np.int64), np.array(token, dtype=str)))
+        # El vocabulario sale de los tokens de los valores distintos (pocos); a las filas solo
+        # se expanden enteros
+        vocabulario = np.unique(np.concatenate([t for _, _, t in columnas])) if columnas else np.array([], dtype=str)
+        pares_codigo, pares_fila = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+        for codigos, valor_de_token, token in columnas:
+            par, filas = _expandir(codigos, valor_de_token)
+            pares_codigo.append(np.searchsorted(vocabulario, token)[par])
+            pares_fila.append(filas + desplazamiento)
+        return cls(vocabulario, np.concatenate(pares_codigo), np.concatenate(pares_fila))
+
+    def filas_con_prefijo(self, prefijo):
+        a = np.searchsorted(self.tokens, prefijo, side="left")
+        b = np.searchsorted(self.tokens, prefijo + "\uffff", side="left")
+        return self.filas[self.inicio[a]:self.inicio[b]]
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido (token -> posiciones de fila en movimientos_df) sobre descripción, banco,
+    categoría y origen_dato. Cada palabra de la consulta se busca como prefijo y todas deben
+    aparecer en la fila ("amaz mkt" encuentra "AMAZON MKTPLACE").
+
+    Se construye una vez por versión de datos. Las filas anexadas o editadas van a un segmento
+    nuevo; `_segmento_de_fila` dice en qué segmento está el texto vigente de cada fila, así una
+    fila editada deja de coincidir por sus tokens anteriores.
+    """
+
+    def __init__(self, movimientos_df):
+        self._n = len(movimientos_df)
+        self._segmentos = [_Segmento.desde_filas(movimientos_df, 0)]
+        self._segmento_de_fila = np.zeros(self._n, dtype=np.int32)
+
+    def __len__(self):
+        return self._n
+
+    def _agregar_segmento(self, segmento, posiciones):
+        self._segmentos.append(segmento)
+        self._segmento_de_fila[posiciones] = len(self._segmentos) - 1
+        if len(self._segmentos) > SEGMENTOS_MAX:
+            self._compactar()
+
+    def _compactar(self):
+        vocabulario = np.unique(np.concatenate([s.tokens for s in self._segmentos]))
+        codigos, filas = [], []
+        for i, segmento in enumerate(self._segmentos):
+            # Código de cada par en el vocabulario común
+            c = np.repeat(np.searchsorted(vocabulario, segmento.tokens), np.diff(segmento.inicio))
+            vigentes = self._segmento_de_fila[segmento.filas] == i
+            codigos.append(c[vigentes])
+            filas.append(segmento.filas[vigentes])
+        self._segmentos = [_Segmento(vocabulario, np.concatenate(codigos), np.concatenate(filas))]
+        self._segmento_de_fila[:] = 0
+
+    def anexar(self, nuevos_df):
+        posiciones = np.arange(self._n, self._n + len(nuevos_df))
+        self._segmento_de_fila = np.concatenate((self._segmento_de_fila, np.zeros(len(nuevos_df), dtype=np.int32)))
+        self._n += len(nuevos_df)
+        self._agregar_segmento(_Segmento.desde_filas(nuevos_df, self._n - len(nuevos_df)), posiciones)
+
+    def actualizar(self, antes_df, despues_df):
+        # Las filas ya están actualizadas en la sesión: se re-indexa su texto completo
+        movimientos_df = st.session_state["movimientos_df"]
+        posiciones = np.flatnonzero(movimientos_df["id"].isin(despues_df["id"]).to_numpy())
+        editadas = movimientos_df.iloc[posiciones]
+        segmento = _Segmento.desde_filas(editadas, 0)
+        # desde_filas numera las filas 0..k-1: se traducen a su posición real
+        segmento.filas = posiciones[segmento.filas]
+        self._agregar_segmento(segmento, posiciones)
+
+    def coincidencias(self, texto):
+        """Máscara booleana (una entrada por fila) de las filas que contienen todas las palabras."""
+        mascara = None
+        for prefijo in tokens(texto):
+            parcial = np.zeros(self._n, dtype=bool)
+            for i, segmento in enumerate(self._segmentos):
+                filas = segmento.filas_con_prefijo(prefijo)
+                parcial[filas[self._segmento_de_fila[filas] == i]] = True
+            mascara = parcial if mascara is None else mascara & parcial
+        return np.ones(self._n, dtype=bool) if mascara is None else mascara
+
+    def buscar(self, texto):
+        """Posiciones (en movimientos_df) de las filas que coinciden con `texto`."""
+        return np.flatnonzero(self.coincidencias(texto))
+
+
+def get_busqueda(movimientos_df):
+    """Índice de búsqueda de la versión de datos actual (se construye la primera vez que se pide)."""
+    return obtener_derivado("busqueda", lambda: IndiceBusqueda(movimientos_df))
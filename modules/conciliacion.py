@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+TOLERANCIA_CONCILIACION = 0.01
+
+COLUMNAS_RESULTADO = {
+    "extracto_id": "string",
+    "banco": "string",
+    "archivo_fuente": "string",
+    "fecha_inicio": "datetime64[ns]",
+    "fecha_fin": "datetime64[ns]",
+    "saldo_inicial": "float64",
+    "saldo_final": "float64",
+    "n_movimientos": "int64",
+    "ingresos_calc": "float64",
+    "egresos_calc": "float64",
+    "saldo_calculado": "float64",
+    "diferencia": "float64",
+    "conciliado": "boolean",
+}
+
+
+def _columna(df, nombre):
+    return df[nombre] if nombre in df.columns else pd.Series(None, index=df.index, dtype="object")
+
+
+def conciliar_extractos(extractos_df, movimientos_df, tolerancia=TOLERANCIA_CONCILIACION):
+    """
+    Concilia todos los extractos a la vez: para cada uno suma los ingresos y egresos del banco
+    entre fecha_inicio y fecha_fin (ambas inclusive) y compara saldo_inicial + ingresos - egresos
+    con el saldo_final informado.
+
+    En lugar de filtrar los movimientos por cada extracto, se ordenan una vez por banco y fecha,
+    se acumulan los montos y cada período se resuelve con dos búsquedas binarias
+    (`searchsorted`): suma del período = acumulado[fin] - acumulado[inicio].
+
+    Devuelve un DataFrame con los tipos de COLUMNAS_RESULTADO, una fila por extracto y en el
+    mismo orden. `conciliado` es <NA> cuando faltan saldos para comparar.
+    """
+    if extractos_df is None or extractos_df.empty:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in COLUMNAS_RESULTADO.items()})
+
+    ext = pd.DataFrame({
+        "extracto_id": _columna(extractos_df, "extracto_id"),
+        "banco": _columna(extractos_df, "banco"),
+        "archivo_fuente": _columna(extractos_df, "archivo_fuente"),
+        "fecha_inicio": pd.to_datetime(_columna(extractos_df, "fecha_inicio"), errors="coerce"),
+        "fecha_fin": pd.to_datetime(_columna(extractos_df, "fecha_fin"), errors="coerce"),
+        "saldo_inicial": pd.to_numeric(_columna(extractos_df, "saldo_inicial"), errors="coerce"),
+        "saldo_final": pd.to_numeric(_columna(extractos_df, "saldo_final"), errors="coerce"),
+    }).reset_index(drop=True)
+
+    n = len(ext)
+    ingresos = np.zeros(n)
+    egresos = np.zeros(n)
+    conteo = np.zeros(n, dtype=np.int64)
+
+    if movimientos_df is not None and not movimientos_df.empty:
+        movs = pd.DataFrame({
+            "banco": movimientos_df["banco"],
+            "fecha": pd.to_datetime(movimientos_df["fecha"], errors="coerce"),
+            "monto": pd.to_numeric(movimientos_df["monto"], errors="coerce").fillna(0.0),
+            "tipo": movimientos_df["tipo"].astype(str).str.lower(),
+        }).dropna(subset=["fecha"])
+        movs = movs.sort_values(["banco", "fecha"], kind="stable")
+        movs["ing"] = np.where(movs["tipo"] == "ingreso", movs["monto"], 0.0)
+        movs["egr"] = np.where(movs["tipo"] == "egreso", movs["monto"], 0.0)
+
+        validos = np.flatnonzero(ext["fecha_inicio"].notna() & ext["fecha_fin"].notna())
+        por_banco_ext = ext.iloc[validos].groupby("banco", sort=False).indices
+        for banco, filas_mov in movs.groupby("banco", sort=False).indices.items():
+            filas_ext = por_banco_ext.get(banco)
+            if filas_ext is None:
+                continue
+            filas_ext = validos[filas_ext]
+            grupo = movs.iloc[filas_mov]
+            fechas = grupo["fecha"].to_numpy()
+            # Acumulados con un 0 delante para que la suma de [i, j) sea acum[j] - acum[i]
+            acum_ing = np.concatenate(([0.0], np.cumsum(grupo["ing"].to_numpy())))
+            acum_egr = np.concatenate(([0.0], np.cumsum(grupo["egr"].to_numpy())))
+            ini = np.searchsorted(fechas, ext["fecha_inicio"].to_numpy()[filas_ext], side="left")
+            fin = np.searchsorted(fechas, ext["fecha_fin"].to_numpy()[filas_ext], side="right")
+            fin = np.maximum(fin, ini)
+            ingresos[filas_ext] = acum_ing[fin] - acum_ing[ini]
+            egresos[filas_ext] = acum_egr[fin] - acum_egr[ini]
+            conteo[filas_ext] = fin - ini
+
+    ext["n_movimientos"] = conteo
+    ext["ingresos_calc"] = ingresos
+    ext["egresos_calc"] = egresos
+    ext["saldo_calculado"] = ext["saldo_inicial"] + ext["ingresos_calc"] - ext["egresos_calc"]
+    ext["diferencia"] = ext["saldo_final"] - ext["saldo_calculado"]
+    conciliado = pd.array(ext["diferencia"].abs() < tolerancia, dtype="boolean")
+    conciliado[ext["diferencia"].isna().to_numpy()] = pd.NA
+    ext["conciliado"] = conciliado
+    return ext.astype(COLUMNAS_RESULTADO)
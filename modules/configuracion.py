@@ -1,11 +1,21 @@
 import streamlit as st
-import pandas as pd
 import datetime
 
+from modules.data_loader import data_version, refresh_data
+from modules.diferencias import BANCOS_REPARSEO, correcciones_reparseo
+from modules.edicion import guardar_ediciones
+from modules.exportar import descarga_bajo_demanda, generar_archivo, parquet_disponible, MIME_ZIP
+from modules.perfilado import render_perfiles
+from modules.respaldo import (
+    FORMATO, escribir_respaldo, hojas_respaldo, importar_csv, lotes_csv, resumen_manifiesto,
+    restaurar_respaldo, validar_lotes, validar_respaldo,
+)
+from modules.sheets_utils import actualizar_celdas
+
 def render(movimientos_df):
         st.title("⚙️ Configuración del Sistema")
         
-        tab1, tab2 = st.tabs(["Integraciones", "Backup"])
+        tab1, tab2, tab3, tab4 = st.tabs(["Integraciones", "Backup", "Perfilado", "Migraciones"])
         
         with tab1:
             st.subheader("Configuración de Integraciones")
@@ -30,34 +40,155 @@ def render(movimientos_df):
                     # En producción, esto se guardaría en st.secrets
                     st.success("Configuración guardada")
         
+        with tab3:
+            st.subheader("Perfiles de rendimiento")
+            render_perfiles()
+
+        with tab4:
+            st.subheader("Re-parsear extractos de Chase y Wise")
+            _migrar_reparseo(movimientos_df)
+
         with tab2:
             st.subheader("Copia de Seguridad y Restauración")
-            
-            # Exportar datos de ejemplo
-            # data = load_demo_data()
-            
+            if not parquet_disponible():
+                st.warning("El respaldo usa Parquet: instala `pyarrow` para exportar y restaurar.")
+                return
+
             col1, col2 = st.columns(2)
             with col1:
                 st.write("**Exportar Datos**")
-                csv = pd.concat([
-                    # data["ingresos"].assign(tipo="ingreso"),
-                    # data["egresos"].assign(tipo="egreso")  # Eliminado: solo datos reales
-                ]).to_csv(index=False).encode("utf-8")
-                
-                st.download_button(
-                    "📥 Exportar Datos",
-                    data=csv,
-                    file_name=f"datos_financieros_{datetime.datetime.now().strftime('%Y%m%d')}.csv",
-                    mime="text/csv"
+                hojas = {
+                    "movimientos": movimientos_df,
+                    "extractos": st.session_state.get("extractos_df"),
+                    "transferencias": st.session_state.get("transferencias_df"),
+                }
+                st.caption(
+                    " · ".join(f"{nombre}: {len(df):,} filas" for nombre, df in hojas.items() if df is not None)
+                    + " · más el historial de cambios"
                 )
-            
+                descarga_bajo_demanda(
+                    "📥 Descargar respaldo",
+                    f"respaldo_{datetime.datetime.now().strftime('%Y%m%d')}.zip",
+                    lambda: generar_archivo(escribir_respaldo, hojas_respaldo()),
+                    filtros={"respaldo": FORMATO},
+                    mime=MIME_ZIP,
+                )
+
             with col2:
                 st.write("**Importar Datos**")
-                uploaded_file = st.file_uploader("Subir archivo CSV", type="csv")
+                uploaded_file = st.file_uploader(
+                    "Subir respaldo (.zip) o movimientos (.csv)", type=["zip", "csv"],
+                    help="Las filas se insertan o actualizan por su id; las que no están en el archivo no se tocan."
+                )
                 if uploaded_file:
-                    try:
-                        df = pd.read_csv(uploaded_file)
-                        st.success("Archivo cargado correctamente")
-                        st.dataframe(df.head(), use_container_width=True)
-                    except Exception as e:
-                        st.error(f"Error al cargar archivo: {e}")
\ No newline at end of file
+                    _restaurar(uploaded_file)
+
+
+def _restaurar(uploaded_file):
+    es_respaldo = uploaded_file.name.lower().endswith(".zip")
+    # La validación recorre el archivo entero: se hace una vez por archivo subido
+    validacion = st.session_state.get("respaldo_validacion")
+    if validacion is None or validacion[0] != uploaded_file.file_id:
+        with st.spinner("Validando archivo..."):
+            if es_respaldo:
+                ok, errores, manifiesto = validar_respaldo(uploaded_file)
+            else:
+                filas, errores = validar_lotes("movimientos", lotes_csv(uploaded_file), "id")
+                ok, manifiesto = not errores, {"hojas": {"movimientos": {"filas": filas, "columnas": [], "clave": "id"}}}
+        validacion = (uploaded_file.file_id, ok, errores, manifiesto)
+        st.session_state["respaldo_validacion"] = validacion
+    _, ok, errores, manifiesto = validacion
+
+    if not ok:
+        st.error("El archivo no se puede restaurar:")
+        for error in errores:
+            st.write(f"- {error}")
+        return
+    if es_respaldo:
+        st.caption(f"Respaldo del {manifiesto['creado']} ({manifiesto.get('usuario', '')})")
+        st.dataframe(resumen_manifiesto(manifiesto), hide_index=True, use_container_width=True)
+        hojas = st.multiselect("Hojas a restaurar", list(manifiesto["hojas"]), default=list(manifiesto["hojas"]))
+    else:
+        st.success(f"Archivo válido: {manifiesto['hojas']['movimientos']['filas']:,} movimientos")
+        hojas = ["movimientos"]
+
+    forzar = st.checkbox(
+        "Sobrescribir filas editadas después del respaldo", key="respaldo_forzar",
+        help="Sin marcar, las filas cuya versión en la hoja cambió desde el respaldo no se tocan y se informan como conflicto.",
+    )
+    if st.button("♻️ Restaurar", disabled=not hojas):
+        barra = st.progress(0.0)
+
+        def progreso(hoja, filas, total):
+            barra.progress(min(filas / max(total, 1), 1.0), text=f"{hoja}: {filas:,} de {total:,} filas")
+
+        if es_respaldo:
+            ok, msg = restaurar_respaldo(uploaded_file, hojas, progreso, forzar)
+        else:
+            ok, msg = importar_csv(uploaded_file, progreso, forzar)
+        if ok:
+            st.success(msg)
+        else:
+            st.error(msg)
+        # Aun con error o conflictos pueden haberse escrito lotes: se recarga igual
+        refresh_data()
+
+
+def _migrar_reparseo(movimientos_df):
+    """
+    Corrige lo guardado con los parsers anteriores de Chase (tipo de cada movimiento) y Wise
+    (saldo inicial del extracto): se re-parsean los PDFs, se muestran las diferencias y se
+    aplican al confirmar. Los movimientos pasan por la edición normal (versión e historial).
+    """
+    st.caption(
+        "Chase ahora toma el tipo de la sección del detalle (antes todo quedaba como ingreso) y Wise "
+        "calcula el saldo inicial restando el movimiento más antiguo. Los extractos subidos antes "
+        "de ese cambio pueden tener el tipo o el saldo inicial mal."
+    )
+    extractos_df = st.session_state.get("extractos_df")
+    if extractos_df is None or extractos_df.empty:
+        st.info("No hay extractos guardados.")
+        return
+    if st.button("🔍 Buscar correcciones", key="reparseo_buscar"):
+        barra = st.progress(0.0, text="Obteniendo PDFs...")
+        resultado = correcciones_reparseo(
+            extractos_df, movimientos_df,
+            on_progreso=lambda hechos, total, nombre: barra.progress(hechos / total, text=f"Re-parseando {nombre}"),
+        )
+        barra.empty()
+        st.session_state["reparseo"] = (data_version(), *resultado)
+
+    guardado = st.session_state.get("reparseo")
+    if not guardado or guardado[0] != data_version():
+        st.caption(f"Bancos revisados: {', '.join(BANCOS_REPARSEO)}.")
+        return
+    _, tipos, saldos, errores = guardado
+    if errores:
+        st.warning("No se pudieron re-parsear:\n" + "\n".join(f"{n}: {e}" for n, e in errores.items()))
+    if tipos.empty and saldos.empty:
+        st.success("✅ No hay nada que corregir.")
+        return
+    st.write(f"**Movimientos con otro tipo:** {len(tipos):,}")
+    st.dataframe(tipos, hide_index=True, use_container_width=True)
+    st.write(f"**Extractos con otro saldo inicial:** {len(saldos):,}")
+    st.dataframe(saldos, hide_index=True, use_container_width=True)
+    if not st.button("✅ Aplicar correcciones", key="reparseo_aplicar"):
+        return
+
+    if not tipos.empty:
+        antes = movimientos_df[movimientos_df["id"].isin(tipos["id"])].drop_duplicates("id")
+        despues = antes.assign(tipo=antes["id"].map(tipos.drop_duplicates("id").set_index("id")["tipo_pdf"]))
+        ok, msg = guardar_ediciones(antes, despues, ["tipo"])
+        if ok:
+            st.success(f"Movimientos: {msg}")
+        else:
+            st.error(f"Movimientos: {msg}")
+    if not saldos.empty:
+        cambios = {fila.extracto_id: {"saldo_inicial": fila.saldo_inicial_pdf} for fila in saldos.itertuples()}
+        ok, msg = actualizar_celdas(cambios, "extractos", "extracto_id")
+        if ok:
+            st.success(f"Extractos: {msg}")
+        else:
+            st.error(f"Extractos: {msg}")
+    st.session_state.pop("reparseo", None)
+    refresh_data()
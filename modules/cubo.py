@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from modules.data_loader import completar_filas, obtener_derivado
+
+DIMENSIONES = ["mes", "banco", "categoría", "tipo"]
+COLUMNAS = ["id", "fecha", "banco", "categoría", "tipo", "monto"]
+
+
+def preparar_movimientos(movimientos_df):
+    """
+    Normaliza las columnas usadas para agregar (mismas reglas que el dashboard y el índice).
+    Las columnas que falten cuentan como vacías.
+    """
+    movimientos_df = movimientos_df.reindex(columns=COLUMNAS)
+    df = pd.DataFrame({
+        "id": movimientos_df["id"],
+        "fecha": pd.to_datetime(movimientos_df["fecha"], errors="coerce"),
+        "banco": movimientos_df["banco"].fillna("").astype(str),
+        "categoría": movimientos_df["categoría"].fillna("Sin Categoría"),
+        "tipo": movimientos_df["tipo"].fillna("").astype(str).str.lower(),
+        "monto": pd.to_numeric(movimientos_df["monto"], errors="coerce"),
+    }, index=movimientos_df.index)
+    df["mes"] = df["fecha"].dt.strftime("%Y-%m")
+    return df
+
+
+def _agregar(df):
+    if df.empty:
+        return pd.DataFrame(columns=DIMENSIONES + ["suma", "conteo"])
+    return (
+        df.groupby(DIMENSIONES, observed=True)["monto"]
+        .agg(suma="sum", conteo="count")
+        .reset_index()
+    )
+
+
+def _sumar(cubo, delta, signo=1):
+    if delta.empty:
+        return cubo
+    delta = delta.assign(suma=delta["suma"] * signo, conteo=delta["conteo"] * signo)
+    combinado = pd.concat([cubo, delta], ignore_index=True)
+    combinado = combinado.groupby(DIMENSIONES, observed=True)[["suma", "conteo"]].sum().reset_index()
+    return combinado[combinado["conteo"] != 0].reset_index(drop=True)
+
+
+class CuboAgregado:
+    """
+    Cubo pre-agregado mes × banco × categoría × tipo con suma y conteo de `monto`.
+
+    Se construye una vez por versión de datos y se actualiza incrementalmente cuando se anexan
+    o editan filas. Las consultas trabajan sobre las celdas del cubo; solo los meses del borde
+    de un rango de fechas que no empieza/termina en límite de mes se recalculan desde las filas
+    de esos meses (localizadas por búsqueda binaria sobre las fechas ordenadas).
+    """
+
+    def __init__(self, movimientos_df):
+        self._movs = preparar_movimientos(movimientos_df).sort_values("fecha", kind="stable")
+        self.cubo = _agregar(self._movs)
+
+    def anexar(self, nuevos_df):
+        nuevos = preparar_movimientos(nuevos_df)
+        self.cubo = _sumar(self.cubo, _agregar(nuevos))
+        self._movs = pd.concat([self._movs, nuevos], ignore_index=True).sort_values("fecha", kind="stable")
+
+    def actualizar(self, antes_df, despues_df):
+        antes = preparar_movimientos(antes_df)
+        despues = preparar_movimientos(completar_filas(antes_df, despues_df))
+        self.cubo = _sumar(_sumar(self.cubo, _agregar(antes), -1), _agregar(despues))
+        restantes = self._movs[~self._movs["id"].isin(despues["id"])]
+        self._movs = pd.concat([restantes, despues], ignore_index=True).sort_values("fecha", kind="stable")
+
+    def _filas_entre(self, desde, hasta):
+        fechas = self._movs["fecha"].to_numpy()
+        inicio = np.searchsorted(fechas, np.datetime64(desde), side="left")
+        fin = np.searchsorted(fechas, np.datetime64(hasta), side="right")
+        return self._movs.iloc[inicio:fin]
+
+    def consultar(self, fecha_ini=None, fecha_fin=None, bancos=None, categorias=None, tipos=None):
+        """Celdas del cubo que cumplen los filtros. `bancos`/`categorias`/`tipos`: None = todos."""
+        cubo = self.cubo
+        if bancos is not None:
+            cubo = cubo[cubo["banco"].isin(bancos)]
+        if categorias is not None:
+            cubo = cubo[cubo["categoría"].isin(categorias)]
+        if tipos is not None:
+            cubo = cubo[cubo["tipo"].isin(tipos)]
+        if fecha_ini is None and fecha_fin is None:
+            return cubo
+
+        fecha_ini = pd.Timestamp(fecha_ini) if fecha_ini is not None else self._movs["fecha"].min()
+        fecha_fin = pd.Timestamp(fecha_fin) if fecha_fin is not None else self._movs["fecha"].max()
+        if pd.isna(fecha_ini) or pd.isna(fecha_fin) or fecha_ini > fecha_fin:
+            return cubo.iloc[0:0]
+        mes_ini, mes_fin = fecha_ini.strftime("%Y-%m"), fecha_fin.strftime("%Y-%m")
+        ini_completo = fecha_ini == fecha_ini.normalize().replace(day=1)
+        fin_completo = fecha_fin.normalize() == (fecha_fin + pd.offsets.MonthEnd(0)).normalize()
+
+        desde = mes_ini if ini_completo else _mes_siguiente(mes_ini)
+        hasta = mes_fin if fin_completo else _mes_anterior(mes_fin)
+        partes = [cubo[(cubo["mes"] >= desde) & (cubo["mes"] <= hasta)]]
+
+        # Meses del borde: se agregan solo sus filas dentro del rango
+        bordes = []
+        if not ini_completo:
+            bordes.append((fecha_ini, min(fecha_fin, fecha_ini + pd.offsets.MonthEnd(0))))
+        if not fin_completo and (ini_completo or mes_fin != mes_ini):
+            bordes.append((max(fecha_ini, fecha_fin.replace(day=1).normalize()), fecha_fin))
+        for desde_b, hasta_b in bordes:
+            filas = self._filas_entre(desde_b, hasta_b)
+            if bancos is not None:
+                filas = filas[filas["banco"].isin(bancos)]
+            if categorias is not None:
+                filas = filas[filas["categoría"].isin(categorias)]
+            if tipos is not None:
+                filas = filas[filas["tipo"].isin(tipos)]
+            partes.append(_agregar(filas))
+        partes = [p for p in partes if not p.empty]
+        if not partes:
+            return cubo.iloc[0:0]
+        return pd.concat(partes, ignore_index=True)
+
+    # --- Vistas usadas por el dashboard y los reportes ---
+
+    def totales_por_tipo(self, **filtros):
+        celdas = self.consultar(**filtros)
+        return celdas.groupby("tipo")["suma"].sum()
+
+    def por_banco_y_tipo(self, **filtros):
+        celdas = self.consultar(**filtros)
+        return celdas.groupby(["banco", "tipo"])["suma"].sum().unstack(fill_value=0)
+
+    def por_mes_y_tipo(self, **filtros):
+        celdas = self.consultar(**filtros)
+        return celdas.groupby(["mes", "tipo"])["suma"].sum().unstack(fill_value=0)
+
+    def por_categoria(self, **filtros):
+        """DataFrame indexado por categoría con Total y Cantidad, ordenado por Total."""
+        celdas = self.consultar(**filtros)
+        return (
+            celdas.groupby("categoría")[["suma", "conteo"]].sum()
+            .rename(columns={"suma": "Total", "conteo": "Cantidad"})
+            .sort_values("Total", ascending=False)
+        )
+
+
+def _mes_siguiente(mes):
+    return (pd.Period(mes, freq="M") + 1).strftime("%Y-%m")
+
+
+def _mes_anterior(mes):
+    return (pd.Period(mes, freq="M") - 1).strftime("%Y-%m")
+
+
+def get_cubo(movimientos_df):
+    """Cubo de la versión de datos actual (se construye la primera vez que se pide)."""
+    return obtener_derivado("cubo", lambda: CuboAgregado(movimientos_df))
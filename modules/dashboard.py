@@ -1,6 +1,13 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from modules.cubo import get_cubo
+from modules.indice import get_indice
+from modules.saldos import get_saldos
+from modules.busqueda import get_busqueda
+from modules.tabla import tabla_paginada
+from modules.transferencias import get_transferencias
+from modules.graficos import mostrar_grafico, plotly_barras, plotly_torta, reducir_series, selector_motor_graficos
 
 
 def render(movimientos_df, extractos_df):
@@ -13,12 +20,8 @@ def render(movimientos_df, extractos_df):
         return
 
     # --- Limpieza y preparación ---
-    movimientos_df = movimientos_df.copy()
-    movimientos_df['tipo'] = movimientos_df['tipo'].astype(str).fillna('')
-    movimientos_df['banco'] = movimientos_df['banco'].astype(str).fillna('')
-    movimientos_df['fecha'] = pd.to_datetime(movimientos_df['fecha'], errors='coerce')
-    movimientos_df['monto'] = pd.to_numeric(movimientos_df['monto'], errors='coerce')
-    movimientos_df['categoría'] = movimientos_df['categoría'].fillna('Sin Categoría')
+    # El índice normaliza y ordena los movimientos una sola vez por versión de datos
+    indice = get_indice(movimientos_df)
 
     extractos_df = extractos_df.copy()
     extractos_df['saldo_final'] = pd.to_numeric(extractos_df['saldo_final'], errors='coerce')
@@ -28,15 +31,12 @@ def render(movimientos_df, extractos_df):
 
     # --- Filtros interactivos ---
     st.sidebar.header("Filtros")
-    bancos = movimientos_df['banco'].unique().tolist()
-    bancos = [b for b in bancos if b]
-    bancos = sorted(bancos)
-    bancos.insert(0, "Todos")
+    bancos = ["Todos"] + indice.bancos
     banco_sel = st.sidebar.selectbox("Banco", bancos)
 
     # Filtro de fechas
-    fecha_min = movimientos_df['fecha'].min()
-    fecha_max = movimientos_df['fecha'].max()
+    fecha_min = indice.fecha_min
+    fecha_max = indice.fecha_max
     fecha_ini, fecha_fin = st.sidebar.date_input(
         "Rango de fechas",
         value=(fecha_min, fecha_max),
@@ -45,25 +45,35 @@ def render(movimientos_df, extractos_df):
     )
 
     # Filtro de categoría
-    categorias = sorted(movimientos_df['categoría'].unique())
-    categorias.insert(0, "Todas")
+    categorias = ["Todas"] + list(indice.categorias['categoría'])
     categoria_sel = st.sidebar.selectbox("Categoría", categorias)
+    excluir_transferencias = st.sidebar.toggle(
+        "Excluir transferencias internas", key="excluir_transferencias",
+        help="No cuenta en los totales los pares egreso/ingreso emparejados entre cuentas propias."
+    )
+    selector_motor_graficos()
 
     # --- Aplicar filtros ---
-    df = movimientos_df.copy()
+    # Los totales y resúmenes salen del cubo pre-agregado; las filas solo se usan para el detalle
+    cubo = get_cubo(movimientos_df)
+    filtros = {
+        "fecha_ini": pd.to_datetime(fecha_ini),
+        "fecha_fin": pd.to_datetime(fecha_fin),
+        "bancos": None if banco_sel == "Todos" else [banco_sel],
+        "categorias": None if categoria_sel == "Todas" else [categoria_sel],
+    }
+    df = indice.consultar(**filtros)
     if banco_sel != "Todos":
-        df = df[df['banco'] == banco_sel]
         ext_df = extractos_df[extractos_df['banco'] == banco_sel]
     else:
         ext_df = extractos_df
 
-    df = df[(df['fecha'] >= pd.to_datetime(fecha_ini)) & (df['fecha'] <= pd.to_datetime(fecha_fin))]
-    if categoria_sel != "Todas":
-        df = df[df['categoría'] == categoria_sel]
-
     # --- KPIs ---
-    total_ingresos = df[df['tipo'].str.lower() == 'ingreso']['monto'].sum()
-    total_egresos = df[df['tipo'].str.lower() == 'egreso']['monto'].sum()
+    totales = cubo.totales_por_tipo(**filtros)
+    if excluir_transferencias:
+        totales = totales.sub(get_transferencias(movimientos_df).totales_excluidos(**filtros), fill_value=0)
+    total_ingresos = totales.get('ingreso', 0)
+    total_egresos = totales.get('egreso', 0)
     balance = total_ingresos - total_egresos
     saldo_final_total = ext_df.sort_values('fecha_fin').groupby('banco')['saldo_final'].last().dropna().sum()
 
@@ -78,48 +88,56 @@ def render(movimientos_df, extractos_df):
         st.metric("Saldo Bancos (actual)", f"${saldo_final_total:,.2f}")
 
     st.caption("El saldo bancario se calcula usando el último extracto disponible de cada banco.")
+    if excluir_transferencias:
+        st.caption(f"Totales sin {len(get_transferencias(movimientos_df).pares):,} transferencias internas emparejadas.")
 
     st.divider()
     st.subheader("Distribución de Ingresos y Egresos por Banco")
 
-    resumen = df.groupby(['banco', 'tipo'])['monto'].sum().unstack(fill_value=0)
+    resumen = cubo.por_banco_y_tipo(**filtros)
     if not resumen.empty:
         col_graf, col_pie = st.columns([1,1])
         with col_graf:
-            fig, ax = plt.subplots(figsize=(3, 2))  
-            resumen.plot(kind='bar', ax=ax)
-            ax.set_ylabel("Monto ($)", fontsize=8)
-            ax.set_title("Ingresos y Egresos por Banco", fontsize=10)
-            ax.tick_params(axis='x', labelsize=7)
-            ax.tick_params(axis='y', labelsize=7)
-            ax.grid(axis='y', linestyle='--', alpha=0.7)
-            ax.set_xlabel("")  # Quitar el label del eje x
-            # Leyenda debajo del eje x
-            ax.legend(
-                title="Tipo de movimiento",
-                fontsize=7,
-                title_fontsize=8,
-                loc='lower center',
-                bbox_to_anchor=(0.5, -0.65),  # Más abajo para no tapar las letras
-                ncol=len(resumen.columns)
+            def _dibujar_bancos(ax):
+                resumen.plot(kind='bar', ax=ax)
+                ax.set_ylabel("Monto ($)", fontsize=8)
+                ax.set_title("Ingresos y Egresos por Banco", fontsize=10)
+                ax.tick_params(axis='x', labelsize=7)
+                ax.tick_params(axis='y', labelsize=7)
+                ax.grid(axis='y', linestyle='--', alpha=0.7)
+                ax.set_xlabel("")  # Quitar el label del eje x
+                # Leyenda debajo del eje x
+                ax.legend(
+                    title="Tipo de movimiento",
+                    fontsize=7,
+                    title_fontsize=8,
+                    loc='lower center',
+                    bbox_to_anchor=(0.5, -0.65),  # Más abajo para no tapar las letras
+                    ncol=len(resumen.columns)
+                )
+            mostrar_grafico(
+                "dashboard_bancos", filtros, _dibujar_bancos, figsize=(3, 2),
+                plotly=lambda: plotly_barras(resumen, "Ingresos y Egresos por Banco")
             )
-            st.pyplot(fig)
         with col_pie:
             # Pie chart de egresos por banco
-            egresos_banco = df[df['tipo'].str.lower() == 'egreso'].groupby('banco')['monto'].sum()
+            egresos_banco = resumen['egreso'] if 'egreso' in resumen.columns else pd.Series(dtype=float)
             egresos_banco = egresos_banco[egresos_banco > 0]
             if not egresos_banco.empty:
-                fig_pie, ax_pie = plt.subplots(figsize=(2.2, 2.2))
-                ax_pie.pie(
-                    egresos_banco,
-                    labels=egresos_banco.index,
-                    autopct='%1.1f%%',
-                    startangle=140,
-                    counterclock=False,
-                    textprops={'fontsize': 7}
+                def _dibujar_torta_bancos(ax):
+                    ax.pie(
+                        egresos_banco,
+                        labels=egresos_banco.index,
+                        autopct='%1.1f%%',
+                        startangle=140,
+                        counterclock=False,
+                        textprops={'fontsize': 7}
+                    )
+                    ax.set_title("Egresos por banco", fontsize=9)
+                mostrar_grafico(
+                    "dashboard_torta_bancos", filtros, _dibujar_torta_bancos, figsize=(2.2, 2.2),
+                    plotly=lambda: plotly_torta(egresos_banco, "Egresos por banco")
                 )
-                ax_pie.set_title("Egresos por banco", fontsize=9)
-                st.pyplot(fig_pie)
             else:
                 st.info("No hay egresos para mostrar por banco.")
     else:
@@ -128,12 +146,10 @@ def render(movimientos_df, extractos_df):
     st.divider()
     st.subheader("Resumen por mes (Ingresos vs Egresos)")
 
-    df["mes"] = df["fecha"].dt.strftime("%Y-%m")
-    ingresos_mes = df[df['tipo'].str.lower() == 'ingreso'].groupby('mes')['monto'].sum()
-    egresos_mes = df[df['tipo'].str.lower() == 'egreso'].groupby('mes')['monto'].sum()
+    por_mes = cubo.por_mes_y_tipo(**filtros)
     resumen_mes = pd.DataFrame({
-        "Ingresos": ingresos_mes,
-        "Egresos": egresos_mes
+        "Ingresos": por_mes['ingreso'] if 'ingreso' in por_mes.columns else pd.Series(dtype=float),
+        "Egresos": por_mes['egreso'] if 'egreso' in por_mes.columns else pd.Series(dtype=float)
     }).fillna(0)
     if not resumen_mes.empty:
         st.line_chart(resumen_mes)
@@ -147,19 +163,24 @@ def render(movimientos_df, extractos_df):
     tabla_saldos = tabla_saldos.rename(columns={"saldo_final": "Saldo Final", "fecha_fin": "Fecha Corte"})
     st.dataframe(tabla_saldos, use_container_width=True)
 
+    st.subheader("Evolución del saldo (diario)")
+    saldos = get_saldos(movimientos_df, extractos_df).consultar(
+        filtros["fecha_ini"], filtros["fecha_fin"], bancos=filtros["bancos"]
+    )
+    if not saldos.empty:
+        if banco_sel != "Todos":
+            saldos = saldos.drop(columns="Total")
+        st.line_chart(reducir_series(saldos, y="saldo", serie="banco"), x="fecha", y="saldo", color="banco")
+        st.caption("Saldo al cierre de cada día: saldo inicial de cada extracto más los movimientos acumulados.")
+    else:
+        st.info("No hay extractos con saldo inicial para calcular la evolución del saldo.")
+
     st.divider()
     st.subheader("Categorías con más gastos (Egresos)")
 
-    egresos = df[df['tipo'].str.lower() == 'egreso']
-
     if categoria_sel == "Todas":
         # ---- Gráfico de torta agrupando en "Otros" ---
-        top_cats = (
-            egresos
-            .groupby('categoría')['monto']
-            .sum()
-            .sort_values(ascending=False)
-        )
+        top_cats = cubo.por_categoria(tipos=['egreso'], **filtros)['Total']
         total = top_cats.sum()
         porcentajes = (top_cats / total) * 100
         mask_otro = porcentajes < 1.5
@@ -172,44 +193,53 @@ def render(movimientos_df, extractos_df):
         if not data_torta.empty:
             col_pie, col_bar = st.columns([1,1])
             with col_pie:
-                fig2, ax2 = plt.subplots(figsize=(2.2, 2.2))
-                ax2.pie(
-                    data_torta,
-                    labels=data_torta.index,
-                    autopct='%1.1f%%',
-                    startangle=140,
-                    counterclock=False,
-                    textprops={'fontsize': 7}
+                def _dibujar_torta_categorias(ax):
+                    ax.pie(
+                        data_torta,
+                        labels=data_torta.index,
+                        autopct='%1.1f%%',
+                        startangle=140,
+                        counterclock=False,
+                        textprops={'fontsize': 7}
+                    )
+                    ax.set_title("Distribución de egresos por categoría", fontsize=9)
+                mostrar_grafico(
+                    "dashboard_torta_categorias", filtros, _dibujar_torta_categorias, figsize=(2.2, 2.2),
+                    plotly=lambda: plotly_torta(data_torta, "Distribución de egresos por categoría")
                 )
-                ax2.set_title("Distribución de egresos por categoría", fontsize=9)
-                st.pyplot(fig2)
             with col_bar:
-                fig3, ax3 = plt.subplots(figsize=(2.2, 2.2))
                 data_bar = data_torta.sort_values(ascending=False)
-                data_bar.plot(kind='bar', ax=ax3, color='#ff6961')
-                ax3.set_ylabel("Monto ($)", fontsize=7)
-                ax3.set_xlabel("")
-                ax3.set_title("Egresos por categoría", fontsize=9)
-                ax3.tick_params(axis='x', labelsize=5, rotation=45)
-                ax3.tick_params(axis='y', labelsize=7)
-                st.pyplot(fig3)
+                def _dibujar_barras_categorias(ax):
+                    data_bar.plot(kind='bar', ax=ax, color='#ff6961')
+                    ax.set_ylabel("Monto ($)", fontsize=7)
+                    ax.set_xlabel("")
+                    ax.set_title("Egresos por categoría", fontsize=9)
+                    ax.tick_params(axis='x', labelsize=5, rotation=45)
+                    ax.tick_params(axis='y', labelsize=7)
+                mostrar_grafico(
+                    "dashboard_barras_categorias", filtros, _dibujar_barras_categorias, figsize=(2.2, 2.2),
+                    plotly=lambda: plotly_barras(data_bar, "Egresos por categoría", color='#ff6961')
+                )
         else:
             st.info("No hay suficientes egresos para mostrar el treemap.")
     else:
         # --- Mostrar resumen relevante para la categoría seleccionada ---
-        egresos_cat = df[(df['tipo'].str.lower() == 'egreso') & (df['categoría'] == categoria_sel)]
-        total_cat = egresos_cat['monto'].sum()
-        count_cat = egresos_cat.shape[0]
-        avg_cat = egresos_cat['monto'].mean() if count_cat > 0 else 0
+        egresos_cat = indice.consultar(tipos=['egreso'], **filtros)
+        resumen_cat = cubo.por_categoria(tipos=['egreso'], **filtros)
+        total_cat = resumen_cat['Total'].sum()
+        count_cat = int(resumen_cat['Cantidad'].sum())
+        avg_cat = total_cat / count_cat if count_cat > 0 else 0
 
         st.markdown(f"**Total gastado en '{categoria_sel}':** ${total_cat:,.2f}")
         st.markdown(f"**Cantidad de movimientos:** {count_cat}")
         st.markdown(f"**Gasto promedio por transacción:** ${avg_cat:,.2f}")
 
-        # Top 3 descripciones/proveedores frecuentes
+        # Top 3 proveedores (contraparte canónica) o descripciones frecuentes
         if not egresos_cat.empty:
-            if "proveedor" in egresos_cat.columns:
-                top_desc = egresos_cat['proveedor'].value_counts().head(3)
+            if "contraparte" in egresos_cat.columns:
+                # value_counts de una categórica cuenta por código e incluye las categorías sin filas
+                top_desc = egresos_cat['contraparte'].value_counts()
+                top_desc = top_desc[top_desc > 0].head(3)
                 st.markdown("**Top 3 proveedores frecuentes:**")
             else:
                 top_desc = egresos_cat['descripción'].value_counts().head(3)
@@ -221,6 +251,7 @@ def render(movimientos_df, extractos_df):
     st.divider()
 
     st.subheader("Movimientos")
-    ultimos = df.sort_values("fecha", ascending=False)
-    ultimos['monto'] = ultimos['monto'].map("${:,.2f}".format)
-    st.dataframe(ultimos[["fecha", "banco", "tipo", "descripción", "monto", "categoría"]], use_container_width=True)
+    tabla_paginada(
+        df, "dashboard_movimientos", columnas=["fecha", "banco", "tipo", "descripción", "monto", "categoría"],
+        filtros=filtros, busqueda=get_busqueda(movimientos_df)
+    )
@@ -1,12 +1,17 @@
 import streamlit as st
-from modules.sheets_utils import load_movimientos_data
+import pandas as pd
+from modules.sheets_utils import load_movimientos_data, load_hoja_opcional
+from modules.parsear import agregar_contraparte
 
 @st.cache_data(show_spinner="Cargando datos...")
 def _fetch():
     """Obtiene todos los datos requeridos desde Google Sheets."""
     return {
-        "movimientos_df": load_movimientos_data("movimientos"),
+        # Las filas anteriores a la columna "contraparte" la calculan al cargar
+        "movimientos_df": agregar_contraparte(load_movimientos_data("movimientos")),
         "extractos_df": load_movimientos_data("extractos"),
+        # Emparejamientos de transferencias internas confirmados (hoja opcional)
+        "transferencias_df": load_hoja_opcional("transferencias"),
     }
 
 def load_data():
@@ -19,4 +24,118 @@ def load_data():
 def refresh_data():
     """Borra la caché y vuelve a cargar los datos."""
     _fetch.clear()
+    st.session_state["movimientos_df"] = None
+    st.session_state["extractos_df"] = None
+    st.session_state["transferencias_df"] = None
+    _nueva_version()
+    st.session_state["_derivados"] = {}
     load_data()
+
+def data_version():
+    """Versión de los datos de la sesión: cambia cada vez que se recargan o se modifican."""
+    return st.session_state.get("data_version", 0)
+
+def _nueva_version():
+    st.session_state["data_version"] = data_version() + 1
+    return st.session_state["data_version"]
+
+def obtener_derivado(nombre, constructor):
+    """
+    Devuelve una estructura derivada de los datos (cubo, índices...) construyéndola solo una
+    vez por versión de datos. `constructor()` se llama únicamente si no existe o está obsoleta.
+    """
+    derivados = st.session_state.setdefault("_derivados", {})
+    version = data_version()
+    entrada = derivados.get(nombre)
+    if entrada is None or entrada[0] != version:
+        entrada = (version, constructor())
+        derivados[nombre] = entrada
+    return entrada[1]
+
+def derivado_vigente(nombre):
+    """El derivado `nombre` si ya está construido para la versión actual; si no, None (no lo construye)."""
+    entrada = st.session_state.get("_derivados", {}).get(nombre)
+    return entrada[1] if entrada is not None and entrada[0] == data_version() else None
+
+def descartar_derivado(nombre):
+    """Fuerza a reconstruir un derivado cuyas entradas cambiaron sin cambiar los movimientos."""
+    st.session_state.setdefault("_derivados", {}).pop(nombre, None)
+
+def _propagar(metodo, *args):
+    """
+    Avanza la versión de datos y actualiza incrementalmente los derivados que saben hacerlo
+    (método `anexar` o `actualizar`); el resto se descarta y se reconstruye al pedirlo.
+    """
+    anterior = data_version()
+    version = _nueva_version()
+    derivados = st.session_state.setdefault("_derivados", {})
+    for nombre, (v, obj) in list(derivados.items()):
+        if v == anterior and hasattr(obj, metodo):
+            getattr(obj, metodo)(*args)
+            derivados[nombre] = (version, obj)
+        else:
+            del derivados[nombre]
+
+def completar_filas(antes_df, despues_df):
+    """
+    `despues_df` con las columnas que le falten tomadas de la misma fila (por `id`) de
+    `antes_df`, para los derivados que necesitan la fila completa al actualizar.
+    """
+    faltantes = antes_df.columns.difference(despues_df.columns)
+    if faltantes.empty or "id" not in despues_df.columns:
+        return despues_df
+    previas = antes_df.drop_duplicates("id").set_index("id")
+    return despues_df.assign(**{col: despues_df["id"].map(previas[col]).to_numpy() for col in faltantes})
+
+def _concatenar_movimientos(actual, nuevos_df):
+    """pd.concat que conserva "contraparte" como categórica (concat la pasa a object si difieren las categorías)."""
+    combinado = pd.concat([actual, nuevos_df], ignore_index=True)
+    if all(isinstance(df.dtypes.get("contraparte"), pd.CategoricalDtype) for df in (actual, nuevos_df)):
+        combinado["contraparte"] = pd.api.types.union_categoricals(
+            [actual["contraparte"], nuevos_df["contraparte"]], ignore_order=True
+        )
+    return combinado
+
+def anexar_movimientos(nuevos_df):
+    """Añade filas nuevas a los movimientos de la sesión sin recargar desde Sheets."""
+    if nuevos_df is None or nuevos_df.empty:
+        return
+    nuevos_df = agregar_contraparte(nuevos_df)
+    actual = st.session_state.get("movimientos_df")
+    st.session_state["movimientos_df"] = (
+        nuevos_df.copy() if actual is None or actual.empty
+        else _concatenar_movimientos(actual, nuevos_df)
+    )
+    _propagar("anexar", nuevos_df)
+
+def actualizar_movimientos(antes_df, despues_df):
+    """Reemplaza en la sesión las filas editadas (por `id`) y actualiza los derivados."""
+    if despues_df is None or despues_df.empty:
+        return
+    if "contraparte" not in despues_df.columns:
+        despues_df = agregar_contraparte(despues_df)
+    actual = st.session_state["movimientos_df"]
+    despues = despues_df.set_index("id")
+    mask = actual["id"].isin(despues.index)
+    for col in despues.columns:
+        if col not in actual.columns:
+            actual[col] = None
+        valores = actual.loc[mask, "id"].map(despues[col])
+        if isinstance(actual[col].dtype, pd.CategoricalDtype):
+            # Una contraparte nueva tiene que existir como categoría antes de asignarla
+            nuevas = pd.Index(valores.dropna().unique()).difference(actual[col].cat.categories)
+            actual[col] = actual[col].cat.add_categories(nuevas)
+            valores = valores.astype(object)
+        actual.loc[mask, col] = valores
+    _propagar("actualizar", antes_df, despues_df)
+
+def anexar_extractos(nuevos_df):
+    """Añade extractos nuevos a la sesión."""
+    if nuevos_df is None or nuevos_df.empty:
+        return
+    actual = st.session_state.get("extractos_df")
+    st.session_state["extractos_df"] = (
+        nuevos_df.copy() if actual is None or actual.empty
+        else pd.concat([actual, nuevos_df], ignore_index=True)
+    )
+    _propagar("anexar_extractos", nuevos_df)
@@ -0,0 +1,237 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from modules.conciliacion import TOLERANCIA_CONCILIACION
+from modules.drive_utils import listar_pdfs_en_drive, obtener_o_crear_carpetas, descargar_de_drive
+from modules.pdf_parser import extract_data_from_pdf
+
+# Copia local de los PDFs de extractos (se llena al subir y al descargar de Drive)
+PDF_CACHE_DIR = Path(os.environ.get("PDF_CACHE_DIR", ".cache/extractos"))
+
+FALTANTE = "faltante"          # está en el PDF pero no en movimientos
+SOBRANTE = "sobrante"          # está en movimientos pero no en el PDF
+MONTO_DISTINTO = "monto distinto"
+
+# Bancos cuyo parser cambió la lectura de filas ya guardadas: Chase toma el tipo de la sección
+# del detalle (antes todo era ingreso) y Wise resta el movimiento más antiguo a su balance
+# para el saldo inicial (antes tomaba el balance tal cual)
+BANCOS_REPARSEO = ("Chase", "Wise USD", "Wise EUR")
+
+COLUMNAS_DIFERENCIAS = [
+    "extracto_id", "archivo_fuente", "banco", "estado", "id", "fecha", "descripción",
+    "tipo_pdf", "monto_pdf", "tipo_guardado", "monto_guardado", "diferencia",
+]
+
+
+def ruta_pdf_local(nombre):
+    return PDF_CACHE_DIR / Path(str(nombre)).name
+
+
+def guardar_pdf_local(nombre, contenido):
+    """Guarda una copia local del PDF para poder re-parsearlo sin ir a Drive."""
+    ruta = ruta_pdf_local(nombre)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ruta.with_suffix(ruta.suffix + ".tmp")
+    tmp.write_bytes(contenido)
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def obtener_pdfs(nombres):
+    """
+    Devuelve (rutas, errores): rutas es un dict nombre -> ruta local del PDF. Los que no están en
+    la caché local se buscan en la carpeta 'Extractos' de Drive y se descargan en paralelo.
+    """
+    rutas, errores = {}, {}
+    faltan = []
+    for nombre in dict.fromkeys(nombres):
+        ruta = ruta_pdf_local(nombre)
+        if ruta.exists():
+            rutas[nombre] = ruta
+        else:
+            faltan.append(nombre)
+    if not faltan:
+        return rutas, errores
+
+    folder_id = obtener_o_crear_carpetas(["Extractos"], crear=False).get("Extractos")
+    ids = {f["name"]: f["id"] for f in listar_pdfs_en_drive(folder_id)} if folder_id else {}
+    for nombre in faltan:
+        if nombre not in ids:
+            errores[nombre] = "PDF no encontrado en Drive"
+    descargas = descargar_de_drive([ids[n] for n in faltan if n in ids])
+    for nombre in faltan:
+        if nombre not in ids:
+            continue
+        ok, contenido = descargas[ids[nombre]]
+        if ok:
+            rutas[nombre] = guardar_pdf_local(nombre, contenido)
+        else:
+            errores[nombre] = contenido
+    return rutas, errores
+
+
+def _normalizar(df):
+    return pd.DataFrame({
+        "extracto_id": df["extracto_id"].astype(str),
+        "id": df["id"].astype(str),
+        "fecha": pd.to_datetime(df["fecha"], errors="coerce"),
+        "descripción": df["descripción"] if "descripción" in df.columns else None,
+        "tipo": df["tipo"].astype(str).str.lower(),
+        "monto": pd.to_numeric(df["monto"], errors="coerce"),
+    })
+
+
+def movimientos_en_extractos(extractos_df, movimientos_df):
+    """
+    Movimientos guardados que caen en el período de cada extracto (mismo banco, fechas inclusive),
+    con la columna `extracto_id` del extracto. Usa las fechas ordenadas por banco y búsqueda
+    binaria, como la conciliación.
+    """
+    movs = movimientos_df.assign(fecha=pd.to_datetime(movimientos_df["fecha"], errors="coerce"))
+    movs = movs.dropna(subset=["fecha"]).sort_values(["banco", "fecha"], kind="stable")
+    ext = extractos_df.assign(
+        fecha_inicio=pd.to_datetime(extractos_df["fecha_inicio"], errors="coerce"),
+        fecha_fin=pd.to_datetime(extractos_df["fecha_fin"], errors="coerce"),
+    ).dropna(subset=["fecha_inicio", "fecha_fin"])
+
+    posiciones, etiquetas = [], []
+    grupos = movs.groupby("banco", sort=False).indices
+    for banco, ext_banco in ext.groupby("banco", sort=False):
+        filas = grupos.get(banco)
+        if filas is None:
+            continue
+        fechas = movs["fecha"].to_numpy()[filas]
+        ini = np.searchsorted(fechas, ext_banco["fecha_inicio"].to_numpy(), side="left")
+        fin = np.searchsorted(fechas, ext_banco["fecha_fin"].to_numpy(), side="right")
+        for extracto_id, i, j in zip(ext_banco["extracto_id"], ini, fin):
+            posiciones.append(filas[i:j])
+            etiquetas.append(np.full(max(j - i, 0), extracto_id, dtype=object))
+    if not posiciones:
+        return movs.iloc[0:0].assign(extracto_id=pd.Series(dtype=object))
+    return movs.iloc[np.concatenate(posiciones)].assign(extracto_id=np.concatenate(etiquetas))
+
+
+def diferencias_movimientos(pdf_df, guardados_df, tolerancia=TOLERANCIA_CONCILIACION):
+    """
+    Anti-join vectorizado por (extracto_id, id) entre los movimientos del PDF y los guardados.
+    Los ids repetidos dentro de un extracto (mismo día, concepto e importe) se emparejan por
+    orden de aparición. Devuelve solo las filas faltantes, sobrantes o con monto/tipo distinto.
+    """
+    pdf = _normalizar(pdf_df)
+    guardados = _normalizar(guardados_df)
+    for df in (pdf, guardados):
+        df["ocurrencia"] = df.groupby(["extracto_id", "id"]).cumcount()
+
+    cruce = pdf.merge(
+        guardados, on=["extracto_id", "id", "ocurrencia"], how="outer",
+        suffixes=("_pdf", "_guardado"), indicator=True
+    )
+    signo_pdf = np.where(cruce["tipo_pdf"] == "ingreso", 1.0, -1.0)
+    signo_guardado = np.where(cruce["tipo_guardado"] == "ingreso", 1.0, -1.0)
+    cruce["diferencia"] = (
+        cruce["monto_pdf"].fillna(0) * signo_pdf - cruce["monto_guardado"].fillna(0) * signo_guardado
+    )
+    cruce["estado"] = np.select(
+        [cruce["_merge"] == "left_only", cruce["_merge"] == "right_only", cruce["diferencia"].abs() >= tolerancia],
+        [FALTANTE, SOBRANTE, MONTO_DISTINTO],
+        default="",
+    )
+    cruce = cruce[cruce["estado"] != ""]
+    return cruce.assign(
+        fecha=cruce["fecha_pdf"].fillna(cruce["fecha_guardado"]),
+        descripción=cruce["descripción_pdf"].fillna(cruce["descripción_guardado"]),
+    )
+
+
+def _reparsear(extractos_df, on_progreso=None):
+    """
+    Re-parsea el PDF de cada extracto. Devuelve (parseados, errores): parseados es un dict
+    extracto_id -> (df_movimientos, df_extractos) y errores un dict archivo -> error.
+    """
+    rutas, errores = obtener_pdfs(extractos_df["archivo_fuente"].astype(str).tolist())
+    parseados = {}
+    for hechos, (_, ext) in enumerate(extractos_df.iterrows(), start=1):
+        nombre = str(ext["archivo_fuente"])
+        if nombre in rutas:
+            df_mov, df_ext, _, _ = extract_data_from_pdf(str(rutas[nombre]), filename=nombre)
+            if df_mov is None:
+                errores[nombre] = "banco no reconocido al re-parsear"
+            else:
+                parseados[ext["extracto_id"]] = (df_mov.assign(extracto_id=ext["extracto_id"]), df_ext)
+        if on_progreso:
+            on_progreso(hechos, len(extractos_df), nombre)
+    return parseados, errores
+
+
+def _cruzar_reparseo(extractos_df, movimientos_df, parseados, errores):
+    # Solo se comparan los extractos que se pudieron re-parsear
+    comparables = extractos_df[~extractos_df["archivo_fuente"].astype(str).isin(errores)]
+    guardados = movimientos_en_extractos(comparables, movimientos_df)
+    movimientos = [df_mov for df_mov, _ in parseados.values() if not df_mov.empty]
+    pdf = pd.concat(movimientos, ignore_index=True) if movimientos else guardados.iloc[0:0]
+    return diferencias_movimientos(pdf, guardados)
+
+
+def diferencias_extractos(extractos_df, movimientos_df, on_progreso=None):
+    """
+    Re-parsea el PDF de cada extracto y lo compara con los movimientos guardados en su período.
+    `on_progreso(hechos, total, nombre)` se llama tras parsear cada PDF.
+    Devuelve (diferencias, errores): DataFrame con COLUMNAS_DIFERENCIAS y dict archivo -> error.
+    """
+    extractos_df = extractos_df.dropna(subset=["archivo_fuente"])
+    parseados, errores = _reparsear(extractos_df, on_progreso)
+    cruce = _cruzar_reparseo(extractos_df, movimientos_df, parseados, errores)
+
+    info = extractos_df.drop_duplicates("extracto_id").set_index("extracto_id")
+    cruce["archivo_fuente"] = cruce["extracto_id"].map(info["archivo_fuente"])
+    cruce["banco"] = cruce["extracto_id"].map(info["banco"])
+    diferencias = cruce[COLUMNAS_DIFERENCIAS].sort_values(["archivo_fuente", "fecha", "estado"], kind="stable")
+    return diferencias.reset_index(drop=True), errores
+
+
+def correcciones_reparseo(extractos_df, movimientos_df, bancos=BANCOS_REPARSEO, on_progreso=None,
+                          tolerancia=TOLERANCIA_CONCILIACION):
+    """
+    Migración de los extractos guardados con los parsers anteriores de `bancos`: re-parsea sus
+    PDFs y devuelve (tipos, saldos, errores).
+    - tipos: movimientos guardados con el mismo id y monto que en el PDF pero otro tipo
+      (columnas extracto_id, id, fecha, descripción, monto, tipo_guardado, tipo_pdf).
+    - saldos: extractos cuyo saldo inicial cambió (extracto_id, archivo_fuente, banco,
+      saldo_inicial_guardado, saldo_inicial_pdf). El extracto_id guardado se conserva aunque
+      incluya el saldo anterior, para no desenganchar sus movimientos.
+    """
+    extractos_df = extractos_df[extractos_df["banco"].isin(bancos)].dropna(subset=["archivo_fuente"])
+    parseados, errores = _reparsear(extractos_df, on_progreso)
+    cruce = _cruzar_reparseo(extractos_df, movimientos_df, parseados, errores)
+
+    solo_tipo = (
+        (cruce["estado"] == MONTO_DISTINTO)
+        & ((cruce["monto_pdf"] - cruce["monto_guardado"]).abs() < tolerancia)
+        & (cruce["tipo_pdf"] != cruce["tipo_guardado"])
+    )
+    tipos = (
+        cruce.loc[solo_tipo, ["extracto_id", "id", "fecha", "descripción", "monto_guardado", "tipo_guardado", "tipo_pdf"]]
+        .rename(columns={"monto_guardado": "monto"})
+        .reset_index(drop=True)
+    )
+
+    guardados = extractos_df.drop_duplicates("extracto_id").set_index("extracto_id")
+    filas = []
+    for extracto_id, (_, df_ext) in parseados.items():
+        nuevo = pd.to_numeric(df_ext["saldo_inicial"], errors="coerce").iloc[0] if not df_ext.empty else np.nan
+        anterior = pd.to_numeric(pd.Series([guardados.at[extracto_id, "saldo_inicial"]]), errors="coerce").iloc[0]
+        if pd.notna(nuevo) and not (pd.notna(anterior) and abs(nuevo - anterior) < tolerancia):
+            filas.append({
+                "extracto_id": extracto_id,
+                "archivo_fuente": guardados.at[extracto_id, "archivo_fuente"],
+                "banco": guardados.at[extracto_id, "banco"],
+                "saldo_inicial_guardado": anterior,
+                "saldo_inicial_pdf": nuevo,
+            })
+    saldos = pd.DataFrame(
+        filas, columns=["extracto_id", "archivo_fuente", "banco", "saldo_inicial_guardado", "saldo_inicial_pdf"]
+    )
+    return tipos, saldos, errores
@@ -1,15 +1,35 @@
 import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httplib2
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 import streamlit as st
 
 from modules.auth import get_credentials
+from modules.metricas import instrumentado
+
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+# Drive exige que el tamaño de chunk sea múltiplo de 256 KB
+UPLOAD_CHUNKSIZE = 4 * 1024 * 1024
+UPLOAD_MAX_WORKERS = 6
+UPLOAD_REINTENTOS = 5
+# Límite de llamadas por petición batch de la API de Drive
+BATCH_MAX = 100
+# Estados HTTP de una sub-petición batch que se reintentan (cuota, límite de tasa, errores del servidor)
+ESTADOS_REINTENTABLES = {403, 429, 500, 502, 503, 504}
+# Un 403 solo se reintenta si es por límite de tasa: sin permisos, reintentar no cambia nada
+RAZONES_403_REINTENTABLES = {"rateLimitExceeded", "userRateLimitExceeded"}
 
 @st.cache_resource
 def get_google_drive_service():
     try:
-        scopes = ["https://www.googleapis.com/auth/drive"]
-        creds = get_credentials(scopes)
+        creds = get_credentials(DRIVE_SCOPES)
         if creds:
             service = build("drive", "v3", credentials=creds)
             return service
@@ -19,6 +39,7 @@ def get_google_drive_service():
         st.error(f"Error al conectar con Google Drive: {e}")
         return None
 
+@instrumentado("drive")
 def crear_carpeta_en_drive(nombre_carpeta, parent_id=None):
     """Crea una carpeta en Google Drive y retorna su ID."""
     try:
@@ -27,7 +48,7 @@ def crear_carpeta_en_drive(nombre_carpeta, parent_id=None):
             return False, "Servicio de Drive no disponible"
         file_metadata = {
             'name': nombre_carpeta,
-            'mimeType': 'application/vnd.google-apps.folder'
+            'mimeType': FOLDER_MIMETYPE
         }
         if parent_id:
             file_metadata['parents'] = [parent_id]
@@ -39,6 +60,7 @@ def crear_carpeta_en_drive(nombre_carpeta, parent_id=None):
         return False, str(e)
 
 
+@instrumentado("drive")
 def subir_a_drive(nombre_archivo, contenido_bytes, mimetype, folder_id=None):
     try:
         drive_service = get_google_drive_service()
@@ -61,7 +83,253 @@ def subir_a_drive(nombre_archivo, contenido_bytes, mimetype, folder_id=None):
         return False, str(e)
 
 
+def _escapar_query(valor):
+    """Escapa un valor para usarlo entre comillas simples en una query de Drive."""
+    return str(valor).replace("\\", "\\\\").replace("'", "\\'")
+
+
+def _razones(error):
+    """Motivos ("reason") del cuerpo JSON de un HttpError de la API de Drive."""
+    try:
+        detalle = json.loads(error.content.decode("utf-8"))["error"]
+        return {e.get("reason") for e in detalle.get("errors", [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def _reintentable(error):
+    if isinstance(error, HttpError):
+        if error.resp.status == 403:
+            return bool(_razones(error) & RAZONES_403_REINTENTABLES)
+        return error.resp.status in ESTADOS_REINTENTABLES
+    # Fallo de transporte del batch entero (timeout, conexión cortada)
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+def _ejecutar_en_batch(drive_service, peticiones, reintentos=0):
+    """
+    Ejecuta una lista de peticiones de la API agrupadas en peticiones batch HTTP.
+    Devuelve una lista (respuesta, error) en el mismo orden que `peticiones`.
+    Con `reintentos`, las sub-peticiones que fallan con un error transitorio (403 por límite de
+    tasa, 429, 5xx, fallo de red) se vuelven a mandar en otro batch, con espera exponencial.
+    Si falla el batch entero, el error queda en cada sub-petición que no llegó a responder.
+    """
+    resultados = [(None, None)] * len(peticiones)
+
+    def _callback(request_id, response, exception):
+        resultados[int(request_id)] = (response, exception)
+
+    pendientes = list(range(len(peticiones)))
+    for intento in range(reintentos + 1):
+        if intento:
+            time.sleep(min(2 ** intento, 16))
+        for inicio in range(0, len(pendientes), BATCH_MAX):
+            tramo = pendientes[inicio:inicio + BATCH_MAX]
+            batch = drive_service.new_batch_http_request(callback=_callback)
+            for i in tramo:
+                resultados[i] = (None, None)
+                batch.add(peticiones[i], request_id=str(i))
+            try:
+                batch.execute()
+            except Exception as e:
+                for i in tramo:
+                    if resultados[i] == (None, None):
+                        resultados[i] = (None, e)
+        pendientes = [i for i in pendientes if _reintentable(resultados[i][1])]
+        if not pendientes:
+            break
+    return resultados
+
+
+@instrumentado("drive")
+def obtener_o_crear_carpetas(nombres, parent_id=None, crear=True):
+    """
+    Busca varias carpetas por nombre dentro de `parent_id` y crea las que falten.
+    Las búsquedas y las creaciones se agrupan en peticiones batch (una ida y vuelta
+    por cada grupo en lugar de una por carpeta).
+    Devuelve un dict nombre -> folder_id (solo con las carpetas encontradas o creadas).
+    """
+    drive_service = get_google_drive_service()
+    if not drive_service or not nombres:
+        return {}
+    parent_id = parent_id or st.secrets["google"]["drive_folder_id"]
+    nombres = list(dict.fromkeys(nombres))
+
+    busquedas = [
+        drive_service.files().list(
+            q=f"'{parent_id}' in parents and mimeType='{FOLDER_MIMETYPE}' "
+              f"and name='{_escapar_query(nombre)}' and trashed=false",
+            fields="files(id, name)"
+        )
+        for nombre in nombres
+    ]
+    carpetas, sin_verificar = {}, set()
+    for nombre, (response, error) in zip(nombres, _ejecutar_en_batch(drive_service, busquedas, UPLOAD_REINTENTOS)):
+        if error is not None:
+            # Si no se pudo buscar, crearla podría duplicar una carpeta existente
+            sin_verificar.add(nombre)
+        elif response and response.get("files"):
+            carpetas[nombre] = response["files"][0]["id"]
+
+    faltantes = [n for n in nombres if n not in carpetas and n not in sin_verificar]
+    if crear and faltantes:
+        creaciones = [
+            drive_service.files().create(
+                body={"name": nombre, "mimeType": FOLDER_MIMETYPE, "parents": [parent_id]},
+                fields="id"
+            )
+            for nombre in faltantes
+        ]
+        for nombre, (response, error) in zip(faltantes, _ejecutar_en_batch(drive_service, creaciones)):
+            if error is None and response:
+                carpetas[nombre] = response.get("id")
+    return carpetas
+
+
+@instrumentado("drive")
+def archivos_existentes_en_drive(nombres, folder_id):
+    """
+    Comprueba en una sola petición batch qué nombres de archivo ya existen en la carpeta.
+    A diferencia de listar la carpeta completa, no depende de la paginación de `files.list`.
+    Devuelve (existentes, sin_verificar): los nombres cuya búsqueda siguió fallando después
+    de los reintentos no se dan por inexistentes, para no subir un duplicado.
+    """
+    drive_service = get_google_drive_service()
+    if not drive_service or not nombres or not folder_id:
+        return set(), set()
+    nombres = list(dict.fromkeys(nombres))
+    busquedas = [
+        drive_service.files().list(
+            q=f"'{folder_id}' in parents and name='{_escapar_query(nombre)}' and trashed=false",
+            fields="files(id)",
+            pageSize=1
+        )
+        for nombre in nombres
+    ]
+    existentes, sin_verificar = set(), set()
+    for nombre, (response, error) in zip(nombres, _ejecutar_en_batch(drive_service, busquedas, UPLOAD_REINTENTOS)):
+        if error is not None:
+            sin_verificar.add(nombre)
+        elif response and response.get("files"):
+            existentes.add(nombre)
+    return existentes, sin_verificar
+
+
+class GestorSubidasDrive:
+    """
+    Sube archivos a Drive en un pool de hilos acotado usando subidas resumibles por chunks.
+
+    Si la conexión falla a mitad de un archivo, la subida se reanuda desde el último
+    chunk confirmado en lugar de reenviar el PDF completo. El progreso de cada archivo
+    queda en `self.progreso` (0.0 - 1.0) para que la página lo muestre.
+    """
+
+    def __init__(self, max_workers=UPLOAD_MAX_WORKERS, chunksize=UPLOAD_CHUNKSIZE):
+        # Las credenciales se obtienen en el hilo de Streamlit; los hilos del pool no tienen contexto
+        self._creds = get_credentials(DRIVE_SCOPES)
+        self._max_workers = max_workers
+        self._chunksize = chunksize
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futuros = {}
+        self.progreso = {}
+
+    def _servicio(self):
+        # httplib2 no es thread-safe: cada hilo del pool usa su propio cliente de Drive
+        servicio = getattr(self._local, "drive_service", None)
+        if servicio is None:
+            servicio = build("drive", "v3", credentials=self._creds, cache_discovery=False)
+            self._local.drive_service = servicio
+        return servicio
+
+    def _actualizar_progreso(self, nombre, valor):
+        with self._lock:
+            self.progreso[nombre] = valor
+
+    @instrumentado("drive")
+    def _subir(self, nombre_archivo, contenido_bytes, mimetype, folder_id):
+        media = MediaIoBaseUpload(
+            io.BytesIO(contenido_bytes), mimetype=mimetype,
+            chunksize=self._chunksize, resumable=True
+        )
+        request = self._servicio().files().create(
+            body={"name": nombre_archivo, "parents": [folder_id]},
+            media_body=media,
+            fields="id"
+        )
+        response = None
+        intentos = 0
+        while response is None:
+            try:
+                # next_chunk reintenta errores 5xx/red y mantiene la sesión resumible
+                status, response = request.next_chunk(num_retries=UPLOAD_REINTENTOS)
+            except Exception:
+                intentos += 1
+                if intentos > UPLOAD_REINTENTOS:
+                    raise
+                time.sleep(min(2 ** intentos, 30))
+                continue
+            if status:
+                self._actualizar_progreso(nombre_archivo, status.progress())
+        self._actualizar_progreso(nombre_archivo, 1.0)
+        return response.get("id")
+
+    def iniciar(self, archivos, folder_id=None):
+        """
+        Encola las subidas sin bloquear. `archivos` es una lista de tuplas
+        (nombre_archivo, contenido_bytes, mimetype).
+        """
+        folder_id = folder_id or st.secrets["google"]["drive_folder_id"]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="drive-upload")
+        for nombre_archivo, contenido_bytes, mimetype in archivos:
+            self.progreso[nombre_archivo] = 0.0
+            futuro = self._executor.submit(self._subir, nombre_archivo, contenido_bytes, mimetype, folder_id)
+            self._futuros[futuro] = nombre_archivo
+
+    @instrumentado("drive")
+    def esperar(self, on_progreso=None, intervalo=0.25):
+        """
+        Espera a que terminen todas las subidas encoladas.
+        `on_progreso(progreso)` se llama desde el hilo que espera (el de Streamlit) con una copia
+        del dict de progreso. Devuelve un dict nombre -> (ok, file_id o mensaje de error).
+        """
+        resultados = {}
+        pendientes = set(self._futuros)
+        while pendientes:
+            hechos, pendientes = wait(pendientes, timeout=intervalo, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                nombre = self._futuros[futuro]
+                try:
+                    resultados[nombre] = (True, futuro.result())
+                except Exception as e:
+                    resultados[nombre] = (False, str(e))
+            if on_progreso:
+                with self._lock:
+                    on_progreso(dict(self.progreso))
+        self._futuros = {}
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        return resultados
+
+
+def barras_progreso_subida(nombres):
+    """Crea una barra de progreso por archivo y devuelve el callback que las actualiza."""
+    barras = {nombre: st.progress(0.0, text=f"☁️ {nombre}") for nombre in nombres}
+
+    def _on_progreso(progreso):
+        for nombre, valor in progreso.items():
+            if nombre in barras:
+                estado = "✅" if valor >= 1.0 else "☁️"
+                barras[nombre].progress(min(float(valor), 1.0), text=f"{estado} {nombre}")
+
+    return _on_progreso
+
+
 # Nueva función: listar archivos PDF en la carpeta de Drive
+@instrumentado("drive")
 def listar_pdfs_en_drive(folder_id=None):
     """Devuelve una lista de archivos PDF en la carpeta de Drive configurada."""
     try:
@@ -70,9 +338,51 @@ def listar_pdfs_en_drive(folder_id=None):
             return []
         folder_id = folder_id or st.secrets["google"]["drive_folder_id"]
         query = f"'{folder_id}' in parents and mimeType='application/pdf' and trashed=false"
-        results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-        return files
+        files = []
+        page_token = None
+        # files.list devuelve como máximo una página: hay que seguir nextPageToken
+        while True:
+            results = drive_service.files().list(
+                q=query, fields="nextPageToken, files(id, name)", pageSize=1000, pageToken=page_token
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
     except Exception as e:
         st.error(f"Error al listar PDFs en Drive: {e}")
         return []
+
+
+@instrumentado("drive")
+def descargar_de_drive(file_ids, max_workers=UPLOAD_MAX_WORKERS):
+    """
+    Descarga varios archivos de Drive en paralelo.
+    Devuelve un dict file_id -> (ok, bytes o mensaje de error).
+    """
+    if not file_ids:
+        return {}
+    creds = get_credentials(DRIVE_SCOPES)
+    local = threading.local()
+
+    def _descargar(file_id):
+        servicio = getattr(local, "drive_service", None)
+        if servicio is None:
+            servicio = build("drive", "v3", credentials=creds, cache_discovery=False)
+            local.drive_service = servicio
+        buffer = io.BytesIO()
+        descarga = MediaIoBaseDownload(buffer, servicio.files().get_media(fileId=file_id), chunksize=UPLOAD_CHUNKSIZE)
+        terminado = False
+        while not terminado:
+            _, terminado = descarga.next_chunk(num_retries=UPLOAD_REINTENTOS)
+        return buffer.getvalue()
+
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="drive-download") as executor:
+        futuros = {executor.submit(_descargar, file_id): file_id for file_id in dict.fromkeys(file_ids)}
+        for futuro, file_id in futuros.items():
+            try:
+                resultados[file_id] = (True, futuro.result())
+            except Exception as e:
+                resultados[file_id] = (False, str(e))
+    return resultados
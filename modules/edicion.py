@@ -1,9 +1,81 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
+import time
+
+from modules.sheets_utils import actualizar_celdas, COLUMNA_VERSION
+from modules.data_loader import actualizar_movimientos
+from modules.parsear import normalizar_contraparte
+from modules.busqueda import get_busqueda
+from modules.historial import get_historial, registrar_eventos, eventos_edicion, get_compactador
+from modules.tabla import tabla_paginada
+
+TIPOS = ["ingreso", "egreso"]
+COLUMNAS_FORMULARIO = ["fecha", "banco", "monto", "tipo", "descripción", "categoría", "extracto_id", "origen_dato"]
+# Columnas editables en la grilla de edición masiva
+COLUMNAS_EDITABLES = ["banco", "monto", "tipo", "descripción", "categoría"]
+MODOS = ["Un movimiento", "Edición masiva"]
+
+
+def _iguales(col, antes, despues):
+    """Máscara de celdas sin cambios: montos como números y fechas como fechas (nulo == nulo)."""
+    antes, despues = pd.Series(antes.to_numpy()), pd.Series(despues.to_numpy())
+    if col == "monto":
+        return np.isclose(pd.to_numeric(antes, errors="coerce"), pd.to_numeric(despues, errors="coerce"), equal_nan=True)
+    if col == "fecha":
+        antes, despues = pd.to_datetime(antes, errors="coerce"), pd.to_datetime(despues, errors="coerce")
+        return ((antes == despues) | (antes.isna() & despues.isna())).to_numpy()
+    return (antes.fillna("").astype(str) == despues.fillna("").astype(str)).to_numpy()
+
+
+def diferencias(antes_df, despues_df, columnas):
+    """
+    Celdas cambiadas entre dos versiones de las mismas filas (en el mismo orden) como
+    {id: {columna: valor}}. Cada fila cambiada lleva además editado_por/fecha_edicion y, si
+    cambió la descripción, su nueva contraparte.
+    """
+    cambios = {}
+    ids = despues_df["id"].to_numpy()
+    for col in columnas:
+        distintas = np.flatnonzero(~_iguales(col, antes_df[col], despues_df[col]))
+        valores = despues_df[col].to_numpy()
+        for i in distintas:
+            cambios.setdefault(ids[i], {})[col] = valores[i]
+    sello = {
+        "editado_por": st.session_state.get("username", "anon"),
+        "fecha_edicion": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    for valores in cambios.values():
+        if "descripción" in valores:
+            valores["contraparte"] = normalizar_contraparte(valores["descripción"])
+        valores.update(sello)
+    return cambios
+
+
+def guardar_ediciones(antes_df, despues_df, columnas):
+    """
+    Guarda en Sheets solo las celdas cambiadas (un único batch_update) y actualiza la sesión
+    con las filas editadas completas. Si otra sesión modificó alguna de las filas desde que se
+    cargaron (su versión cambió), no se guarda nada y el mensaje lo indica.
+    """
+    cambios = diferencias(antes_df, despues_df, columnas)
+    if not cambios:
+        return True, "No hay cambios para guardar."
+    leidas = antes_df[COLUMNA_VERSION] if COLUMNA_VERSION in antes_df.columns else pd.Series(0, index=antes_df.index)
+    versiones = {i: v for i, v in zip(antes_df["id"], leidas) if i in cambios}
+    ok, msg = actualizar_celdas(cambios, versiones=versiones)
+    if ok:
+        editadas = despues_df["id"].isin(list(cambios)).to_numpy()
+        antes = antes_df[editadas]
+        # Filas completas (con las columnas no editables) y los cambios encima
+        despues = pd.DataFrame([{**fila, **cambios[fila["id"]]} for fila in antes.to_dict("records")])
+        actualizar_movimientos(antes, despues)
+        ok_log, msg_log = registrar_eventos(eventos_edicion(antes, cambios))
+        if not ok_log:
+            st.warning(f"Los cambios se guardaron pero no quedaron en el historial: {msg_log}")
+    return ok, msg
 
-from gspread_dataframe import set_with_dataframe
-from modules.sheets_utils import get_google_sheets_client
 
 def render(movimientos_df):
     st.title("📝 Edición Manual de Movimientos")
@@ -19,28 +91,35 @@ def render(movimientos_df):
     categorias = ["todas"] + sorted(movimientos_df["categoría"].dropna().unique())
     filtro_categoria = st.selectbox("Filtrar por categoría", categorias, index=0)
 
-    df_edit = movimientos_df.copy()
+    # Índice por posición en movimientos_df (sin copiar): lo necesita la búsqueda de texto
+    df_edit = movimientos_df.set_axis(pd.RangeIndex(len(movimientos_df)), copy=False)
     if filtro_tipo != "todos":
         df_edit = df_edit[df_edit["tipo"].str.lower() == filtro_tipo.lower()]
     if filtro_categoria != "todas":
         df_edit = df_edit[df_edit["categoría"].str.lower() == filtro_categoria.lower()]
 
-    st.dataframe(df_edit, use_container_width=True)
+    filtros = {"tipo": filtro_tipo, "categoria": filtro_categoria}
+    modo = st.radio("Modo", MODOS, horizontal=True, key="edicion_modo")
+    if modo == MODOS[1]:
+        _edicion_masiva(df_edit, filtros, get_busqueda(movimientos_df))
+        return
+
+    pagina = tabla_paginada(df_edit, "edicion", filtros=filtros, busqueda=get_busqueda(movimientos_df))
     st.markdown("---")
-    st.write("Selecciona un movimiento para editar:")
+    st.write("Selecciona un movimiento de la página visible para editar (usa la búsqueda para encontrarlo):")
 
-    if df_edit.empty:
+    if pagina.empty:
         st.info("No hay movimientos para editar con estos filtros.")
         return
 
-    selected = st.selectbox("ID de movimiento", df_edit["id"].tolist())
+    selected = st.selectbox("ID de movimiento", pagina["id"].tolist())
     if selected:
         row = df_edit[df_edit["id"] == selected].iloc[0]
         with st.form("form_edicion_manual"):
             fecha = st.date_input("Fecha", pd.to_datetime(row["fecha"]))
             banco = st.text_input("Banco", row["banco"])
             monto = st.number_input("Monto", value=float(row["monto"]), step=0.01)
-            tipo = st.selectbox("Tipo", ["ingreso", "egreso"], index=["ingreso", "egreso"].index(row["tipo"]))
+            tipo = st.selectbox("Tipo", TIPOS, index=TIPOS.index(row["tipo"]))
             descripcion = st.text_input("Descripción", row["descripción"])
             categoria = st.text_input("Categoría", row["categoría"])
             extracto_id = st.text_input("Extracto ID", row["extracto_id"])
@@ -58,22 +137,76 @@ def render(movimientos_df):
                 "categoría": categoria,
                 "extracto_id": extracto_id,
                 "origen_dato": origen_dato,
-                "editado_por": st.session_state.get("username", "anon"),
-                "fecha_edicion": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-
-            # Actualizar en Google Sheets (nombre de hoja: "movimientos")
-            gc = get_google_sheets_client()
-            sheet_id = st.secrets["google"]["spreadsheet_id"]
-            sh = gc.open_by_key(sheet_id)
-            worksheet = sh.worksheet("movimientos")
-            df_all = pd.DataFrame(worksheet.get_all_records())
-            idx = df_all[df_all["id"] == row["id"]].index
-            if not idx.empty:
-                for col in data_edit:
-                    df_all.at[idx[0], col] = data_edit[col]
-                set_with_dataframe(worksheet, df_all)
-                st.success("¡Movimiento actualizado!")
+            ok, msg = guardar_ediciones(pd.DataFrame([row]), pd.DataFrame([data_edit]), COLUMNAS_FORMULARIO)
+            if ok:
+                st.success(f"¡Movimiento actualizado! {msg}")
             else:
-                st.error("No se encontró el movimiento para actualizar.")
+                st.error(msg)
+
+        # Un toggle y no un expander: el log solo se carga de Sheets si se pide
+        if st.toggle("🕓 Ver historial del movimiento", key="edicion_historial"):
+            _historial_movimiento(row["id"], movimientos_df)
+
 
+def _historial_movimiento(id_mov, movimientos_df):
+    """Eventos del movimiento (alta, ediciones) y cómo estaba en una fecha dada."""
+    historial = get_historial()
+    eventos = historial.eventos_de(id_mov)
+    if eventos.empty:
+        st.caption("Sin cambios registrados para este movimiento.")
+    else:
+        st.dataframe(
+            eventos[["fecha_evento", "tipo_evento", "usuario", "valores", "anteriores"]],
+            hide_index=True, use_container_width=True
+        )
+    fecha = st.date_input("Ver cómo estaba el", datetime.date.today(), key="historial_fecha")
+    fila = historial.fila_en(id_mov, pd.Timestamp(fecha) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1), movimientos_df)
+    if fila is None:
+        st.caption("El movimiento todavía no existía en esa fecha.")
+    else:
+        st.dataframe(fila.to_frame("valor").astype(str), use_container_width=True)
+    if st.session_state.get("role") == "admin":
+        compactador = get_compactador()
+        st.caption(f"{historial.eventos_desde_snapshot():,} eventos desde el último snapshot.")
+        if compactador.ultimo_resultado is not None:
+            fecha, msg = compactador.ultimo_resultado
+            st.caption(f"Última compactación ({fecha:%d/%m %H:%M}): {msg}")
+        if compactador.ultimo_error is not None:
+            fecha, msg = compactador.ultimo_error
+            espera = max(0, int(compactador.reintentar_desde - time.time()))
+            st.error(
+                f"La compactación falló ({fecha:%d/%m %H:%M}, {compactador.fallos} seguidas): {msg}. "
+                f"La automática se reintenta en {espera // 60} min."
+            )
+        if compactador.en_curso:
+            st.info("Compactando el historial en segundo plano…")
+        elif st.button("🗜️ Compactar historial", key="historial_compactar"):
+            compactador.pedir(st.session_state.get("username", "anon"), forzar=True)
+            st.info("Compactación iniciada en segundo plano; el resultado aparece aquí al volver a cargar.")
+
+
+def _edicion_masiva(df_edit, filtros, busqueda):
+    """
+    Grilla editable sobre la página visible (hasta 250 filas). Al guardar se comparan las
+    celdas con las originales y solo las cambiadas van a Sheets, en una sola escritura.
+    """
+    st.caption("Edita las celdas directamente; los cambios de la página se guardan juntos.")
+    pagina = tabla_paginada(
+        df_edit, "edicion_masiva", filtros=filtros, busqueda=busqueda, filas_por_pagina=100,
+        editable=COLUMNAS_EDITABLES,
+        column_config={"tipo": st.column_config.SelectboxColumn("tipo", options=TIPOS, required=True)},
+    )
+    if pagina.empty:
+        st.info("No hay movimientos para editar con estos filtros.")
+        return
+    original = df_edit.loc[pagina.index, pagina.columns]
+    cambios = diferencias(original, pagina, COLUMNAS_EDITABLES)
+    celdas = sum(len([c for c in valores if c in COLUMNAS_EDITABLES]) for valores in cambios.values())
+    st.caption(f"{celdas} celdas modificadas en {len(cambios)} movimientos.")
+    if st.button(f"💾 Guardar cambios ({len(cambios)})", disabled=not cambios, key="edicion_masiva_guardar"):
+        ok, msg = guardar_ediciones(original, pagina, COLUMNAS_EDITABLES)
+        if ok:
+            st.success(msg)
+        else:
+            st.error(msg)
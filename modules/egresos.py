@@ -2,13 +2,18 @@ import streamlit as st
 import pandas as pd
 import datetime
 from modules.sheets_utils import save_to_unificada
+from modules.data_loader import anexar_movimientos
+from modules.historial import registrar_eventos, eventos_alta
+from modules.indice import get_indice
+from modules.busqueda import get_busqueda
+from modules.tabla import tabla_paginada
+from modules.exportar import descarga_bajo_demanda, generar_archivo, escribir_csv
 
 def render(movimientos_df):
     st.title("💸 Registro de Egresos")
     st.caption("Visualiza y filtra los egresos registrados en la base de datos unificada.")
 
-    movimientos_df["tipo"] = movimientos_df["tipo"].astype(str).fillna("")
-    egresos_df = movimientos_df[movimientos_df["tipo"].str.lower() == "egreso"].copy()
+    indice = get_indice(movimientos_df)
 
     col1, col2 = st.columns(2)
     with col1:
@@ -16,20 +21,18 @@ def render(movimientos_df):
     with col2:
         fecha_hasta = st.date_input("Hasta", datetime.datetime.now())
 
-    egresos_df["fecha"] = pd.to_datetime(egresos_df["fecha"])
-    filtered_df = egresos_df[
-        (egresos_df["fecha"] >= pd.Timestamp(fecha_desde)) &
-        (egresos_df["fecha"] <= pd.Timestamp(fecha_hasta))
-    ]
+    # Búsqueda binaria sobre el índice ordenado por fecha (sin recorrer toda la tabla)
+    filtered_df = indice.consultar(pd.Timestamp(fecha_desde), pd.Timestamp(fecha_hasta), tipos=["egreso"])
 
     columnas_egreso = ["fecha", "banco", "descripción", "categoría", "monto", "archivo"]
-    for col in columnas_egreso:
-        if col not in filtered_df.columns:
-            filtered_df[col] = ""
+    # reindex devuelve una copia con las columnas que falten vacías (la consulta es una vista)
+    filtered_df = filtered_df.reindex(columns=list(dict.fromkeys(list(filtered_df.columns) + columnas_egreso)), fill_value="")
 
-    display_df = filtered_df[columnas_egreso].sort_values("fecha", ascending=False)
-    display_df["monto"] = display_df["monto"].astype(float).map("${:,.2f}".format)
-    st.dataframe(display_df, hide_index=True, use_container_width=True)
+    # Solo se formatea y envía la página visible; el monto sigue siendo numérico
+    tabla_paginada(
+        filtered_df, "egresos", columnas=columnas_egreso, filtros={"desde": fecha_desde, "hasta": fecha_hasta},
+        busqueda=get_busqueda(movimientos_df)
+    )
 
     st.metric(
         "Total en el período",
@@ -37,12 +40,11 @@ def render(movimientos_df):
         help="Total de egresos en el período seleccionado",
     )
 
-    csv = filtered_df.to_csv(index=False).encode("utf-8")
-    st.download_button(
+    descarga_bajo_demanda(
         "📥 Exportar a CSV",
-        data=csv,
-        file_name=f"egresos_{fecha_desde}_{fecha_hasta}.csv",
-        mime="text/csv",
+        f"egresos_{fecha_desde}_{fecha_hasta}.csv",
+        lambda: generar_archivo(escribir_csv, filtered_df),
+        {"desde": fecha_desde, "hasta": fecha_hasta},
     )
 
     st.divider()
@@ -60,7 +62,7 @@ def render(movimientos_df):
         data = {
             "fecha": fecha_n.strftime("%Y-%m-%d"),
             "banco": banco_n,
-            "categoria": categoria_n,
+            "categoría": categoria_n,
             "descripción": descripcion_n,
             "monto": monto_n,
             "referencia": referencia_n,
@@ -68,6 +70,8 @@ def render(movimientos_df):
         }
         ok, msg = save_to_unificada(data, "movimientos")
         if ok:
+            anexar_movimientos(pd.DataFrame([data]))
+            registrar_eventos(eventos_alta(pd.DataFrame([data])))
             st.success(msg)
             st.experimental_rerun()
         else:
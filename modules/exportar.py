@@ -0,0 +1,287 @@
+"""
+Exportaciones en streaming: CSV por chunks, XLSX en modo write-only de openpyxl y un zip de
+Parquet opcional (requiere pyarrow). La memoria usada al generar no depende del número de filas.
+
+Uso:
+    python -m modules.exportar --benchmark 10000 100000 1000000
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.data_loader import data_version, obtener_derivado
+from modules.graficos import huella_filtros, CacheLRU
+
+FILAS_POR_CHUNK = 20_000
+# Los archivos generados se quedan en memoria hasta este tamaño y después pasan a disco
+MAX_EN_MEMORIA = 8 * 1024 * 1024
+EXPORTES_MAX = 12
+EXPORTES_MAX_BYTES = 512 * 1024 * 1024
+
+MIME_CSV = "text/csv"
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MIME_ZIP = "application/zip"
+
+
+def _chunks(df, filas_por_chunk=FILAS_POR_CHUNK):
+    for inicio in range(0, len(df), filas_por_chunk):
+        yield df.iloc[inicio:inicio + filas_por_chunk]
+
+
+def escribir_csv(df, destino, encoding="utf-8", filas_por_chunk=FILAS_POR_CHUNK):
+    """Escribe `df` como CSV en el archivo binario `destino`, un bloque de filas cada vez."""
+    texto = io.TextIOWrapper(destino, encoding=encoding, newline="")
+    try:
+        if df.empty:
+            df.to_csv(texto, index=False)
+        for i, chunk in enumerate(_chunks(df, filas_por_chunk)):
+            chunk.to_csv(texto, index=False, header=i == 0)
+        texto.flush()
+    finally:
+        # Se suelta el wrapper sin cerrar `destino`
+        texto.detach()
+
+
+def _filas_excel(chunk):
+    """Filas del chunk con tipos que openpyxl entiende (None en vez de NaN/NaT, tipos nativos)."""
+    # astype(object) ya convierte los escalares de numpy a int/float de Python
+    return chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist()
+
+
+def escribir_xlsx(hojas, destino, filas_por_chunk=FILAS_POR_CHUNK):
+    """
+    Escribe un libro con una hoja por entrada de `hojas` (dict nombre -> DataFrame).
+    En modo write-only openpyxl vuelca cada fila a disco en lugar de mantener el libro en memoria.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    for nombre, df in hojas.items():
+        hoja = libro.create_sheet(title=str(nombre)[:31])
+        hoja.append([str(c) for c in df.columns])
+        for chunk in _chunks(df, filas_por_chunk):
+            for fila in _filas_excel(chunk):
+                hoja.append(fila)
+    libro.save(destino)
+
+
+def parquet_disponible():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _chunk_arrow(chunk):
+    # Las columnas que vienen de Sheets mezclan tipos: se exportan como texto. Las categóricas
+    # también (sus categorías cambian de un chunk a otro y el esquema tiene que ser el mismo)
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if chunk[col].dtype == object or isinstance(chunk[col].dtype, pd.CategoricalDtype):
+            chunk[col] = chunk[col].astype("string")
+    return chunk
+
+
+def escribir_parquet(df, destino, filas_por_chunk=FILAS_POR_CHUNK, compression="snappy"):
+    """Escribe `df` como Parquet en `destino`, un row group de `filas_por_chunk` filas cada vez."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.Schema.from_pandas(_chunk_arrow(df.iloc[:filas_por_chunk]), preserve_index=False)
+    with pq.ParquetWriter(destino, esquema, compression=compression) as writer:
+        for chunk in _chunks(df, filas_por_chunk):
+            writer.write_table(pa.Table.from_pandas(_chunk_arrow(chunk), schema=esquema, preserve_index=False))
+
+
+def copiar_a_zip(origen, zf, nombre, al_leer=None):
+    """Copia el archivo `origen` a la entrada `nombre` del zip por bloques; `al_leer(bloque)` ve cada bloque."""
+    with zf.open(nombre, "w", force_zip64=True) as entrada:
+        while bloque := origen.read(1024 * 1024):
+            if al_leer is not None:
+                al_leer(bloque)
+            entrada.write(bloque)
+
+
+def escribir_parquet_zip(hojas, destino, filas_por_chunk=FILAS_POR_CHUNK):
+    """Zip con un .parquet por entrada de `hojas`, escrito por row groups de `filas_por_chunk`."""
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zf:
+        for nombre, df in hojas.items():
+            with tempfile.TemporaryFile() as tmp:
+                escribir_parquet(df, tmp, filas_por_chunk)
+                tmp.seek(0)
+                copiar_a_zip(tmp, zf, f"{nombre}.parquet")
+
+
+def generar_archivo(escribir, *args, **kwargs):
+    """Ejecuta `escribir(destino, ...)` sobre un archivo temporal y lo devuelve rebobinado."""
+    destino = tempfile.SpooledTemporaryFile(max_size=MAX_EN_MEMORIA)
+    escribir(*args, destino=destino, **kwargs)
+    destino.seek(0)
+    return destino
+
+
+def _tamano(archivo):
+    posicion = archivo.tell()
+    archivo.seek(0, io.SEEK_END)
+    tamano = archivo.tell()
+    archivo.seek(posicion)
+    return tamano
+
+
+def _contenido_descarga(archivo):
+    """
+    Lo que se pasa a `download_button`: el archivo mismo, sin leerlo antes a un `bytes` aparte.
+    Streamlit solo acepta BytesIO o archivos de E/S cruda, así que se entrega el que está dentro
+    del SpooledTemporaryFile (el BytesIO si sigue en memoria, el archivo en disco si no).
+    """
+    interno = getattr(archivo, "_file", archivo)
+    if isinstance(interno, io.BytesIO):
+        return interno
+    interno.flush()
+    return getattr(interno, "raw", interno)
+
+
+def descarga_bajo_demanda(etiqueta, nombre_archivo, generar, filtros, mime=MIME_CSV, preparar=True):
+    """
+    Botón de descarga que solo genera el archivo cuando se pide ("Preparar").
+    `generar()` devuelve un archivo binario (ver `generar_archivo`). El resultado se guarda por
+    (versión de datos, archivo, filtros) y se reutiliza mientras los filtros no cambien.
+    Con `preparar=False` se genera sin el botón de "Preparar" (para resultados que no siguen
+    en pantalla después de un rerun), igualmente una sola vez por clave.
+    """
+    exportes = obtener_derivado(
+        "exportes", lambda: CacheLRU(EXPORTES_MAX, EXPORTES_MAX_BYTES, tamano=_tamano, al_descartar=lambda f: f.close())
+    )
+    clave = (data_version(), nombre_archivo, huella_filtros(filtros))
+    archivo = exportes.obtener(clave)
+    hueco = st.empty()
+    if archivo is None:
+        if preparar and not hueco.button(f"⚙️ Preparar: {etiqueta}", key=f"preparar_{nombre_archivo}"):
+            return
+        with st.spinner(f"Generando {nombre_archivo}..."):
+            archivo = generar()
+        exportes.guardar(clave, archivo)
+    # El botón de descarga ocupa el lugar del de "Preparar"
+    hueco.download_button(
+        etiqueta, _contenido_descarga(archivo), nombre_archivo, mime=mime, key=f"descargar_{nombre_archivo}"
+    )
+
+
+# --- Benchmark de memoria ---
+
+def _movimientos_sinteticos(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    fechas = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, n), unit="D")
+    return pd.DataFrame({
+        "id": [f"mov_{i}" for i in range(n)],
+        "fecha": fechas,
+        "banco": rng.choice(["Chase", "Mercury", "Wise USD", "Truist"], n),
+        "monto": np.round(rng.random(n) * 5000, 2),
+        "tipo": rng.choice(["ingreso", "egreso"], n),
+        "descripción": rng.choice(["AMAZON MKTPLACE", "Zelle payment", "SLACK", "Payroll ADP"], n),
+        "categoría": rng.choice(["Shopping", "Transfers", "Services", "Payroll"], n),
+        "extracto_id": "ext",
+        "origen_dato": "benchmark.pdf",
+    })
+
+
+def _memoria():
+    """(RSS actual, pico de RSS) del proceso en bytes, leídos de /proc/self/status (Linux)."""
+    valores = {}
+    with open("/proc/self/status") as f:
+        for linea in f:
+            clave, _, resto = linea.partition(":")
+            if clave in ("VmRSS", "VmHWM"):
+                valores[clave] = int(resto.split()[0]) * 1024
+    return valores["VmRSS"], valores["VmHWM"]
+
+
+def _reiniciar_pico():
+    # "5" baja el pico (VmHWM) al RSS actual: lo que costó crear los datos de entrada no cuenta
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _casos(n):
+    df = _movimientos_sinteticos(n)
+    hojas = {"ingresos": df[df["tipo"] == "ingreso"], "egresos": df[df["tipo"] == "egreso"]}
+    return {
+        ("csv", "streaming"): lambda: generar_archivo(escribir_csv, df),
+        ("xlsx", "streaming"): lambda: generar_archivo(escribir_xlsx, hojas),
+        ("parquet", "streaming"): lambda: generar_archivo(escribir_parquet_zip, hojas),
+        ("csv", "memoria"): lambda: io.BytesIO(df.to_csv(index=False).encode("utf-8")),
+    }
+
+
+def _medir_caso(n, formato, modo):
+    """
+    Mide un caso en este proceso (ver `benchmark`): cuánto sube el pico de RSS sobre el RSS con
+    los datos de entrada ya creados. Incluye la memoria nativa de pyarrow/openpyxl.
+    """
+    funcion = _casos(n)[(formato, modo)]
+    gc.collect()
+    _reiniciar_pico()
+    base, _ = _memoria()
+    inicio = time.perf_counter()
+    archivo = funcion()
+    segundos = time.perf_counter() - inicio
+    pico = _memoria()[1] - base
+    tamano = _tamano(archivo)
+    archivo.close()
+    return {"segundos": segundos, "pico": pico, "tamano": tamano}
+
+
+def _medir(n, formato, modo):
+    # Un proceso por caso: la memoria que un caso libera no siempre vuelve al sistema
+    salida = subprocess.run(
+        [sys.executable, "-m", "modules.exportar", "--caso", str(n), formato, modo],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def benchmark(tamanos=(10_000, 100_000, 1_000_000), formatos=("csv", "xlsx", "parquet")):
+    """
+    Pico de memoria residente (RSS, incluye la memoria nativa de pyarrow/openpyxl) al exportar
+    n filas, por encima de la que ya ocupan los datos de entrada. Cada caso corre en su propio
+    proceso. Lee la memoria de /proc, así que solo funciona en Linux.
+    """
+    for n in tamanos:
+        for formato in formatos:
+            if formato == "parquet" and not parquet_disponible():
+                continue
+            r = _medir(n, formato, "streaming")
+            linea = (
+                f"{n:>9,} filas | {formato:<7} | {r['segundos']:7.2f}s | pico RSS {r['pico'] / 2**20:7.1f} MiB"
+                f" | archivo {r['tamano'] / 2**20:7.1f} MiB"
+            )
+            if (formato, "memoria") in _casos(0):
+                base = _medir(n, formato, "memoria")
+                linea += f" | to_csv en memoria: pico RSS {base['pico'] / 2**20:7.1f} MiB"
+            print(linea)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportaciones en streaming")
+    parser.add_argument("--benchmark", type=int, nargs="+", metavar="FILAS", help="Tamaños a medir")
+    parser.add_argument("--formatos", nargs="+", default=["csv", "xlsx", "parquet"])
+    parser.add_argument("--caso", nargs=3, metavar=("FILAS", "FORMATO", "MODO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.caso:
+        print(json.dumps(_medir_caso(int(args.caso[0]), args.caso[1], args.caso[2])))
+    elif args.benchmark:
+        benchmark(args.benchmark, args.formatos)
+    else:
+        parser.print_help()
@@ -0,0 +1,157 @@
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from modules.pdf_parser import (
+    extract_data_from_pdf, extraer_texto_paginas, paginas_con_importes, agrupar_rangos
+)
+from modules.gemini_engine import get_motor_gemini
+from modules.parsear import generar_id_compuesto
+from modules.conciliacion import TOLERANCIA_CONCILIACION
+
+# Por debajo de este puntaje el extracto se reenvía a Gemini
+UMBRAL_CONFIANZA = 0.9
+
+
+@dataclass
+class ResultadoExtraccion:
+    nombre: str
+    df_movimientos: pd.DataFrame = None
+    df_extractos: pd.DataFrame = None
+    banco: str = None
+    metodo: str = "local"
+    confianza: float = 0.0
+    motivo: str = ""
+    segundos: float = 0.0
+    paginas_gemini: list = field(default_factory=list)
+
+    def resumen(self):
+        return {
+            "archivo": self.nombre,
+            "banco": self.banco,
+            "método": self.metodo,
+            "confianza": round(self.confianza, 2),
+            "motivo": self.motivo,
+            "páginas Gemini": ", ".join(f"{a + 1}-{b + 1}" if a != b else f"{a + 1}" for a, b in self.paginas_gemini),
+            "movimientos": 0 if self.df_movimientos is None else len(self.df_movimientos),
+            "segundos": round(self.segundos, 2),
+        }
+
+
+def puntuar_confianza(df_movimientos, df_extractos):
+    """
+    Puntúa de 0 a 1 qué tan confiable es una extracción. El criterio principal es que
+    saldo_inicial + ingresos - egresos reproduzca el saldo_final del extracto.
+    Devuelve (confianza, motivo).
+    """
+    if df_movimientos is None or df_extractos is None:
+        return 0.0, "banco no soportado"
+    if df_movimientos.empty:
+        return 0.0, "sin movimientos"
+    if df_extractos.empty:
+        return 0.2, "sin resumen de extracto"
+
+    montos = pd.to_numeric(df_movimientos["monto"], errors="coerce")
+    incompletos = (montos.isna() | df_movimientos["fecha"].isna()).mean()
+    ext = df_extractos.iloc[0]
+    saldo_inicial = pd.to_numeric(ext.get("saldo_inicial"), errors="coerce")
+    saldo_final = pd.to_numeric(ext.get("saldo_final"), errors="coerce")
+    if pd.isna(saldo_inicial) or pd.isna(saldo_final):
+        return float(0.5 * (1 - incompletos)), "sin saldos para conciliar"
+
+    signo = np.where(df_movimientos["tipo"].astype(str).str.lower() == "ingreso", 1.0, -1.0)
+    calculado = saldo_inicial + float(np.nansum(montos.to_numpy(dtype=float) * signo))
+    diferencia = saldo_final - calculado
+    if abs(diferencia) < TOLERANCIA_CONCILIACION:
+        return float(1.0 - 0.5 * incompletos), "concilia"
+    return 0.3, f"no concilia (diferencia {diferencia:,.2f})"
+
+
+def _recalcular_totales(df_movimientos, df_extractos):
+    df_extractos = df_extractos.copy()
+    tipo = df_movimientos["tipo"].astype(str).str.lower()
+    montos = pd.to_numeric(df_movimientos["monto"], errors="coerce")
+    df_extractos["total_ingresos"] = montos[tipo == "ingreso"].sum()
+    df_extractos["total_egresos"] = montos[tipo == "egreso"].sum()
+    return df_extractos
+
+
+def _combinar(local, df_mov_gemini, df_ext_gemini, banco_gemini):
+    """
+    Combina la extracción local con la de Gemini: los saldos y el extracto_id del parser local
+    se conservan (son fiables y mantienen los ids existentes), los huecos se completan con
+    Gemini y los movimientos pasan a ser los de Gemini.
+    """
+    if local.df_extractos is None or local.df_extractos.empty:
+        return df_mov_gemini, df_ext_gemini, banco_gemini
+    df_ext = local.df_extractos.copy()
+    if not df_ext_gemini.empty:
+        for col in ["fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final"]:
+            if pd.isna(df_ext.at[df_ext.index[0], col]):
+                df_ext.at[df_ext.index[0], col] = df_ext_gemini[col].iloc[0]
+    banco = df_ext["banco"].iloc[0]
+    df_mov = df_mov_gemini.copy()
+    if not df_mov.empty:
+        df_mov["banco"] = banco
+        df_mov["extracto_id"] = df_ext["extracto_id"].iloc[0]
+        df_mov["id"] = [
+            generar_id_compuesto(f, banco, d, m)
+            for f, d, m in zip(df_mov["fecha"], df_mov["descripción"], df_mov["monto"])
+        ]
+    return df_mov, _recalcular_totales(df_mov, df_ext), banco
+
+
+def extraer_hibrido(archivos, umbral=UMBRAL_CONFIANZA, motor=None):
+    """
+    Motor de extracción unificado. `archivos`: lista de (pdf_path, nombre).
+
+    1. Corre el parser local (parsear_*) y puntúa la confianza de cada extracto.
+    2. Solo los bancos desconocidos o los extractos que no concilian se escalan a Gemini,
+       y únicamente con las páginas que contienen importes (se omiten portadas, avisos
+       legales, etc.). Todas las escaladas van juntas al motor asíncrono, por chunks de páginas.
+    3. Se queda con la alternativa de mayor confianza.
+    """
+    resultados = []
+    escalar = []
+    for pdf_path, nombre in archivos:
+        inicio = time.perf_counter()
+        df_mov, df_ext, banco, _ = extract_data_from_pdf(pdf_path, filename=nombre)
+        confianza, motivo = puntuar_confianza(df_mov, df_ext)
+        resultados.append(ResultadoExtraccion(
+            nombre, df_mov, df_ext, banco, "local", confianza, motivo, time.perf_counter() - inicio
+        ))
+        if confianza < umbral:
+            escalar.append((len(resultados) - 1, pdf_path))
+
+    if not escalar:
+        return resultados
+
+    motor = motor or get_motor_gemini()
+    documentos = []
+    for i, pdf_path in escalar:
+        textos = extraer_texto_paginas(pdf_path)
+        paginas = paginas_con_importes(textos) or list(range(len(textos)))
+        resultados[i].paginas_gemini = agrupar_rangos(paginas)
+        documentos.append((pdf_path, resultados[i].nombre, paginas))
+    # El motor parte las páginas en chunks y los procesa todos a la vez
+    respuestas = motor.extraer_documentos(documentos)
+
+    for (i, _), respuesta in zip(escalar, respuestas):
+        local = resultados[i]
+        local.segundos += respuesta.segundos
+        if respuesta.error:
+            local.motivo += f"; Gemini falló: {respuesta.error}"
+            continue
+        df_mov, df_ext, banco = _combinar(local, respuesta.df_movimientos, respuesta.df_extractos, respuesta.banco)
+        confianza, motivo = puntuar_confianza(df_mov, df_ext)
+        if local.df_movimientos is None or confianza >= local.confianza:
+            metodo = "gemini" if local.df_movimientos is None else "local+gemini"
+            resultados[i] = ResultadoExtraccion(
+                local.nombre, df_mov, df_ext, banco, metodo, confianza, motivo,
+                local.segundos, local.paginas_gemini
+            )
+        else:
+            local.motivo += f"; Gemini no mejoró ({motivo})"
+    return resultados
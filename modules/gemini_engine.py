@@ -0,0 +1,613 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import streamlit as st
+import pandas as pd
+
+from modules.metricas import instrumentado
+
+GEMINI_MODELO = "models/gemini-1.5-flash"
+# Cambiar la versión invalida la caché de extracciones hechas con el prompt/esquema anterior
+PROMPT_VERSION = "v2"
+PROMPT = (
+    "Eres un asistente que lee extractos bancarios en formato PDF. Devuelve el nombre del banco, "
+    "un resumen del extracto en 'extractos' y cada transacción en 'movimientos', en el orden del PDF. "
+    "Fechas en formato YYYY-MM-DD; 'monto' siempre positivo y 'tipo' indica si es ingreso o egreso."
+)
+
+# Esquema estricto de la respuesta: mismas columnas que las hojas 'movimientos' y 'extractos'.
+# 'movimientos' va primero para que el parser incremental empiece a emitir filas cuanto antes.
+ESQUEMA_MOVIMIENTO = {
+    "type": "object",
+    "properties": {
+        "fecha": {"type": "string"},
+        "monto": {"type": "number"},
+        "tipo": {"type": "string", "enum": ["ingreso", "egreso"]},
+        "descripción": {"type": "string"},
+        "categoría": {"type": "string", "nullable": True},
+    },
+    "required": ["fecha", "monto", "tipo", "descripción"],
+}
+ESQUEMA_EXTRACTO = {
+    "type": "object",
+    "properties": {
+        "fecha_inicio": {"type": "string", "nullable": True},
+        "fecha_fin": {"type": "string", "nullable": True},
+        "saldo_inicial": {"type": "number", "nullable": True},
+        "saldo_final": {"type": "number", "nullable": True},
+        "total_ingresos": {"type": "number", "nullable": True},
+        "total_egresos": {"type": "number", "nullable": True},
+    },
+}
+ESQUEMA_RESPUESTA = {
+    "type": "object",
+    "properties": {
+        "movimientos": {"type": "array", "items": ESQUEMA_MOVIMIENTO},
+        "banco": {"type": "string"},
+        "extractos": {"type": "array", "items": ESQUEMA_EXTRACTO},
+    },
+    "required": ["movimientos", "banco", "extractos"],
+}
+COLUMNAS_MOV = [
+    "id", "fecha", "banco", "monto", "tipo", "descripción", "categoría", "extracto_id", "origen_dato", "contraparte"
+]
+COLUMNAS_EXT = ["extracto_id", "banco", "fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "archivo_fuente"]
+CONCURRENCIA_MAX = 4
+PETICIONES_POR_MINUTO = 15
+# Extractos más largos se parten en chunks de páginas para no chocar con el límite de tokens de salida
+PAGINAS_POR_CHUNK = 4
+REINTENTOS_CHUNK = 3
+CACHE_DIR = Path(os.environ.get("GEMINI_CACHE_DIR", ".cache/gemini"))
+
+
+def hash_pdf(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class LimitadorTasa:
+    """
+    Token bucket: como máximo `por_minuto` peticiones por minuto, con ráfagas de `rafaga`.
+    Se comparte entre event loops y sesiones (un `asyncio.run` por extracción), así que el
+    estado se protege con un lock de hilos: cada petición reserva su token (el saldo puede
+    quedar negativo) y duerme fuera del lock hasta que le toque.
+    """
+
+    def __init__(self, por_minuto=PETICIONES_POR_MINUTO, rafaga=None):
+        self.intervalo = 60.0 / por_minuto if por_minuto else 0.0
+        self.capacidad = rafaga or CONCURRENCIA_MAX
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reservar(self):
+        """Toma un token y devuelve cuántos segundos hay que esperar antes de usarlo."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) / self.intervalo)
+            self._ultimo = ahora
+            self._tokens -= 1
+            return max(0.0, -self._tokens * self.intervalo)
+
+    async def esperar(self):
+        if not self.intervalo:
+            return
+        espera = self._reservar()
+        if espera:
+            await asyncio.sleep(espera)
+
+
+class CacheExtracciones:
+    """
+    Caché persistente en disco de respuestas de Gemini.
+    La clave es el hash del PDF + versión del prompt + modelo, así que el mismo extracto
+    no se vuelve a pagar aunque se suba con otro nombre.
+    """
+
+    def __init__(self, directorio=CACHE_DIR):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def clave(pdf_hash, prompt_version=PROMPT_VERSION, modelo=GEMINI_MODELO):
+        modelo_n = modelo.replace("/", "-")
+        return f"{pdf_hash}_{prompt_version}_{modelo_n}"
+
+    def _ruta(self, clave):
+        return self.directorio / f"{clave}.json"
+
+    def get(self, clave):
+        ruta = self._ruta(clave)
+        if not ruta.exists():
+            return None
+        try:
+            return json.loads(ruta.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def set(self, clave, valor):
+        ruta = self._ruta(clave)
+        tmp = ruta.with_suffix(".tmp")
+        tmp.write_text(json.dumps(valor, ensure_ascii=False), encoding="utf-8")
+        # os.replace es atómico: un lector nunca ve un JSON a medio escribir
+        os.replace(tmp, ruta)
+
+
+class BackendGemini:
+    """Cliente real de Gemini. Es síncrono; el motor lo ejecuta en hilos."""
+
+    def __init__(self, api_key, modelo=GEMINI_MODELO):
+        import google.generativeai as genai
+        self._genai = genai
+        # configure se llama una sola vez por proceso, no por PDF
+        genai.configure(api_key=api_key)
+        self.modelo = modelo
+        self._model = genai.GenerativeModel(modelo)
+
+    @instrumentado("gemini")
+    def generar(self, pdf_path, display_name, prompt, on_fragmento=None):
+        """Devuelve (texto, uso). `on_fragmento(texto)` recibe cada fragmento del stream."""
+        uploaded = self._genai.upload_file(path=pdf_path, display_name=display_name or "pdf")
+        try:
+            config = self._genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=ESQUEMA_RESPUESTA,
+            )
+            response = self._model.generate_content([prompt, uploaded], generation_config=config, stream=True)
+            fragmentos = []
+            for chunk in response:
+                fragmentos.append(chunk.text)
+                if on_fragmento:
+                    on_fragmento(chunk.text)
+            meta = response.usage_metadata
+            uso = {
+                "tokens_prompt": meta.prompt_token_count,
+                "tokens_respuesta": meta.candidates_token_count,
+                "tokens_total": meta.total_token_count,
+            }
+            return "".join(fragmentos), uso
+        finally:
+            # Borrar el archivo subido para evitar acumularlo en la cuenta
+            self._genai.delete_file(uploaded.name)
+
+
+class BackendStub:
+    """Cliente del servidor stub local (ver modules/gemini_stub.py) para pruebas sin red."""
+
+    def __init__(self, url, modelo=GEMINI_MODELO, timeout=60):
+        self.url = url.rstrip("/")
+        self.modelo = modelo
+        self.timeout = timeout
+
+    @instrumentado("gemini")
+    def generar(self, pdf_path, display_name, prompt, on_fragmento=None):
+        import base64
+        import codecs
+        import urllib.request
+        body = json.dumps({
+            "prompt": prompt,
+            "display_name": display_name,
+            "pdf_b64": base64.b64encode(Path(pdf_path).read_bytes()).decode("ascii"),
+        }).encode("utf-8")
+        req = urllib.request.Request(
+            f"{self.url}/generate?stream=1", data=body, headers={"Content-Type": "application/json"}
+        )
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        fragmentos = []
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            while True:
+                bloque = resp.read1(4096)
+                if not bloque:
+                    break
+                texto = decoder.decode(bloque)
+                fragmentos.append(texto)
+                if on_fragmento and texto:
+                    on_fragmento(texto)
+        texto = "".join(fragmentos)
+        # El stub no cuenta tokens: se estiman a ~4 caracteres por token
+        uso = {
+            "tokens_prompt": len(prompt) // 4,
+            "tokens_respuesta": len(texto) // 4,
+            "tokens_total": (len(prompt) + len(texto)) // 4,
+            "estimado": True,
+        }
+        return texto, uso
+
+
+class ParserMovimientosIncremental:
+    """
+    Extrae los objetos del array "movimientos" a medida que llega el JSON en fragmentos,
+    sin esperar a la respuesta completa. Cada `alimentar(fragmento)` devuelve los
+    movimientos que se completaron con ese fragmento.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._en_array = False
+        self._terminado = False
+        self._inicio_obj = None
+        self._profundidad = 0
+        self._en_string = False
+        self._escape = False
+
+    def alimentar(self, fragmento):
+        nuevos = []
+        if self._terminado:
+            return nuevos
+        self._buffer += fragmento
+        if not self._en_array:
+            clave = self._buffer.find('"movimientos"')
+            if clave == -1:
+                return nuevos
+            corchete = self._buffer.find("[", clave)
+            if corchete == -1:
+                return nuevos
+            self._en_array = True
+            self._pos = corchete + 1
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            c = buffer[i]
+            if self._en_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_string = False
+            elif c == '"':
+                self._en_string = True
+            elif c == "{":
+                if self._profundidad == 0:
+                    self._inicio_obj = i
+                self._profundidad += 1
+            elif c == "}":
+                self._profundidad -= 1
+                if self._profundidad == 0 and self._inicio_obj is not None:
+                    try:
+                        nuevos.append(json.loads(buffer[self._inicio_obj:i + 1]))
+                    except ValueError:
+                        pass
+                    self._inicio_obj = None
+            elif c == "]" and self._profundidad == 0:
+                self._terminado = True
+                i += 1
+                break
+            i += 1
+        # Se descarta lo ya recorrido (salvo el objeto a medio llegar): el buffer no crece con
+        # la respuesta y cada fragmento cuesta lo que mide
+        corte = self._inicio_obj if self._inicio_obj is not None else i
+        self._buffer = buffer[corte:]
+        self._pos = i - corte
+        if self._inicio_obj is not None:
+            self._inicio_obj = 0
+        return nuevos
+
+
+def limpiar_json(texto):
+    """Quita cercas de markdown (```json ... ```) y texto alrededor del objeto JSON."""
+    texto = texto.strip()
+    if texto.startswith("```"):
+        texto = texto.split("\n", 1)[1] if "\n" in texto else texto[3:]
+        if texto.rstrip().endswith("```"):
+            texto = texto.rstrip()[:-3]
+    inicio, fin = texto.find("{"), texto.rfind("}")
+    if inicio != -1 and fin != -1:
+        texto = texto[inicio:fin + 1]
+    return texto
+
+
+@dataclass
+class ResultadoGemini:
+    nombre: str
+    texto: str = None
+    desde_cache: bool = False
+    error: str = None
+    segundos: float = 0.0
+    uso: dict = None
+
+
+@dataclass
+class ResultadoDocumento:
+    """Resultado de un PDF completo procesado en uno o varios chunks de páginas."""
+    nombre: str
+    df_movimientos: pd.DataFrame = None
+    df_extractos: pd.DataFrame = None
+    banco: str = None
+    chunks: list = None
+    error: str = None
+    segundos: float = 0.0
+
+    @property
+    def desde_cache(self):
+        return bool(self.chunks) and all(c.desde_cache for c in self.chunks)
+
+    @property
+    def uso(self):
+        """Uso de tokens sumado sobre todos los chunks."""
+        total = {}
+        for chunk in self.chunks or []:
+            for clave, valor in (chunk.uso or {}).items():
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                    total[clave] = total.get(clave, 0) + valor
+        if total:
+            total["chunks"] = len(self.chunks)
+        return total or None
+
+
+class MotorGemini:
+    """
+    Motor de extracción asíncrono: procesa varios PDFs a la vez con un límite de
+    concurrencia, limitación de tasa del lado cliente y caché persistente.
+    """
+
+    def __init__(self, backend, cache=None, concurrencia=CONCURRENCIA_MAX,
+                 por_minuto=PETICIONES_POR_MINUTO, prompt=PROMPT, prompt_version=PROMPT_VERSION):
+        self.backend = backend
+        self.cache = cache
+        self.concurrencia = concurrencia
+        self.por_minuto = por_minuto
+        self.prompt = prompt
+        self.prompt_version = prompt_version
+        # El motor es uno por proceso: la tasa y las estadísticas son comunes a todas las sesiones
+        self.limitador = LimitadorTasa(por_minuto, rafaga=concurrencia)
+        self._lock = threading.Lock()
+        self.estadisticas = {
+            "llamadas": 0, "aciertos_cache": 0, "errores": 0,
+            "tokens_prompt": 0, "tokens_respuesta": 0,
+        }
+
+    def _contar(self, **incrementos):
+        with self._lock:
+            for clave, n in incrementos.items():
+                self.estadisticas[clave] += n
+
+    async def _extraer_uno(self, pdf_path, nombre, semaforo, on_movimiento=None, huella=None):
+        inicio = time.perf_counter()
+        clave = None
+        if self.cache is not None:
+            # `huella` permite identificar PDFs derivados (rangos de páginas) por su origen
+            huella = huella or hash_pdf(Path(pdf_path).read_bytes())
+            clave = self.cache.clave(huella, self.prompt_version, self.backend.modelo)
+            guardado = self.cache.get(clave)
+            if guardado is not None:
+                self._contar(aciertos_cache=1)
+                return ResultadoGemini(nombre, guardado["texto"], True, segundos=time.perf_counter() - inicio,
+                                       uso=guardado.get("uso"))
+        on_fragmento = None
+        if on_movimiento is not None:
+            # El backend corre en un hilo: los movimientos se devuelven al hilo del event loop
+            loop = asyncio.get_running_loop()
+            parser = ParserMovimientosIncremental()
+
+            def avisar(fragmento):
+                for movimiento in parser.alimentar(fragmento):
+                    loop.call_soon_threadsafe(on_movimiento, nombre, movimiento)
+
+            on_fragmento = avisar
+
+        async with semaforo:
+            await self.limitador.esperar()
+            try:
+                self._contar(llamadas=1)
+                texto, uso = await asyncio.to_thread(self.backend.generar, pdf_path, nombre, self.prompt, on_fragmento)
+                # Una respuesta truncada (límite de tokens de salida) no es JSON válido: no se cachea
+                json.loads(limpiar_json(texto))
+            except Exception as e:
+                self._contar(errores=1)
+                return ResultadoGemini(nombre, error=str(e), segundos=time.perf_counter() - inicio)
+        uso = dict(uso or {}, caracteres_prompt=len(self.prompt), bytes_pdf=Path(pdf_path).stat().st_size)
+        self._contar(tokens_prompt=uso.get("tokens_prompt") or 0, tokens_respuesta=uso.get("tokens_respuesta") or 0)
+        if self.cache is not None:
+            self.cache.set(clave, {
+                "texto": texto, "uso": uso, "archivo": nombre,
+                "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        return ResultadoGemini(nombre, texto, segundos=time.perf_counter() - inicio, uso=uso)
+
+    async def extraer_async(self, archivos, on_movimiento=None):
+        """
+        `archivos`: lista de (pdf_path, nombre) o (pdf_path, nombre, huella), donde `huella`
+        reemplaza al hash del PDF en la clave de caché. Devuelve los resultados en el mismo orden.
+        `on_movimiento(nombre, movimiento)` se llama en el hilo del event loop por cada
+        movimiento en cuanto termina de llegar en el stream.
+        """
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        return await asyncio.gather(*[
+            self._extraer_uno(archivo[0], archivo[1], semaforo, on_movimiento, *archivo[2:])
+            for archivo in archivos
+        ])
+
+    @instrumentado("gemini")
+    def extraer(self, archivos, on_movimiento=None):
+        """Versión síncrona para llamar desde las páginas de Streamlit."""
+        return asyncio.run(self.extraer_async(archivos, on_movimiento))
+
+    async def _extraer_chunk(self, ruta, nombre, huella, semaforo, on_movimiento):
+        """
+        Reintenta solo el chunk que falló; los chunks correctos quedan en caché. Los movimientos
+        se avisan con `intento=(huella, n)`: al reintentar, los del intento anterior quedan obsoletos.
+        """
+        for intento in range(REINTENTOS_CHUNK + 1):
+            aviso = None if on_movimiento is None else functools.partial(on_movimiento, intento=(huella, intento))
+            resultado = await self._extraer_uno(ruta, nombre, semaforo, aviso, huella)
+            if not resultado.error:
+                return resultado
+            if intento < REINTENTOS_CHUNK:
+                await asyncio.sleep(min(2 ** intento, 20))
+        return resultado
+
+    async def extraer_documentos_async(self, documentos, paginas_por_chunk=PAGINAS_POR_CHUNK, on_movimiento=None):
+        """
+        `documentos`: lista de (pdf_path, nombre) o (pdf_path, nombre, paginas) con las páginas
+        (base 0) a procesar. Cada documento se parte en chunks de `paginas_por_chunk` páginas, todos
+        los chunks de todos los documentos se procesan a la vez y luego se combinan en orden.
+        `on_movimiento(nombre, movimiento, intento=...)` recibe el chunk y el número de intento:
+        cuando llega el primer movimiento de un reintento, el consumidor debe descartar los que
+        ya recibió de los intentos anteriores de ese chunk.
+        """
+        from modules.pdf_parser import contar_paginas_pdf, extraer_paginas_pdf
+
+        planes = []
+        temporales = []
+        try:
+            for documento in documentos:
+                pdf_path = documento[0]
+                huella = hash_pdf(Path(pdf_path).read_bytes())
+                total_paginas = contar_paginas_pdf(pdf_path)
+                paginas = list(documento[2]) if len(documento) > 2 and documento[2] else list(range(total_paginas))
+                if len(paginas) == total_paginas and total_paginas <= paginas_por_chunk:
+                    planes.append([(pdf_path, huella)])
+                    continue
+                chunks = []
+                for inicio in range(0, len(paginas), paginas_por_chunk):
+                    grupo = paginas[inicio:inicio + paginas_por_chunk]
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                        tmp.write(extraer_paginas_pdf(pdf_path, grupo))
+                    temporales.append(tmp.name)
+                    chunks.append((tmp.name, f"{huella}_p{'-'.join(map(str, grupo))}"))
+                planes.append(chunks)
+
+            semaforo = asyncio.Semaphore(self.concurrencia)
+            tareas = [
+                self._extraer_chunk(ruta, documento[1], huella, semaforo, on_movimiento)
+                for documento, chunks in zip(documentos, planes)
+                for ruta, huella in chunks
+            ]
+            planos = await asyncio.gather(*tareas)
+        finally:
+            for ruta in temporales:
+                os.unlink(ruta)
+
+        resultados = []
+        pos = 0
+        for documento, chunks in zip(documentos, planes):
+            resultados_chunks = planos[pos:pos + len(chunks)]
+            pos += len(chunks)
+            resultados.append(combinar_chunks(documento[1], resultados_chunks))
+        return resultados
+
+    @instrumentado("gemini")
+    def extraer_documentos(self, documentos, paginas_por_chunk=PAGINAS_POR_CHUNK, on_movimiento=None):
+        """Versión síncrona de `extraer_documentos_async`."""
+        return asyncio.run(self.extraer_documentos_async(documentos, paginas_por_chunk, on_movimiento))
+
+
+@instrumentado("parser")
+def respuesta_a_dataframes(texto, nombre_archivo=None):
+    """
+    Convierte el JSON devuelto por Gemini en (df_movimientos, df_extractos, banco) con las
+    mismas columnas e ids compuestos que producen los parsers locales.
+    """
+    from modules.parsear import generar_id_compuesto, generar_extracto_id, categorizar_movimiento, agregar_contraparte
+
+    data = json.loads(limpiar_json(texto))
+    banco = data.get("banco")
+    df_ext = pd.DataFrame(data.get("extractos", []))
+    if df_ext.empty:
+        df_ext = pd.DataFrame([{}])
+    df_ext["banco"] = banco
+    df_ext["archivo_fuente"] = nombre_archivo
+    df_ext = df_ext.reindex(columns=COLUMNAS_EXT)
+    df_ext["extracto_id"] = [
+        generar_extracto_id(banco, r.fecha_inicio, r.fecha_fin, r.saldo_inicial, r.saldo_final, nombre_archivo)
+        for r in df_ext.itertuples(index=False)
+    ]
+    extracto_id = df_ext["extracto_id"].iloc[0]
+
+    df_mov = pd.DataFrame(data.get("movimientos", []), columns=COLUMNAS_MOV)
+    if not df_mov.empty:
+        df_mov["banco"] = banco
+        df_mov["monto"] = pd.to_numeric(df_mov["monto"], errors="coerce").abs()
+        df_mov["descripción"] = df_mov["descripción"].fillna("").astype(str)
+        sin_categoria = df_mov["categoría"].isna() | (df_mov["categoría"] == "")
+        df_mov.loc[sin_categoria, "categoría"] = df_mov.loc[sin_categoria, "descripción"].map(categorizar_movimiento)
+        df_mov["extracto_id"] = extracto_id
+        df_mov["origen_dato"] = nombre_archivo
+        df_mov["id"] = [
+            generar_id_compuesto(f, banco, d, m)
+            for f, d, m in zip(df_mov["fecha"], df_mov["descripción"], df_mov["monto"])
+        ]
+        df_mov = agregar_contraparte(df_mov)
+    return df_mov, df_ext, banco
+
+
+def combinar_chunks(nombre_archivo, resultados_chunks):
+    """
+    Une los chunks de un documento de forma determinista (en orden de páginas). Un movimiento
+    cuyo id compuesto ya apareció en un chunk anterior se descarta (filas repetidas en el borde
+    entre chunks); los repetidos dentro de un mismo chunk se conservan porque son legítimos.
+    """
+    from modules.parsear import generar_extracto_id
+
+    segundos = max((r.segundos for r in resultados_chunks), default=0.0)
+    errores = [r.error for r in resultados_chunks if r.error]
+    if errores:
+        return ResultadoDocumento(
+            nombre_archivo, chunks=resultados_chunks, segundos=segundos,
+            error=f"{len(errores)}/{len(resultados_chunks)} chunks fallaron: {errores[0]}"
+        )
+    try:
+        partes = [respuesta_a_dataframes(r.texto, nombre_archivo) for r in resultados_chunks]
+    except Exception as e:
+        return ResultadoDocumento(nombre_archivo, chunks=resultados_chunks, segundos=segundos, error=str(e))
+
+    banco = next((b for _, _, b in partes if b), None)
+    vistos = set()
+    movimientos = []
+    for df_mov, _, _ in partes:
+        if df_mov.empty:
+            continue
+        movimientos.append(df_mov[~df_mov["id"].isin(vistos)])
+        vistos.update(df_mov["id"])
+    df_mov = pd.concat(movimientos, ignore_index=True) if movimientos else pd.DataFrame(columns=COLUMNAS_MOV)
+
+    ext = pd.concat([df_ext for _, df_ext, _ in partes], ignore_index=True)
+    inicios = pd.to_datetime(ext["fecha_inicio"], errors="coerce")
+    fines = pd.to_datetime(ext["fecha_fin"], errors="coerce")
+    saldos_ini = pd.to_numeric(ext["saldo_inicial"], errors="coerce").dropna()
+    saldos_fin = pd.to_numeric(ext["saldo_final"], errors="coerce").dropna()
+    fila = {
+        "banco": banco,
+        "fecha_inicio": inicios.min().strftime("%Y-%m-%d") if inicios.notna().any() else None,
+        "fecha_fin": fines.max().strftime("%Y-%m-%d") if fines.notna().any() else None,
+        # El saldo inicial sale del primer chunk que lo trae y el final del último
+        "saldo_inicial": saldos_ini.iloc[0] if not saldos_ini.empty else None,
+        "saldo_final": saldos_fin.iloc[-1] if not saldos_fin.empty else None,
+        "archivo_fuente": nombre_archivo,
+    }
+    fila["extracto_id"] = generar_extracto_id(
+        banco, fila["fecha_inicio"], fila["fecha_fin"], fila["saldo_inicial"], fila["saldo_final"], nombre_archivo
+    )
+    tipo = df_mov["tipo"].astype(str).str.lower()
+    fila["total_ingresos"] = df_mov.loc[tipo == "ingreso", "monto"].sum()
+    fila["total_egresos"] = df_mov.loc[tipo == "egreso", "monto"].sum()
+    df_ext = pd.DataFrame([fila], columns=COLUMNAS_EXT)
+    if not df_mov.empty:
+        df_mov["extracto_id"] = fila["extracto_id"]
+    return ResultadoDocumento(nombre_archivo, df_mov, df_ext, banco, chunks=resultados_chunks, segundos=segundos)
+
+
+@st.cache_resource
+def get_motor_gemini():
+    """Crea el motor una vez por proceso. Usa el servidor stub si GEMINI_STUB_URL está definido."""
+    gemini_cfg = st.secrets.get("gemini", {})
+    stub_url = os.environ.get("GEMINI_STUB_URL") or gemini_cfg.get("stub_url")
+    if stub_url:
+        backend = BackendStub(stub_url)
+    else:
+        backend = BackendGemini(gemini_cfg["api_key"])
+    return MotorGemini(
+        backend,
+        cache=CacheExtracciones(),
+        concurrencia=int(gemini_cfg.get("concurrencia", CONCURRENCIA_MAX)),
+        por_minuto=int(gemini_cfg.get("peticiones_por_minuto", PETICIONES_POR_MINUTO)),
+    )
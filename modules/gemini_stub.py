@@ -0,0 +1,163 @@
+"""
+Servidor stub local que imita al modelo de Gemini para probar el motor de extracción sin red.
+
+Uso:
+    python -m modules.gemini_stub --puerto 8765 --latencia 0.5
+    GEMINI_STUB_URL=http://127.0.0.1:8765 streamlit run app.py
+
+    python -m modules.gemini_stub --benchmark 20   # throughput y aciertos de caché
+"""
+import argparse
+import base64
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+
+def respuesta_falsa(pdf_bytes, display_name=None):
+    """Respuesta determinista derivada del hash del PDF (mismo PDF -> misma respuesta)."""
+    semilla = int(hashlib.sha256(pdf_bytes).hexdigest()[:8], 16)
+    n_movs = 5 + semilla % 20
+    movimientos = []
+    for i in range(n_movs):
+        monto = round(((semilla >> (i % 16)) % 50000) / 100 + 1, 2)
+        movimientos.append({
+            "fecha": f"2025-01-{1 + i % 28:02d}",
+            "monto": monto,
+            "tipo": "ingreso" if (semilla + i) % 3 == 0 else "egreso",
+            "descripción": f"Movimiento stub {i}",
+            "categoría": None,
+        })
+    return {
+        "banco": "Stub",
+        "movimientos": movimientos,
+        "extractos": [{
+            "fecha_inicio": "2025-01-01",
+            "fecha_fin": "2025-01-31",
+            "saldo_inicial": 1000.0,
+            "saldo_final": 1000.0,
+        }],
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, codigo, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.lock:
+                self._responder(200, dict(self.server.stats))
+        else:
+            self._responder(404, {"error": "not found"})
+
+    def _responder_stream(self, texto, trozo=256):
+        """Escribe la respuesta en trozos (sin Content-Length) para simular el stream del modelo."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        body = texto.encode("utf-8")
+        pausa = self.server.latencia / max(len(body) // trozo, 1)
+        for inicio in range(0, len(body), trozo):
+            self.wfile.write(body[inicio:inicio + trozo])
+            self.wfile.flush()
+            time.sleep(pausa)
+        self.close_connection = True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/generate":
+            self._responder(404, {"error": "not found"})
+            return
+        largo = int(self.headers.get("Content-Length", 0))
+        peticion = json.loads(self.rfile.read(largo).decode("utf-8"))
+        with self.server.lock:
+            self.server.stats["peticiones"] += 1
+            self.server.stats["en_curso"] += 1
+            self.server.stats["max_en_curso"] = max(self.server.stats["max_en_curso"], self.server.stats["en_curso"])
+        try:
+            pdf_bytes = base64.b64decode(peticion.get("pdf_b64", ""))
+            texto = json.dumps(respuesta_falsa(pdf_bytes, peticion.get("display_name")), ensure_ascii=False)
+            if parse_qs(url.query).get("stream") == ["1"]:
+                # La latencia se reparte entre los trozos: las primeras filas llegan antes
+                self._responder_stream(texto)
+            else:
+                time.sleep(self.server.latencia)
+                self._responder(200, {"text": texto})
+        finally:
+            with self.server.lock:
+                self.server.stats["en_curso"] -= 1
+
+
+def iniciar_servidor_stub(puerto=0, latencia=0.5):
+    """Arranca el servidor en un hilo daemon. Devuelve (servidor, url)."""
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _StubHandler)
+    servidor.latencia = latencia
+    servidor.lock = threading.Lock()
+    servidor.stats = {"peticiones": 0, "en_curso": 0, "max_en_curso": 0}
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def benchmark(n_pdfs=20, concurrencia=4, latencia=0.5, por_minuto=0):
+    """Procesa n PDFs falsos dos veces: la primera contra el stub, la segunda desde caché."""
+    from modules.gemini_engine import MotorGemini, BackendStub, CacheExtracciones
+
+    servidor, url = iniciar_servidor_stub(latencia=latencia)
+    with tempfile.TemporaryDirectory() as tmp:
+        archivos = []
+        for i in range(n_pdfs):
+            ruta = Path(tmp) / f"extracto_{i}.pdf"
+            ruta.write_bytes(f"%PDF-stub {i}".encode("ascii"))
+            archivos.append((str(ruta), ruta.name))
+        motor = MotorGemini(
+            BackendStub(url), cache=CacheExtracciones(Path(tmp) / "cache"),
+            concurrencia=concurrencia, por_minuto=por_minuto
+        )
+        for ronda in ("fría", "caché"):
+            primera_fila = []
+            inicio = time.perf_counter()
+            resultados = motor.extraer(
+                archivos, on_movimiento=lambda *_: primera_fila or primera_fila.append(time.perf_counter() - inicio)
+            )
+            segundos = time.perf_counter() - inicio
+            errores = sum(1 for r in resultados if r.error)
+            ttfr = f"{primera_fila[0]:.2f}s" if primera_fila else "-"
+            print(
+                f"[{ronda}] {n_pdfs} PDFs en {segundos:.2f}s "
+                f"({n_pdfs / segundos:.1f} PDF/s, primera fila {ttfr}, errores={errores}) | motor={motor.estadisticas}"
+            )
+    print(f"servidor stub: {servidor.stats}")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor stub de Gemini")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.5)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--benchmark", type=int, default=0, help="Número de PDFs para medir throughput")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark, concurrencia=args.concurrencia, latencia=args.latencia)
+    else:
+        servidor, url = iniciar_servidor_stub(args.puerto, args.latencia)
+        print(f"Stub de Gemini escuchando en {url} (Ctrl+C para salir)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            servidor.shutdown()
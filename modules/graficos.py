@@ -0,0 +1,213 @@
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from matplotlib.figure import Figure
+
+from modules.data_loader import data_version, obtener_derivado
+from modules.metricas import contar, instrumentado, medir
+
+GRAFICOS_MAX = 48
+GRAFICOS_MAX_BYTES = 32 * 1024 * 1024
+GRAFICOS_DPI = 150
+
+
+def huella_filtros(filtros):
+    """Hash estable del estado de filtros (fechas, listas, None...) para usarlo como clave."""
+    texto = json.dumps(filtros, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+
+
+class CacheLRU:
+    """
+    LRU acotada de contenidos ya renderizados (bytes PNG/SVG, JSON de Plotly, exportaciones).
+    Se acota por número de entradas y por bytes totales; al superar cualquiera de los dos
+    límites se descartan los menos usados recientemente. `tamano(contenido)` mide cada entrada
+    y `al_descartar(contenido)` se llama al expulsarla (p. ej. para cerrar un archivo).
+    """
+
+    def __init__(self, max_entradas=GRAFICOS_MAX, max_bytes=GRAFICOS_MAX_BYTES, tamano=len, al_descartar=None):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._tamano = tamano
+        self._al_descartar = al_descartar
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.estadisticas = {"aciertos": 0, "fallos": 0, "descartes": 0}
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.estadisticas["fallos"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.estadisticas["aciertos"] += 1
+            return entrada[0]
+
+    def guardar(self, clave, contenido):
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._entradas[clave] = (contenido, self._tamano(contenido))
+            self._bytes += self._entradas[clave][1]
+            # La entrada recién guardada nunca se expulsa: quien la guardó la va a usar ahora
+            while len(self._entradas) > 1 and (len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                _, (descartado, tamano) = self._entradas.popitem(last=False)
+                self._bytes -= tamano
+                self.estadisticas["descartes"] += 1
+                if self._al_descartar:
+                    self._al_descartar(descartado)
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+@instrumentado("gráfico")
+def renderizar_matplotlib(dibujar, figsize=(6, 4), formato="png"):
+    """
+    Llama a `dibujar(ax)` sobre una figura nueva y devuelve los bytes renderizados.
+    La figura no se registra en pyplot, así que no queda viva entre reruns.
+    """
+    fig = Figure(figsize=figsize)
+    try:
+        dibujar(fig.subplots())
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=formato, dpi=GRAFICOS_DPI, bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+def usar_plotly():
+    return st.session_state.get("graficos_plotly", False)
+
+
+def selector_motor_graficos():
+    """Toggle en la barra lateral para elegir gráficos interactivos (Plotly) o estáticos."""
+    st.sidebar.toggle("Gráficos interactivos (Plotly)", key="graficos_plotly")
+
+
+def mostrar_grafico(tipo, filtros, dibujar, figsize=(6, 4), plotly=None, formato="png"):
+    """
+    Muestra un gráfico cacheado por (versión de datos, tipo de gráfico, hash de filtros).
+
+    `dibujar(ax)` dibuja la versión matplotlib y `plotly()` (opcional) devuelve la figura
+    interactiva equivalente. Solo se llama a uno de los dos cuando el gráfico no está en caché,
+    así que una vista repetida no vuelve a dibujar nada.
+    """
+    cache = obtener_derivado("graficos", CacheLRU)
+    interactivo = plotly is not None and usar_plotly()
+    clave = (data_version(), tipo, huella_filtros(filtros), "plotly" if interactivo else formato)
+    contenido = cache.obtener(clave)
+    contar(f"gráfico.cache_{'fallo' if contenido is None else 'acierto'}")
+    if contenido is None:
+        if interactivo:
+            with medir("gráfico.plotly", "gráfico"):
+                contenido = plotly().to_json().encode("utf-8")
+        else:
+            contenido = renderizar_matplotlib(dibujar, figsize, formato)
+        cache.guardar(clave, contenido)
+
+    if interactivo:
+        import plotly.io as pio
+        st.plotly_chart(pio.from_json(contenido.decode("utf-8")), use_container_width=True)
+    elif formato == "svg":
+        st.image(contenido.decode("utf-8"), use_container_width=True)
+    else:
+        st.image(contenido, use_container_width=True)
+
+
+# --- Equivalentes Plotly de los gráficos matplotlib más usados ---
+
+def plotly_barras(datos, titulo, ylabel="Monto ($)", horizontal=False, color=None):
+    """Barras agrupadas a partir de una Serie o de un DataFrame (una traza por columna)."""
+    import plotly.graph_objects as go
+
+    columnas = datos.to_frame() if hasattr(datos, "to_frame") else datos
+    fig = go.Figure()
+    for col in columnas.columns:
+        x, y = columnas.index.astype(str), columnas[col]
+        fig.add_trace(go.Bar(
+            x=y if horizontal else x, y=x if horizontal else y, name=str(col),
+            orientation="h" if horizontal else "v", marker_color=color
+        ))
+    fig.update_layout(
+        title=titulo, barmode="group", showlegend=len(columnas.columns) > 1,
+        margin=dict(l=10, r=10, t=40, b=10)
+    )
+    if horizontal:
+        fig.update_xaxes(title=ylabel)
+    else:
+        fig.update_yaxes(title=ylabel)
+    return fig
+
+
+def plotly_torta(serie, titulo):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Pie(labels=serie.index.astype(str), values=serie.values, sort=False))
+    fig.update_layout(title=titulo, margin=dict(l=10, r=10, t=40, b=10))
+    return fig
+
+
+# --- Reducción de puntos para series largas ---
+
+PUNTOS_MAX_SERIE = 500
+
+
+def lttb(x, y, n_puntos=PUNTOS_MAX_SERIE):
+    """
+    Largest-Triangle-Three-Buckets: devuelve las posiciones de `n_puntos` puntos de la serie
+    (x, y) que conservan su forma visual (picos y valles incluidos). `x` debe ser numérico y
+    creciente (para fechas, p. ej. `fechas.astype("int64")`). El primero y el último se conservan.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_puntos >= n or n_puntos < 3:
+        return np.arange(n)
+    # Cubos de tamaño similar entre el primer y el último punto
+    bordes = np.linspace(1, n - 1, n_puntos - 1).astype(int)
+    elegidos = np.empty(n_puntos, dtype=int)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    anterior = 0
+    for i in range(n_puntos - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        # El tercer vértice es el promedio del cubo siguiente
+        sig_ini, sig_fin = fin, bordes[i + 2] if i + 2 < len(bordes) else n
+        x_prom, y_prom = x[sig_ini:sig_fin].mean(), y[sig_ini:sig_fin].mean()
+        areas = np.abs(
+            (x[anterior] - x_prom) * (y[ini:fin] - y[anterior])
+            - (x[anterior] - x[ini:fin]) * (y_prom - y[anterior])
+        )
+        anterior = ini + int(np.argmax(areas))
+        elegidos[i + 1] = anterior
+    return elegidos
+
+
+def reducir_series(df, n_puntos=PUNTOS_MAX_SERIE, x="fecha", y="valor", serie="serie"):
+    """
+    Pasa un DataFrame ancho (índice de fechas, una columna por serie) a formato largo con como
+    mucho `n_puntos` puntos por serie, elegidos con LTTB. Así el navegador recibe un número de
+    puntos acotado sin importar la longitud del historial.
+    """
+    partes = []
+    for col in df.columns:
+        valores = df[col].dropna()
+        if valores.empty:
+            continue
+        posiciones = lttb(valores.index.asi8, valores.to_numpy(), n_puntos)
+        partes.append(pd.DataFrame({
+            x: valores.index[posiciones], y: valores.to_numpy()[posiciones], serie: col
+        }))
+    if not partes:
+        return pd.DataFrame(columns=[x, y, serie])
+    return pd.concat(partes, ignore_index=True)
@@ -0,0 +1,409 @@
+import datetime
+import gzip
+import io
+import json
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.data_loader import obtener_derivado, derivado_vigente, descartar_derivado
+from modules.drive_utils import obtener_o_crear_carpetas, subir_a_drive, descargar_de_drive
+from modules.exportar import escribir_parquet, parquet_disponible
+from modules.sheets_utils import COLUMNA_ESCRITURA, anexar_filas, archivar_filas, load_hoja_opcional, load_movimientos_data
+
+HOJA_CAMBIOS = "cambios"
+HOJA_SNAPSHOTS = "snapshots"
+# Eventos anteriores al último snapshot: se sacan de "cambios" al compactar y solo se leen para
+# consultar fechas anteriores a ese snapshot
+HOJA_ARCHIVO = "cambios_archivo"
+CARPETA_SNAPSHOTS = "historial"
+# Pasado este número de eventos desde el último snapshot se compacta uno nuevo
+EVENTOS_POR_SNAPSHOT = 5000
+# Tras un fallo la compactación automática espera 1, 2, 4... minutos (hasta una hora)
+ESPERA_COMPACTAR = 60
+ESPERA_COMPACTAR_MAX = 3600
+
+ALTA = "alta"
+EDICION = "edicion"
+RECATEGORIZACION = "recategorizacion"
+# version_fila: versión de la fila después del evento ("version" es la de la propia fila del log)
+COLUMNAS_EVENTO = ["evento_id", "fecha_evento", "tipo_evento", "id", "version_fila", "usuario", "valores", "anteriores"]
+# Sellos de la edición: ya quedan en fecha_evento/usuario/evento_id del evento
+COLUMNAS_SELLO = ["editado_por", "fecha_edicion", COLUMNA_ESCRITURA]
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _a_json(valores):
+    limpio = {}
+    for col, valor in valores.items():
+        if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+            valor = None
+        elif isinstance(valor, (pd.Timestamp, datetime.date)):
+            valor = valor.strftime("%Y-%m-%d")
+        elif hasattr(valor, "item"):
+            valor = valor.item()
+        limpio[col] = valor
+    return json.dumps(limpio, ensure_ascii=False, default=str)
+
+
+def _eventos(tipos, ids, versiones, valores, anteriores):
+    ahora = datetime.datetime.now().strftime(FORMATO_FECHA)
+    return pd.DataFrame({
+        "evento_id": [uuid.uuid4().hex for _ in ids],
+        "fecha_evento": ahora,
+        "tipo_evento": tipos,
+        "id": [str(i) for i in ids],
+        "version_fila": versiones,
+        "usuario": st.session_state.get("username", "anon"),
+        "valores": [_a_json(v) for v in valores],
+        "anteriores": [_a_json(a) for a in anteriores],
+    }, columns=COLUMNAS_EVENTO)
+
+
+def eventos_alta(nuevos_df):
+    """Un evento "alta" por fila nueva con la fila completa tal como la produjo el parser o el formulario."""
+    filas = nuevos_df.to_dict("records")
+    return _eventos([ALTA] * len(filas), [f["id"] for f in filas], [f.get("version", 1) for f in filas], filas, [{}] * len(filas))
+
+
+def eventos_edicion(antes_df, cambios):
+    """
+    Un evento por fila editada a partir de los `cambios` ({id: {columna: valor}}) ya guardados,
+    con los valores anteriores de `antes_df`. Si solo cambió la categoría es una recategorización.
+    """
+    anteriores = antes_df.drop_duplicates("id").set_index("id")
+    tipos, versiones, valores, previos = [], [], [], []
+    for id_mov, cambio in cambios.items():
+        cambio = {c: v for c, v in cambio.items() if c not in COLUMNAS_SELLO}
+        versiones.append(cambio.pop("version", None))
+        editadas = set(cambio) - {"contraparte"}
+        tipos.append(RECATEGORIZACION if editadas == {"categoría"} else EDICION)
+        valores.append(cambio)
+        fila = anteriores.loc[id_mov] if id_mov in anteriores.index else pd.Series(dtype=object)
+        previos.append({c: fila.get(c) for c in cambio})
+    return _eventos(tipos, list(cambios), versiones, valores, previos)
+
+
+def _tabla_cambios(eventos, columna):
+    """Eventos en formato largo (id, columna, valor), en el orden de `eventos`."""
+    filas = [
+        (id_mov, col, valor)
+        for id_mov, contenido in zip(eventos["id"], eventos[columna])
+        for col, valor in json.loads(contenido or "{}").items()
+    ]
+    return pd.DataFrame(filas, columns=["id", "columna", "valor"])
+
+
+def _aplicar(estado, cambios):
+    """Asigna a `estado` (indexado por id) el valor de cada (id, columna) de `cambios`."""
+    cambios = cambios[cambios["id"].isin(estado.index)]
+    for col, grupo in cambios.groupby("columna", sort=False):
+        if col not in estado.columns:
+            estado[col] = None
+        estado[col] = estado[col].astype(object)
+        estado.loc[grupo["id"].to_numpy(), col] = grupo["valor"].to_numpy()
+    return estado
+
+
+def _escribir_snapshot(movimientos):
+    """Contenido, nombre de extensión y mimetype del snapshot: Parquet (zstd) o, sin pyarrow, CSV gzip."""
+    if parquet_disponible():
+        destino = io.BytesIO()
+        escribir_parquet(movimientos, destino, compression="zstd")
+        return destino.getvalue(), "parquet", "application/vnd.apache.parquet"
+    return gzip.compress(movimientos.to_csv(index=False).encode("utf-8")), "csv.gz", "application/gzip"
+
+
+def _leer_snapshot(contenido):
+    """Estado de un snapshot; los anteriores a Parquet son CSV gzip."""
+    if contenido[:4] == b"PAR1":
+        return pd.read_parquet(io.BytesIO(contenido)).astype({"id": str})
+    return pd.read_csv(io.BytesIO(contenido), compression="gzip", dtype={"id": str})
+
+
+class HistorialMovimientos:
+    """
+    Log de cambios de movimientos (hoja "cambios", solo se anexa) más snapshots compactados del
+    estado completo (Parquet en Drive, registrados en la hoja "snapshots"). Al compactar, los
+    eventos hasta el corte pasan a "cambios_archivo": la sesión lee el último snapshot y la cola,
+    y `cargar_archivo()` trae el resto solo si se consulta antes del último corte.
+
+    El estado en una fecha es el snapshot anterior más la cola de eventos hasta esa fecha. Antes
+    del primer snapshot se parte del siguiente (o del estado actual) y se deshacen los eventos con
+    sus valores anteriores. Para consultar una fila, los eventos están ordenados por (id, fecha):
+    los de un id son un bloque contiguo y el corte por fecha es una búsqueda binaria.
+    """
+
+    def __init__(self, eventos_df, snapshots_df, cargar_archivo=None):
+        self._snapshots = (
+            snapshots_df.assign(fecha_corte=pd.to_datetime(snapshots_df["fecha_corte"]))
+            .sort_values("fecha_corte", ignore_index=True)
+            if snapshots_df is not None and not snapshots_df.empty
+            else pd.DataFrame(columns=["snapshot_id", "fecha_corte", "filas"])
+        )
+        self._estados = {}
+        # Compactaciones del proceso que ya estaban hechas al cargarlo (ver `Compactador`)
+        self.compactaciones = 0
+        self._cargar_archivo = cargar_archivo if not self._snapshots.empty else None
+        self._eventos = pd.DataFrame(columns=COLUMNAS_EVENTO).astype({"fecha_evento": "datetime64[ns]", "id": str})
+        self.anexar_eventos(eventos_df)
+
+    def anexar_eventos(self, eventos_df):
+        if eventos_df is not None and not eventos_df.empty:
+            nuevos = eventos_df.reindex(columns=COLUMNAS_EVENTO).assign(
+                id=eventos_df["id"].astype(str), fecha_evento=pd.to_datetime(eventos_df["fecha_evento"])
+            )
+            self._eventos = nuevos if self._eventos.empty else pd.concat([self._eventos, nuevos], ignore_index=True)
+        # Un evento puede estar en la cola y en el archivo si se cortó un archivado a la mitad
+        self._eventos = self._eventos.drop_duplicates("evento_id").sort_values(["fecha_evento", "evento_id"], ignore_index=True)
+        por_id = self._eventos.sort_values(["id", "fecha_evento"], kind="stable")
+        self._por_id = por_id.index.to_numpy()
+        ids = por_id["id"].to_numpy()
+        self._ids, inicio = np.unique(ids, return_index=True)
+        self._bloques = np.append(inicio, len(ids))
+        self._fechas_por_id = por_id["fecha_evento"].to_numpy()
+
+    # El log se actualiza en `registrar_eventos`; así el historial sobrevive a los cambios de versión
+    def anexar(self, nuevos_df):
+        pass
+
+    def actualizar(self, antes_df, despues_df):
+        pass
+
+    @property
+    def eventos(self):
+        """Eventos cargados: la cola desde el último snapshot y, si ya se pidió, el archivo."""
+        return self._eventos
+
+    def _completar(self, desde):
+        """Carga el archivo si hacen falta eventos posteriores a `desde` y anteriores al último corte."""
+        if self._cargar_archivo is None:
+            return
+        if desde is None or pd.Timestamp(desde) < self._snapshots["fecha_corte"].iloc[-1]:
+            cargar, self._cargar_archivo = self._cargar_archivo, None
+            self.anexar_eventos(cargar())
+
+    def eventos_desde_snapshot(self):
+        if self._snapshots.empty:
+            return len(self._eventos)
+        return int((self._eventos["fecha_evento"] > self._snapshots["fecha_corte"].iloc[-1]).sum())
+
+    def eventos_de(self, id_mov, desde=None, hasta=None):
+        """Eventos de un movimiento con desde < fecha_evento <= hasta, sin recorrer el log completo."""
+        self._completar(desde)
+        k = np.searchsorted(self._ids, str(id_mov))
+        if k >= len(self._ids) or self._ids[k] != str(id_mov):
+            return self._eventos.iloc[:0]
+        a, b = self._bloques[k], self._bloques[k + 1]
+        fechas = self._fechas_por_id[a:b]
+        i = a if desde is None else a + np.searchsorted(fechas, np.datetime64(pd.Timestamp(desde)), side="right")
+        j = b if hasta is None else a + np.searchsorted(fechas, np.datetime64(pd.Timestamp(hasta)), side="right")
+        return self._eventos.iloc[self._por_id[i:max(i, j)]]
+
+    def _entre(self, desde, hasta, ids=None):
+        """Eventos con desde < fecha_evento <= hasta, en orden; con `ids`, solo los bloques de esos ids."""
+        if ids is not None:
+            partes = [self.eventos_de(i, desde, hasta) for i in ids]
+            return pd.concat(partes).sort_values(["fecha_evento", "evento_id"]) if partes else self._eventos.iloc[:0]
+        self._completar(desde)
+        fechas = self._eventos["fecha_evento"]
+        return self._eventos[(fechas > desde) & (fechas <= hasta)]
+
+    def _snapshot(self, posicion, actual_df, ids=None):
+        """Estado (indexado por id) del snapshot en `posicion`; la posición final es el estado actual."""
+        if posicion == len(self._snapshots):
+            if ids is not None:
+                actual_df = actual_df[actual_df["id"].astype(str).isin(ids)]
+            return actual_df.astype({"id": str}).drop_duplicates("id").set_index("id", drop=False)
+        snapshot_id = self._snapshots["snapshot_id"].iloc[posicion]
+        if snapshot_id not in self._estados:
+            ok, contenido = descargar_de_drive([snapshot_id])[snapshot_id]
+            if not ok:
+                raise RuntimeError(f"No se pudo descargar el snapshot {snapshot_id}: {contenido}")
+            df = _leer_snapshot(contenido)
+            self._estados[snapshot_id] = df.drop_duplicates("id").set_index("id", drop=False)
+        estado = self._estados[snapshot_id]
+        return estado if ids is None else estado[estado.index.isin(ids)]
+
+    def estado_en(self, fecha, actual_df, ids=None):
+        """
+        Movimientos tal como estaban en `fecha` (solo los de `ids`, si se pasa).
+        `actual_df` es el estado actual: hace de último snapshot.
+        """
+        fecha = pd.Timestamp(fecha)
+        ids = None if ids is None else [str(i) for i in ids]
+        cortes = self._snapshots["fecha_corte"]
+        previo = int(np.searchsorted(cortes.to_numpy(), np.datetime64(fecha), side="right")) - 1
+        if previo >= 0:
+            # Snapshot anterior + cola de eventos hasta la fecha
+            base = self._snapshot(previo, actual_df, ids)
+            eventos = self._entre(cortes.iloc[previo], fecha, ids)
+            anteriores = False
+        else:
+            # Antes del primer snapshot: se parte del siguiente y se deshacen los eventos
+            base = self._snapshot(0, actual_df, ids)
+            hasta = cortes.iloc[0] if len(cortes) else pd.Timestamp.max
+            eventos = self._entre(fecha, hasta, ids).iloc[::-1]
+            anteriores = True
+        estado = base.copy()
+
+        altas = eventos[eventos["tipo_evento"] == ALTA]
+        if anteriores:
+            # Deshacer: las altas posteriores a la fecha no existían; del resto, el valor anterior
+            # del evento más antiguo de cada (id, columna) es el que regía en la fecha
+            estado = estado[~estado.index.isin(altas["id"])]
+            cambios = _tabla_cambios(eventos[eventos["tipo_evento"] != ALTA], "anteriores")
+        else:
+            if not altas.empty:
+                filas = pd.DataFrame([json.loads(v) for v in altas["valores"]]).astype({"id": str})
+                filas = filas.drop_duplicates("id", keep="last").set_index("id", drop=False)
+                estado = pd.concat([estado[~estado.index.isin(filas.index)], filas])
+            cambios = _tabla_cambios(eventos[eventos["tipo_evento"] != ALTA], "valores")
+        cambios = cambios.drop_duplicates(["id", "columna"], keep="last")
+        return _aplicar(estado, cambios).reset_index(drop=True)
+
+    def fila_en(self, id_mov, fecha, actual_df):
+        """Cómo estaba el movimiento `id_mov` en `fecha` (None si todavía no existía)."""
+        estado = self.estado_en(fecha, actual_df, ids=[id_mov])
+        return None if estado.empty else estado.iloc[0]
+
+    def reconstruir(self, actual_df):
+        """Estado actual a partir del último snapshot más la cola del log."""
+        return self.estado_en(pd.Timestamp.now(), actual_df)
+
+
+class Compactador:
+    """
+    Compacta el historial en un hilo aparte, una compactación a la vez por proceso, para que
+    guardar no espere a leer la hoja completa ni a subir el snapshot. Tras cada fallo la
+    compactación automática espera el doble que la vez anterior; el último error queda en
+    `ultimo_error` para mostrarlo.
+    """
+
+    def __init__(self, espera=ESPERA_COMPACTAR, espera_max=ESPERA_COMPACTAR_MAX):
+        self.espera = espera
+        self.espera_max = espera_max
+        self._lock = threading.Lock()
+        self.en_curso = False
+        self.fallos = 0
+        self.ultimo_error = None
+        self.reintentar_desde = 0.0
+        self.ultimo_resultado = None
+        # Las sesiones comparan este número con el de su historial para recargarlo
+        self.completadas = 0
+
+    def pedir(self, usuario="anon", forzar=False):
+        """
+        Lanza una compactación si no hay otra en curso y no se está esperando tras un fallo
+        (`forzar` salta la espera). Devuelve si la lanzó.
+        """
+        with self._lock:
+            if self.en_curso or (not forzar and time.time() < self.reintentar_desde):
+                return False
+            self.en_curso = True
+        threading.Thread(target=self._ejecutar, args=(usuario,), daemon=True).start()
+        return True
+
+    def _ejecutar(self, usuario):
+        try:
+            ok, msg = compactar(usuario)
+        except Exception as e:
+            ok, msg = False, f"Error al compactar el historial: {e}"
+        with self._lock:
+            self.en_curso = False
+            if ok:
+                self.fallos = 0
+                self.ultimo_error = None
+                self.reintentar_desde = 0.0
+                self.ultimo_resultado = (datetime.datetime.now(), msg)
+                self.completadas += 1
+            else:
+                self.fallos += 1
+                self.ultimo_error = (datetime.datetime.now(), msg)
+                self.reintentar_desde = time.time() + min(self.espera * 2 ** (self.fallos - 1), self.espera_max)
+
+
+@st.cache_resource
+def get_compactador():
+    """Compactador del proceso (uno solo para todas las sesiones)."""
+    return Compactador()
+
+
+def _cargar_historial():
+    completadas = get_compactador().completadas
+    historial = HistorialMovimientos(
+        load_hoja_opcional(HOJA_CAMBIOS), load_hoja_opcional(HOJA_SNAPSHOTS),
+        cargar_archivo=lambda: load_hoja_opcional(HOJA_ARCHIVO),
+    )
+    historial.compactaciones = completadas
+    return historial
+
+
+def _historial_cargado():
+    """El historial de la sesión si ya está cargado y no hubo una compactación después; si no, None."""
+    historial = derivado_vigente("historial")
+    if historial is not None and historial.compactaciones != get_compactador().completadas:
+        # Sigue siendo correcto, pero se relee para partir del snapshot nuevo y una cola corta
+        descartar_derivado("historial")
+        return None
+    return historial
+
+
+def get_historial():
+    """Historial de cambios (se carga de Sheets la primera vez que se pide en la sesión)."""
+    return _historial_cargado() or obtener_derivado("historial", _cargar_historial)
+
+
+def registrar_eventos(eventos_df):
+    """
+    Anexa los eventos a la hoja "cambios" (y al historial cargado en la sesión). Si desde el
+    último snapshot se acumularon `EVENTOS_POR_SNAPSHOT` eventos, pide una compactación en
+    segundo plano (ver `Compactador`).
+    """
+    if eventos_df is None or eventos_df.empty:
+        return True, "Sin eventos"
+    ok, msg, anexados = anexar_filas(eventos_df, HOJA_CAMBIOS, columna_clave="evento_id")
+    historial = _historial_cargado()
+    if ok and historial is not None:
+        historial.anexar_eventos(anexados)
+        if historial.eventos_desde_snapshot() >= EVENTOS_POR_SNAPSHOT:
+            get_compactador().pedir(st.session_state.get("username", "anon"))
+    return ok, msg
+
+
+def compactar(usuario="anon"):
+    """
+    Guarda en Drive un snapshot del estado completo de la hoja "movimientos", lo registra en
+    la hoja "snapshots" y pasa los eventos hasta el corte a "cambios_archivo". El corte se toma
+    antes de leer la hoja: los eventos que lleguen mientras se lee se vuelven a aplicar al
+    reconstruir, y aplicar dos veces el mismo valor no cambia nada. No usa la sesión: se
+    ejecuta en el hilo del `Compactador`.
+    """
+    corte = datetime.datetime.now().strftime(FORMATO_FECHA)
+    movimientos = load_movimientos_data("movimientos")
+    if movimientos.empty:
+        return False, "No hay movimientos para compactar"
+    contenido, extension, mimetype = _escribir_snapshot(movimientos)
+    carpeta = obtener_o_crear_carpetas([CARPETA_SNAPSHOTS]).get(CARPETA_SNAPSHOTS)
+    ok, snapshot_id = subir_a_drive(f"movimientos_{corte[:19].replace(':', '-')}.{extension}", contenido, mimetype, carpeta)
+    if not ok:
+        return False, f"No se pudo subir el snapshot: {snapshot_id}"
+    registro = pd.DataFrame([{
+        "snapshot_id": snapshot_id, "fecha_corte": corte, "filas": len(movimientos),
+        "usuario": usuario,
+    }])
+    ok, msg, _ = anexar_filas(registro, HOJA_SNAPSHOTS, columna_clave="snapshot_id")
+    if not ok:
+        return False, msg
+    limite = pd.Timestamp(datetime.datetime.strptime(corte, FORMATO_FECHA))
+    ok, msg_archivo, _ = archivar_filas(
+        HOJA_CAMBIOS, HOJA_ARCHIVO, "evento_id",
+        lambda eventos: pd.to_datetime(eventos["fecha_evento"], errors="coerce") <= limite,
+    )
+    mensaje = f"Snapshot de {len(movimientos):,} movimientos guardado"
+    # Sin archivar, el snapshot sigue siendo válido: la cola solo queda más larga
+    return True, f"{mensaje}; {msg_archivo}" if ok else f"{mensaje}, pero no se archivó el log: {msg_archivo}"
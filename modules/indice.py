@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from modules.data_loader import obtener_derivado
+
+COLUMNAS_CODIFICADAS = ["banco", "categoría", "tipo"]
+
+
+def _normalizar(movimientos_df):
+    df = movimientos_df.copy()
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    df["monto"] = pd.to_numeric(df["monto"], errors="coerce")
+    df["banco"] = df["banco"].fillna("").astype(str)
+    df["tipo"] = df["tipo"].fillna("").astype(str).str.lower()
+    df["categoría"] = df["categoría"].fillna("Sin Categoría")
+    return df
+
+
+class IndiceMovimientos:
+    """
+    Índice de consulta sobre los movimientos, construido una vez por versión de datos.
+
+    - `df`: movimientos normalizados y ordenados por fecha, indexados por su posición en
+      `movimientos_df`. Un rango de fechas es una búsqueda binaria y el resultado es un slice
+      contiguo (vista, sin copiar filas).
+    - `df_bancos`: la misma tabla ordenada por (banco, fecha). Cada banco ocupa un bloque
+      contiguo, así que banco + rango de fechas también es un slice.
+    - banco/categoría/tipo se guardan además como códigos enteros (categorías precalculadas):
+      los filtros por lista se resuelven con `np.isin` sobre los códigos del slice, no sobre
+      cadenas de toda la tabla.
+
+    Las vistas devueltas comparten memoria con el índice: hay que copiarlas antes de modificarlas.
+    """
+
+    def __init__(self, movimientos_df):
+        base = _normalizar(movimientos_df)
+        self.categorias = {}
+        codigos_base = {}
+        for col in COLUMNAS_CODIFICADAS:
+            codigos, categorias = pd.factorize(base[col].astype(str), sort=True)
+            self.categorias[col] = categorias
+            codigos_base[col] = codigos
+
+        fechas = base["fecha"].to_numpy()
+        # numpy ordena NaT al final, así el rango de fechas válidas queda contiguo
+        orden = np.argsort(fechas, kind="stable")
+        # lexsort ordena por la última clave: banco y, dentro de cada banco, fecha (NaT al final)
+        orden_bancos = np.lexsort((fechas[orden], np.isnat(fechas[orden]), codigos_base["banco"][orden]))
+        orden_bancos = orden[orden_bancos]
+        self.df = base.take(orden)
+        self.df_bancos = base.take(orden_bancos)
+        # El índice de las filas es su posición en movimientos_df (lo usa la búsqueda de texto).
+        # Se reemplaza directamente: reset_index copiaría todas las columnas otra vez
+        self.df.index = pd.Index(orden)
+        self.df_bancos.index = pd.Index(orden_bancos)
+        self._codigos = {col: c[orden] for col, c in codigos_base.items()}
+        self._codigos_bancos = {col: c[orden_bancos] for col, c in codigos_base.items()}
+
+        self._fechas = self.df["fecha"].to_numpy()
+        self._fechas_bancos = self.df_bancos["fecha"].to_numpy()
+        # Bloque [inicio, fin) de cada banco dentro de df_bancos
+        codigos = self._codigos_bancos["banco"]
+        cortes = np.flatnonzero(np.diff(codigos)) + 1
+        inicios = np.concatenate(([0], cortes))
+        fines = np.concatenate((cortes, [len(codigos)]))
+        self._bloques_banco = {
+            self.categorias["banco"][codigos[i]]: (i, f) for i, f in zip(inicios, fines) if len(codigos)
+        }
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def fecha_min(self):
+        return self.df["fecha"].min()
+
+    @property
+    def fecha_max(self):
+        return self.df["fecha"].max()
+
+    @property
+    def bancos(self):
+        return [b for b in self.categorias["banco"] if b]
+
+    def _rango(self, fechas, inicio, fin, fecha_ini, fecha_fin):
+        """Posiciones [i, j) con fecha_ini <= fecha <= fecha_fin dentro de fechas[inicio:fin]."""
+        i = inicio if fecha_ini is None else inicio + np.searchsorted(
+            fechas[inicio:fin], np.datetime64(pd.Timestamp(fecha_ini)), side="left")
+        j = fin if fecha_fin is None else inicio + np.searchsorted(
+            fechas[inicio:fin], np.datetime64(pd.Timestamp(fecha_fin)), side="right")
+        return i, max(i, j)
+
+    def _mascara(self, codigos, i, j, filtros):
+        mascara = None
+        for col, valores in filtros.items():
+            if valores is None:
+                continue
+            buscados = self.categorias[col].get_indexer([str(v) for v in valores])
+            parcial = np.isin(codigos[col][i:j], buscados[buscados >= 0])
+            mascara = parcial if mascara is None else mascara & parcial
+        return mascara
+
+    def consultar(self, fecha_ini=None, fecha_fin=None, bancos=None, categorias=None, tipos=None):
+        """
+        Movimientos que cumplen los filtros (`None` = sin filtrar). Mismos argumentos que
+        `CuboAgregado.consultar`. Sin filtros de lista devuelve una vista (slice contiguo).
+        """
+        tipos = None if tipos is None else [str(t).lower() for t in tipos]
+        if bancos is not None and len(bancos) == 1:
+            # Un solo banco: se busca dentro de su bloque contiguo
+            inicio, fin = self._bloques_banco.get(str(bancos[0]), (0, 0))
+            i, j = self._rango(self._fechas_bancos, inicio, fin, fecha_ini, fecha_fin)
+            base, codigos, bancos = self.df_bancos, self._codigos_bancos, None
+        else:
+            i, j = self._rango(self._fechas, 0, len(self.df), fecha_ini, fecha_fin)
+            base, codigos = self.df, self._codigos
+
+        vista = base.iloc[i:j]
+        mascara = self._mascara(codigos, i, j, {"banco": bancos, "categoría": categorias, "tipo": tipos})
+        return vista if mascara is None else vista[mascara]
+
+
+def get_indice(movimientos_df):
+    """Índice de la versión de datos actual (se construye la primera vez que se pide)."""
+    return obtener_derivado("indice", lambda: IndiceMovimientos(movimientos_df))
@@ -1,11 +1,15 @@
 import streamlit as st
 import pandas as pd
 
+from modules.exportar import descarga_bajo_demanda, generar_archivo, escribir_csv
+from modules.indice import get_indice
+from modules.busqueda import get_busqueda
+from modules.tabla import tabla_paginada
+
 def render(movimientos_df):
     st.title("💰 Registro de Ingresos")
     st.caption("Visualiza y filtra los ingresos registrados en la base de datos unificada.")
-    movimientos_df['tipo'] = movimientos_df['tipo'].astype(str).fillna('')
-    ingresos_df = movimientos_df[movimientos_df['tipo'].str.lower() == 'ingreso'].copy()
+    indice = get_indice(movimientos_df)
     # Filtros
     col1, col2 = st.columns(2)
     with col1:
@@ -13,19 +17,17 @@ def render(movimientos_df):
     with col2:
         fecha_hasta = st.date_input("Hasta", pd.to_datetime('today'))
     # Aplicar filtros
-    ingresos_df["fecha"] = pd.to_datetime(ingresos_df["fecha"])
-    filtered_df = ingresos_df[
-        (ingresos_df["fecha"] >= pd.Timestamp(fecha_desde)) & 
-        (ingresos_df["fecha"] <= pd.Timestamp(fecha_hasta))
-    ]
+    # Búsqueda binaria sobre el índice ordenado por fecha (sin recorrer toda la tabla)
+    filtered_df = indice.consultar(pd.Timestamp(fecha_desde), pd.Timestamp(fecha_hasta), tipos=['ingreso'])
     # Mostrar tabla adaptable a columnas existentes
     columnas_ingreso = ["fecha", "banco", "descripción", "categoría", "monto", "archivo"]
-    for col in columnas_ingreso:
-        if col not in filtered_df.columns:
-            filtered_df[col] = ""
-    display_df = filtered_df[columnas_ingreso].sort_values("fecha", ascending=False)
-    display_df["monto"] = display_df["monto"].astype(float).map("${:,.2f}".format)
-    st.dataframe(display_df, hide_index=True, use_container_width=True)
+    # reindex devuelve una copia con las columnas que falten vacías (la consulta es una vista)
+    filtered_df = filtered_df.reindex(columns=list(dict.fromkeys(list(filtered_df.columns) + columnas_ingreso)), fill_value="")
+    # Solo se formatea y envía la página visible; el monto sigue siendo numérico
+    tabla_paginada(
+        filtered_df, "ingresos", columnas=columnas_ingreso, filtros={"desde": fecha_desde, "hasta": fecha_hasta},
+        busqueda=get_busqueda(movimientos_df)
+    )
     # Resumen
     st.metric(
         "Total en el período", 
@@ -33,10 +35,9 @@ def render(movimientos_df):
         help="Total de ingresos en el período seleccionado"
     )
     # Opción para exportar
-    csv = filtered_df.to_csv(index=False).encode('utf-8')
-    st.download_button(
+    descarga_bajo_demanda(
         "📥 Exportar a CSV",
-        data=csv,
-        file_name=f"ingresos_{fecha_desde}_{fecha_hasta}.csv",
-        mime="text/csv",
+        f"ingresos_{fecha_desde}_{fecha_hasta}.csv",
+        lambda: generar_archivo(escribir_csv, filtered_df),
+        {"desde": fecha_desde, "hasta": fecha_hasta},
     )
@@ -0,0 +1,177 @@
+"""
+Instrumentación: tiempos y contadores de render de páginas, llamadas a Google (Sheets, Drive,
+Gemini), etapas de parseo y gráficos.
+
+    with medir("dashboard", "página"): ...
+    @instrumentado("sheets")
+    def load_movimientos_data(...): ...
+
+Las mediciones van a un registro del proceso (compartido entre sesiones) que guarda una ventana
+de duraciones por nombre para los percentiles y los últimos eventos, cada uno con la sesión y el
+número de rerun en que ocurrió. En hilos sin contexto de Streamlit se miden igual, pero no se
+pueden atribuir a un rerun. El panel de la barra lateral (solo administradores) muestra el
+desglose del último rerun, los percentiles y exporta los eventos como JSON lines.
+"""
+import functools
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Duraciones por nombre sobre las que se calculan los percentiles
+VENTANA = 500
+EVENTOS_MAX = 20_000
+PERCENTILES = (50, 90, 99)
+
+
+def _sesion():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+class Metricas:
+    """Registro de mediciones del proceso. Es seguro usarlo desde varios hilos."""
+
+    def __init__(self, ventana=VENTANA, eventos_max=EVENTOS_MAX):
+        self._lock = threading.Lock()
+        self._duraciones = defaultdict(lambda: deque(maxlen=ventana))
+        self._categorias = {}
+        self.contadores = Counter()
+        self.eventos = deque(maxlen=eventos_max)
+        # sesión -> (número de rerun, página)
+        self._reruns = {}
+
+    def iniciar_rerun(self, sesion, pagina):
+        with self._lock:
+            numero = self._reruns.get(sesion, (0, None))[0] + 1
+            self._reruns[sesion] = (numero, pagina)
+
+    def rerun(self, sesion):
+        return self._reruns.get(sesion, (0, None))
+
+    def registrar(self, nombre, categoria, ms, sesion, ok=True):
+        numero, pagina = self.rerun(sesion)
+        evento = {
+            "ts": round(time.time(), 3), "sesion": sesion, "rerun": numero, "pagina": pagina,
+            "nombre": nombre, "categoria": categoria, "ms": round(ms, 2), "ok": ok,
+        }
+        with self._lock:
+            self._duraciones[nombre].append(ms)
+            self._categorias[nombre] = categoria
+            self.eventos.append(evento)
+
+    def contar(self, nombre, n=1):
+        with self._lock:
+            self.contadores[nombre] += n
+
+    def percentiles(self):
+        """Por nombre: llamadas en la ventana, p50/p90/p99 y máximo en ms (las más lentas primero)."""
+        with self._lock:
+            ventanas = {nombre: np.array(d) for nombre, d in self._duraciones.items() if d}
+        filas = []
+        for nombre, ms in ventanas.items():
+            fila = {"nombre": nombre, "categoría": self._categorias.get(nombre, ""), "n": len(ms)}
+            fila.update({f"p{p}": v for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))})
+            fila["máx"] = ms.max()
+            filas.append(fila)
+        columnas = ["nombre", "categoría", "n", *(f"p{p}" for p in PERCENTILES), "máx"]
+        return pd.DataFrame(filas, columns=columnas).sort_values(f"p{PERCENTILES[1]}", ascending=False).round(1)
+
+    def del_rerun(self, sesion, numero=None):
+        """Eventos del rerun `numero` (el actual por defecto) de una sesión, en orden."""
+        numero = numero if numero is not None else self.rerun(sesion)[0]
+        with self._lock:
+            eventos = [e for e in self.eventos if e["sesion"] == sesion and e["rerun"] == numero]
+        return pd.DataFrame(eventos, columns=["nombre", "categoria", "ms", "ok"])
+
+    def a_jsonl(self):
+        with self._lock:
+            eventos = list(self.eventos)
+        return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in eventos).encode("utf-8")
+
+    def reiniciar(self):
+        with self._lock:
+            self._duraciones.clear()
+            self._categorias.clear()
+            self.contadores.clear()
+            self.eventos.clear()
+            # Las sesiones vuelven a numerar sus reruns desde 1 (ya no quedan eventos con los anteriores)
+            self._reruns.clear()
+
+
+@st.cache_resource
+def get_metricas():
+    """Registro de métricas del proceso (uno solo para todas las sesiones)."""
+    return Metricas()
+
+
+def iniciar_rerun(pagina):
+    """Marca el comienzo de un rerun: las mediciones siguientes de la sesión se agrupan en él."""
+    get_metricas().iniciar_rerun(_sesion(), pagina)
+
+
+@contextmanager
+def medir(nombre, categoria=""):
+    """Mide el bloque y lo registra aunque termine con una excepción (con ok=False)."""
+    inicio = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        get_metricas().registrar(nombre, categoria, (time.perf_counter() - inicio) * 1000, _sesion(), ok)
+
+
+def instrumentado(categoria, nombre=None):
+    """Decorador: mide cada llamada a la función como `categoria.nombre` (por defecto el de la función)."""
+    def decorador(funcion):
+        etiqueta = f"{categoria}.{nombre or funcion.__qualname__}"
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(etiqueta, categoria):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def contar(nombre, n=1):
+    get_metricas().contar(nombre, n)
+
+
+def panel_metricas():
+    """Panel de la barra lateral con el desglose del rerun, los percentiles y la exportación."""
+    from modules.exportar import descarga_bajo_demanda, generar_archivo
+
+    metricas = get_metricas()
+    sesion = _sesion()
+    with st.sidebar.expander("⏱️ Métricas"):
+        numero, pagina = metricas.rerun(sesion)
+        rerun = metricas.del_rerun(sesion, numero)
+        st.caption(f"Rerun {numero} · {pagina or '—'} · {rerun['ms'].sum():,.0f} ms medidos")
+        st.dataframe(rerun.round(1), hide_index=True, use_container_width=True)
+        if not rerun.empty:
+            st.bar_chart(rerun.groupby("categoria")["ms"].sum())
+
+        st.caption(f"Percentiles (ms) de las últimas {VENTANA} llamadas de cada nombre, todas las sesiones")
+        st.dataframe(metricas.percentiles(), hide_index=True, use_container_width=True)
+        if metricas.contadores:
+            st.caption("Contadores")
+            st.dataframe(
+                pd.Series(metricas.contadores, name="n").rename_axis("nombre").reset_index(),
+                hide_index=True, use_container_width=True
+            )
+        descarga_bajo_demanda(
+            "📥 Métricas (JSONL)", "metricas.jsonl",
+            lambda: generar_archivo(lambda destino: destino.write(metricas.a_jsonl())),
+            filtros={"eventos": len(metricas.eventos), "ultimo": metricas.eventos[-1]["ts"] if metricas.eventos else 0},
+            mime="application/jsonl",
+        )
+        if st.button("🧹 Reiniciar métricas", key="metricas_reiniciar"):
+            metricas.reiniciar()
@@ -2,6 +2,7 @@
 import pandas as pd
 import re
 from datetime import datetime
+from functools import lru_cache
 
 
 def normalizar_campo(valor):
@@ -77,6 +78,123 @@ def categorizar_movimiento(descripcion):
         return "Transfers"
     return "Uncategorized"
 
+# --- Contraparte canónica (cliente/proveedor) a partir de la descripción ---
+
+SIN_CONTRAPARTE = "Sin contraparte"
+CONTRAPARTE_MAX_PALABRAS = 3
+
+# Formatos con la contraparte en un lugar conocido (Wise, ACH de Chase)
+_CONTRAPARTE_EXPLICITA = [
+    re.compile(r"received money from (.+?)(?: with reference.*)?$", re.I),
+    re.compile(r"sent money to (.+?)(?: with reference.*)?$", re.I),
+    re.compile(r"orig co name:\s*(.+?)(?:\s+(?:orig id|desc date|co entry|sec|trace|eed|ind id|ind name)\b.*)?$", re.I),
+]
+_CONTRAPARTE_FIJA = [
+    (re.compile(r"^converted\b|\busd to eur\b", re.I), "Wise Conversion"),
+    (re.compile(r"^wise charges", re.I), "Wise"),
+]
+# Texto de relleno del banco antes del comercio
+_PREFIJOS = re.compile(
+    r"^(?:recurring card purchase|card purchase(?: with pin)?|debit card purchase|purchase authorized on|"
+    r"pos (?:debit|purchase)|ach (?:debit|credit)|zelle payment (?:to|from)|online payment to|"
+    r"online transfer (?:to|from)|payment (?:to|from)|direct deposit|incoming|outgoing)\b[\s:]*",
+    re.I,
+)
+# Prefijos de procesadores de pago: "SQ *CAFE", "TST* BAR", "PAYPAL *TIENDA"
+_PROCESADORES = re.compile(r"^(?:sq|tst|sp|pp|paypal|py|in)\s*\*\s*", re.I)
+_RUIDO = [
+    re.compile(r"\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b"),                   # fechas 01/15 y 01/15/2024
+    re.compile(r"\b\d{4}-\d{2}-\d{2}\b"),
+    re.compile(r"\bcard\s*(?:ending\s*(?:in)?\s*)?\d{4}\b", re.I),       # "Card 1234"
+    re.compile(r"(?:\.{2,}|x{2,}|\*{2,})\d{2,}", re.I),                   # "...1234", "XXXX1234"
+    re.compile(r"\b(?:ref(?:erence)?|trn|transaction|conf(?:irmation)?|trace|web id|ppd id|id)\b[#:\s]*\S*", re.I),
+    re.compile(r"\S*\d\S*"),                                                # tokens con números (referencias)
+    re.compile(r"\s+[A-Z]{2}\s*$"),                                                  # estado al final ("... WA")
+]
+
+
+@lru_cache(maxsize=100_000)
+def normalizar_contraparte(descripcion):
+    """
+    Contraparte canónica de una descripción bancaria: sin ids, fechas, finales de tarjeta ni
+    texto de relleno del banco ("Card Purchase 01/02 Amazon Mktplace Card 1234" -> "Amazon
+    Mktplace"). Las descripciones se repiten mucho, así que el resultado se memoiza.
+    """
+    texto = " ".join(str(descripcion or "").split())
+    for patron, fija in _CONTRAPARTE_FIJA:
+        if patron.search(texto):
+            return fija
+    for patron in _CONTRAPARTE_EXPLICITA:
+        m = patron.search(texto)
+        if m:
+            texto = m.group(1)
+            break
+    texto = _PROCESADORES.sub("", _PREFIJOS.sub("", texto))
+    # Lo que sigue a un "*" suele ser un número de orden ("AMAZON.COM*2K3L45")
+    texto = texto.split("*")[0]
+    for patron in _RUIDO:
+        texto = patron.sub(" ", texto)
+    palabras = re.sub(r"[^\w&' ]+", " ", texto).split()[:CONTRAPARTE_MAX_PALABRAS]
+    return " ".join(palabras).title() if palabras else SIN_CONTRAPARTE
+
+
+def agregar_contraparte(df_movimientos):
+    """
+    Completa la columna "contraparte" (categórica) a partir de "descripción". Cada descripción
+    distinta se normaliza una sola vez; las contrapartes que ya vienen cargadas se respetan.
+    """
+    if df_movimientos is None or "descripción" not in df_movimientos.columns:
+        return df_movimientos
+    df_movimientos = df_movimientos.copy()
+    codigos, descripciones = pd.factorize(df_movimientos["descripción"].fillna("").astype(str))
+    canonicas = pd.Series([normalizar_contraparte(d) for d in descripciones], dtype=object)
+    derivada = canonicas.to_numpy()[codigos] if len(descripciones) else []
+    if "contraparte" in df_movimientos.columns:
+        existente = df_movimientos["contraparte"].astype(object)
+        vacia = existente.isna() | (existente.astype(str).str.strip() == "")
+        derivada = existente.where(~vacia, pd.Series(derivada, index=df_movimientos.index))
+    df_movimientos["contraparte"] = pd.Categorical(derivada)
+    return df_movimientos
+
+
+# Encabezados de las secciones de detalle de Chase y el tipo de movimiento que contienen
+CHASE_SECCIONES = [
+    ("DEPOSITS AND ADDITIONS", "ingreso"),
+    ("CHECKS PAID", "egreso"),
+    ("ATM & DEBIT CARD WITHDRAWALS", "egreso"),
+    ("ELECTRONIC WITHDRAWALS", "egreso"),
+    ("OTHER WITHDRAWALS", "egreso"),
+    ("FEES", "egreso"),
+]
+
+def posiciones_secciones(texto, secciones):
+    """Lista ordenada (posición, tipo) de cada encabezado de sección encontrado en el texto."""
+    posiciones = []
+    for encabezado, tipo in secciones:
+        for m in re.finditer(re.escape(encabezado), texto):
+            posiciones.append((m.start(), tipo))
+    return sorted(posiciones)
+
+def tipo_en_posicion(posiciones, pos):
+    """Tipo de la última sección que empieza antes de `pos` (None si no hay ninguna)."""
+    tipo = None
+    for inicio, tipo_seccion in posiciones:
+        if inicio > pos:
+            break
+        tipo = tipo_seccion
+    return tipo
+
+def saldo_inicial_desde_balance(df_movimientos):
+    """
+    En Wise la última fila (la más antigua) trae el balance DESPUÉS de aplicar ese movimiento,
+    así que el saldo inicial es ese balance menos el monto con signo.
+    """
+    if df_movimientos.empty or "balance" not in df_movimientos.columns:
+        return None
+    ultimo = df_movimientos.iloc[-1]
+    signo = 1 if ultimo["tipo"] == "ingreso" else -1
+    return round(ultimo["balance"] - signo * ultimo["monto"], 2)
+
 def parsear_chase(texto, nombre_archivo):
     periodo_pat = re.search(
     r'([A-Za-z]{3,9} \d{2}, \d{4})\s*through\s*([A-Za-z]{3,9} \d{2}, \d{4})',
@@ -100,6 +218,7 @@ def parsear_chase(texto, nombre_archivo):
     movimientos = []
 
     mov_pat = re.compile(r'(\d{2}/\d{2})(.+?)\$(\d{1,3}(?:,\d{3})*\.\d{2})', re.DOTALL)
+    secciones = posiciones_secciones(texto, CHASE_SECCIONES)
     for match in mov_pat.finditer(texto):
         # Si no hay fecha_inicio, no se puede armar la fecha completa
         if fecha_inicio is not None:
@@ -115,7 +234,10 @@ def parsear_chase(texto, nombre_archivo):
             monto = float(match.group(3).replace(",", ""))
         except Exception:
             monto = None
-        tipo = "ingreso" if (monto is not None and monto > 0) else "egreso"
+        # Chase imprime todos los montos en positivo: el tipo lo da la sección del detalle
+        tipo = tipo_en_posicion(secciones, match.start())
+        if tipo is None:
+            tipo = "ingreso" if (monto is not None and monto > 0) else "egreso"
 
         descripcion = linea_completa
 
@@ -404,7 +526,7 @@ def parsear_wise_usd(texto, nombre_archivo):
             i += 1  # Avanza solo una línea
 
     df_movimientos = pd.DataFrame(movimientos)
-    saldo_inicial = df_movimientos["balance"].iloc[-1] if (not df_movimientos.empty and "balance" in df_movimientos.columns) else None
+    saldo_inicial = saldo_inicial_desde_balance(df_movimientos)
     if "balance" in df_movimientos.columns:
         df_movimientos = df_movimientos.drop(columns=["balance"])
 
@@ -495,7 +617,7 @@ def parsear_wise_eur(texto, nombre_archivo):
             i += 1  # Avanza solo una línea
 
     df_movimientos = pd.DataFrame(movimientos)
-    saldo_inicial = df_movimientos["balance"].iloc[-1] if (not df_movimientos.empty and "balance" in df_movimientos.columns) else None
+    saldo_inicial = saldo_inicial_desde_balance(df_movimientos)
     if "balance" in df_movimientos.columns:
         df_movimientos = df_movimientos.drop(columns=["balance"])
 
@@ -1,19 +1,71 @@
 import pdfplumber
 import re
+import io
 import hashlib
 from pathlib import Path
 import streamlit as st
 
 import pandas as pd
+from modules.metricas import instrumentado
+
+COLUMNAS_MOV = [
+    "id", "fecha", "banco", "monto", "tipo", "descripción", "categoría", "extracto_id", "origen_dato", "contraparte"
+]
+COLUMNAS_EXT = ["extracto_id", "banco", "fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "archivo_fuente"]
+IMPORTE_PAT = re.compile(r'\d{1,3}(?:,\d{3})*\.\d{2}')
 
 def extraer_texto(pdf_path):
-    texto = ""
+    return "".join(t + "\n" for t in extraer_texto_paginas(pdf_path) if t)
+
+def _huella_ruta(valor):
+    """
+    Clave de caché de una cadena o Path: las rutas a archivos valen por su contenido y el resto
+    (p. ej. el nombre original del archivo) por sí mismas. Devuelve bytes: Streamlit vuelve a
+    hashear lo que devuelve la función, y una cadena la mandaría otra vez aquí.
+    """
+    try:
+        return hashlib.md5(Path(valor).read_bytes()).digest()
+    except (OSError, ValueError):
+        return str(valor).encode("utf-8")
+
+@st.cache_data(hash_funcs={Path: _huella_ruta, str: _huella_ruta}, max_entries=64)
+@instrumentado("parser")
+def extraer_texto_paginas(pdf_path):
+    """
+    Devuelve el texto de cada página (cadena vacía si la página no tiene texto). Se cachea por
+    contenido: el parser local y la selección de páginas para Gemini leen el PDF una sola vez.
+    """
     with pdfplumber.open(pdf_path) as pdf:
-        for pagina in pdf.pages:
-            texto_pagina = pagina.extract_text()
-            if texto_pagina:
-                texto += texto_pagina + "\n"
-    return texto
+        return [pagina.extract_text() or "" for pagina in pdf.pages]
+
+def paginas_con_importes(textos_paginas):
+    """Índices (base 0) de las páginas que contienen importes, es decir, posibles movimientos."""
+    return [i for i, texto in enumerate(textos_paginas) if IMPORTE_PAT.search(texto)]
+
+def agrupar_rangos(paginas):
+    """[0, 1, 2, 5, 6] -> [(0, 2), (5, 6)]"""
+    rangos = []
+    for p in sorted(paginas):
+        if rangos and p == rangos[-1][1] + 1:
+            rangos[-1] = (rangos[-1][0], p)
+        else:
+            rangos.append((p, p))
+    return rangos
+
+def contar_paginas_pdf(pdf_path):
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+def extraer_paginas_pdf(pdf_path, paginas):
+    """Genera un PDF nuevo (bytes) con solo las páginas indicadas (base 0, en orden)."""
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for p in paginas:
+        writer.add_page(reader.pages[p])
+    salida = io.BytesIO()
+    writer.write(salida)
+    return salida.getvalue()
 
 def detectar_banco(texto, filename=None):
     if filename:
@@ -51,7 +103,57 @@ def detectar_banco(texto, filename=None):
                     return nombre
         return "Desconocido"
 
-@st.cache_data(hash_funcs={Path: lambda p: hashlib.md5(Path(p).read_bytes()).hexdigest(), str: lambda p: hashlib.md5(Path(p).read_bytes()).hexdigest()})
+@instrumentado("parser")
+def parsear_texto(texto, banco, nombre_archivo):
+    """
+    Aplica el parser local del banco detectado. Devuelve (df_movimientos, df_extractos),
+    o (None, None) si el banco no está soportado.
+    """
+    from modules.parsear import (parsear_chase, parsear_mercury, parsear_truist, parsear_wise_usd, parsear_wise_eur,
+                                 agregar_contraparte)
+
+    df_movimientos, df_extractos = None, None
+    if banco == "Chase":
+        try:
+            df_movimientos, df_extractos = parsear_chase(texto, nombre_archivo)
+        except Exception as e:
+            st.error(f"❌ Error al parsear Chase: {e}")
+    elif banco == "Mercury":
+        try:
+            df_movimientos, df_extractos = parsear_mercury(texto, nombre_archivo)
+        except Exception as e:
+            st.error(f"❌ Error al parsear Mercury: {e}")
+    elif banco == "Truist":
+        try:
+            df_movimientos, df_extractos = parsear_truist(texto, nombre_archivo)
+        except Exception as e:
+            st.error(f"❌ Error al parsear Truist: {e}")
+    elif banco == "Wise":
+        try:
+            if "eur statement" in texto.lower():
+                df_movimientos, df_extractos = parsear_wise_eur(texto, nombre_archivo)
+            elif "usd statement" in texto.lower():
+                df_movimientos, df_extractos = parsear_wise_usd(texto, nombre_archivo)
+            else:
+                try:
+                    df_movimientos, df_extractos = parsear_wise_usd(texto, nombre_archivo)
+                except Exception:
+                    df_movimientos, df_extractos = parsear_wise_eur(texto, nombre_archivo)
+        except Exception as e:
+            st.error(f"❌ Error al parsear Wise: {e}")
+    else:
+        return None, None
+
+    # Si el DataFrame no tiene las columnas estándar, devolver vacíos con columnas estándar
+    if df_movimientos is None or not isinstance(df_movimientos, pd.DataFrame) or df_movimientos.empty:
+        df_movimientos = pd.DataFrame(columns=COLUMNAS_MOV)
+    else:
+        df_movimientos = agregar_contraparte(df_movimientos)
+    if df_extractos is None or not isinstance(df_extractos, pd.DataFrame) or df_extractos.empty:
+        df_extractos = pd.DataFrame(columns=COLUMNAS_EXT)
+    return df_movimientos, df_extractos
+
+@st.cache_data(hash_funcs={Path: _huella_ruta, str: _huella_ruta})
 def extract_data_from_pdf(pdf_path, filename=None):
     """
     Extrae y estandariza los datos de un PDF bancario.
@@ -61,57 +163,17 @@ def extract_data_from_pdf(pdf_path, filename=None):
     try:
         texto = extraer_texto(pdf_path)
         banco = detectar_banco(texto, filename=filename)
-        from modules.parsear import (parsear_chase, parsear_mercury, parsear_truist, parsear_wise_usd, parsear_wise_eur)
-
 
         # Usa siempre el nombre del archivo para trazabilidad
         nombre_archivo = filename if filename else str(pdf_path)
 
-        df_movimientos, df_extractos = None, None
-        if banco == "Chase":
-            try:
-                df_movimientos, df_extractos = parsear_chase(texto, nombre_archivo)
-            except Exception as e:
-                st.error(f"❌ Error al parsear Chase: {e}")
-        elif banco == "Mercury":
-            try:
-                df_movimientos, df_extractos = parsear_mercury(texto, nombre_archivo)
-            except Exception as e:
-                st.error(f"❌ Error al parsear Mercury: {e}")
-        elif banco == "Truist":
-            try:
-                df_movimientos, df_extractos = parsear_truist(texto, nombre_archivo)
-            except Exception as e:
-                st.error(f"❌ Error al parsear Truist: {e}")
-        elif banco == "Wise":
-            try:
-                if "eur statement" in texto.lower():
-                    df_movimientos, df_extractos = parsear_wise_eur(texto, nombre_archivo)
-                elif "usd statement" in texto.lower():
-                    df_movimientos, df_extractos = parsear_wise_usd(texto, nombre_archivo)
-                else:
-                    try:
-                        df_movimientos, df_extractos = parsear_wise_usd(texto, nombre_archivo)
-                    except Exception:
-                        df_movimientos, df_extractos = parsear_wise_eur(texto, nombre_archivo)
-            except Exception as e:
-                st.error(f"❌ Error al parsear Wise: {e}")
-        else:
+        df_movimientos, df_extractos = parsear_texto(texto, banco, nombre_archivo)
+        if df_movimientos is None:
             st.warning("No se reconoce el banco en el PDF.")
             return None, None, banco, texto
 
-        # Si el DataFrame no tiene las columnas estándar, devolver vacíos con columnas estándar
-        columnas_mov = ["id", "fecha", "banco", "monto", "tipo", "descripción", "categoría", "extracto_id", "origen_dato"]
-        columnas_ext = ["extracto_id", "banco", "fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "archivo_fuente"]
-        if df_movimientos is None or not isinstance(df_movimientos, pd.DataFrame) or df_movimientos.empty:
-            df_movimientos = pd.DataFrame(columns=columnas_mov)
-        if df_extractos is None or not isinstance(df_extractos, pd.DataFrame) or df_extractos.empty:
-            df_extractos = pd.DataFrame(columns=columnas_ext)
-
         return df_movimientos, df_extractos, banco, texto
 
     except Exception as e:
         st.error(f"❌ Error al procesar el PDF ({banco or 'desconocido'}): {e}")
-        columnas_mov = ["id", "fecha", "banco", "monto", "tipo", "descripción", "categoría", "extracto_id", "origen_dato"]
-        columnas_ext = ["extracto_id", "banco", "fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "archivo_fuente"]
-        return pd.DataFrame(columns=columnas_mov), pd.DataFrame(columns=columnas_ext), banco, None
\ No newline at end of file
+        return pd.DataFrame(columns=COLUMNAS_MOV), pd.DataFrame(columns=COLUMNAS_EXT), banco, None
@@ -0,0 +1,174 @@
+"""
+Perfilado opcional de los reruns con cProfile. Se activa para todas las sesiones con la
+variable de entorno PERFILADO=1, o para un administrador con `?profile=1` en la URL.
+
+Cada rerun perfilado deja en PERFILADO_DIR un .prof (formato pstats) y un .json con la página,
+el estado de los filtros, el usuario y la duración. Se conservan como máximo `PERFILES_MAX`
+perfiles y `PERFILES_DIAS` días. El visor (en Configuración) suma los perfiles de una página y
+lista las funciones con más tiempo acumulado.
+
+cProfile solo ve el hilo del script: el trabajo en hilos (subidas a Drive, Gemini) aparece
+como la espera del hilo principal.
+"""
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+PERFILES_DIR = Path(os.environ.get("PERFILADO_DIR", ".cache/perfiles"))
+PERFILES_MAX = 200
+PERFILES_DIAS = 7
+FUNCIONES_MAX = 40
+# Claves de session_state que no se guardan como "filtros"
+_CLAVES_EXCLUIDAS = re.compile(r"^_|pass|token|oauth|secret", re.IGNORECASE)
+_DIRECTORIO_REPO = str(Path(__file__).resolve().parent.parent)
+
+
+def perfilado_activo():
+    if os.environ.get("PERFILADO", "").lower() in ("1", "true", "si", "sí"):
+        return True
+    return st.query_params.get("profile") == "1" and st.session_state.get("role") == "admin"
+
+
+def _valor_simple(valor):
+    simples = (str, int, float, bool, datetime.date)
+    if isinstance(valor, simples) or valor is None:
+        return True
+    return isinstance(valor, (list, tuple)) and len(valor) <= 20 and all(isinstance(v, simples) for v in valor)
+
+
+def estado_filtros():
+    """Valores simples de session_state (widgets con clave, toggles, páginas...) que describen el rerun."""
+    return {
+        clave: valor for clave, valor in sorted(st.session_state.to_dict().items())
+        if not _CLAVES_EXCLUIDAS.search(str(clave)) and _valor_simple(valor)
+    }
+
+
+def _nombre_archivo(pagina):
+    ahora = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    slug = re.sub(r"[^0-9a-z]+", "_", pagina.lower().encode("ascii", "ignore").decode()).strip("_") or "pagina"
+    return f"{ahora}_{slug}"
+
+
+def podar_perfiles(directorio=PERFILES_DIR, maximo=PERFILES_MAX, dias=PERFILES_DIAS):
+    """Borra los perfiles más viejos que `dias` y, de los que quedan, todos menos los `maximo` más nuevos."""
+    limite = time.time() - dias * 86400
+    perfiles = sorted(Path(directorio).glob("*.prof"), reverse=True)
+    for i, perfil in enumerate(perfiles):
+        if i >= maximo or perfil.stat().st_mtime < limite:
+            perfil.unlink(missing_ok=True)
+            perfil.with_suffix(".json").unlink(missing_ok=True)
+
+
+def guardar_perfil(perfil, pagina, segundos, directorio=PERFILES_DIR):
+    directorio = Path(directorio)
+    directorio.mkdir(parents=True, exist_ok=True)
+    base = directorio / _nombre_archivo(pagina)
+    perfil.dump_stats(base.with_suffix(".prof"))
+    metadatos = {
+        "pagina": pagina,
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "usuario": st.session_state.get("username"),
+        "segundos": round(segundos, 3),
+        "filtros": estado_filtros(),
+    }
+    base.with_suffix(".json").write_text(json.dumps(metadatos, ensure_ascii=False, default=str), encoding="utf-8")
+    podar_perfiles(directorio)
+
+
+@contextmanager
+def perfilar(pagina):
+    """Perfila el bloque si el perfilado está activo; si no (o si ya hay otro profiler activo) no hace nada."""
+    perfil = None
+    if perfilado_activo():
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Otro profiler ya está activo en este hilo
+            perfil = None
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        # También al cortar el rerun (st.rerun/st.stop lanzan excepciones)
+        if perfil is not None:
+            perfil.disable()
+            guardar_perfil(perfil, pagina, time.perf_counter() - inicio)
+
+
+def listar_perfiles(directorio=PERFILES_DIR):
+    """Metadatos de los perfiles guardados, del más nuevo al más viejo."""
+    filas = []
+    for ruta in sorted(Path(directorio).glob("*.json"), reverse=True):
+        if not ruta.with_suffix(".prof").exists():
+            continue
+        try:
+            metadatos = json.loads(ruta.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        filas.append({
+            "archivo": str(ruta.with_suffix(".prof")), "pagina": metadatos.get("pagina"),
+            "fecha": metadatos.get("fecha"), "usuario": metadatos.get("usuario"),
+            "segundos": metadatos.get("segundos"), "filtros": json.dumps(metadatos.get("filtros", {}), ensure_ascii=False),
+        })
+    return pd.DataFrame(filas, columns=["archivo", "pagina", "fecha", "usuario", "segundos", "filtros"])
+
+
+def top_funciones(archivos, n=FUNCIONES_MAX, solo_repo=False):
+    """
+    Suma los perfiles `archivos` y devuelve las `n` funciones con más tiempo acumulado, con el
+    promedio por rerun. `solo_repo` deja solo el código de la aplicación (sin pandas, streamlit...).
+    """
+    if not archivos:
+        return pd.DataFrame()
+    stats = pstats.Stats(*map(str, archivos))
+    filas = []
+    for (archivo, linea, funcion), (_, llamadas, propio, acumulado, _) in stats.stats.items():
+        if solo_repo and not archivo.startswith(_DIRECTORIO_REPO):
+            continue
+        filas.append({
+            "función": funcion,
+            "ubicación": f"{os.path.relpath(archivo, _DIRECTORIO_REPO) if archivo.startswith(_DIRECTORIO_REPO) else archivo}:{linea}",
+            "llamadas": llamadas,
+            "propio_s": propio,
+            "acumulado_s": acumulado,
+            "acumulado_por_rerun_s": acumulado / len(archivos),
+        })
+    return pd.DataFrame(filas).sort_values("acumulado_s", ascending=False).head(n).round(4).reset_index(drop=True)
+
+
+def render_perfiles():
+    """Visor de los perfiles guardados: por página, las funciones con más tiempo acumulado."""
+    st.caption(
+        f"Perfiles en `{PERFILES_DIR}` (máx. {PERFILES_MAX}, {PERFILES_DIAS} días). "
+        "Se activan con `PERFILADO=1` en el servidor o con `?profile=1` en la URL (administradores)."
+    )
+    perfiles = listar_perfiles()
+    if perfiles.empty:
+        st.info("No hay perfiles guardados.")
+        return
+    resumen = perfiles.groupby("pagina")["segundos"].agg(reruns="size", p50="median", max="max").round(3)
+    st.dataframe(resumen, use_container_width=True)
+
+    col_pagina, col_repo = st.columns([3, 1])
+    pagina = col_pagina.selectbox("Página", list(resumen.index), key="perfiles_pagina")
+    solo_repo = col_repo.toggle("Solo código de la app", value=True, key="perfiles_solo_repo")
+    de_pagina = perfiles[perfiles["pagina"] == pagina]
+    elegidos = st.multiselect(
+        "Reruns", list(de_pagina["fecha"]), default=list(de_pagina["fecha"]), key="perfiles_reruns",
+        help="Por defecto se suman todos los reruns guardados de la página."
+    )
+    archivos = list(de_pagina.loc[de_pagina["fecha"].isin(elegidos), "archivo"])
+    st.dataframe(top_funciones(archivos, solo_repo=solo_repo), hide_index=True, use_container_width=True)
+    with st.expander("Filtros de cada rerun"):
+        st.dataframe(de_pagina[["fecha", "usuario", "segundos", "filtros"]], hide_index=True, use_container_width=True)
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from modules.data_loader import obtener_derivado
+from modules.parsear import agregar_contraparte, SIN_CONTRAPARTE
+
+# Periodo en días de cada periodicidad reconocida
+PERIODICIDADES = {"semanal": 7.0, "quincenal": 14.0, "mensual": 30.44, "trimestral": 91.31, "anual": 365.25}
+# Un intervalo "cae" en el periodo si se desvía menos de esta fracción (mensual: 24 a 37 días)
+TOLERANCIA_INTERVALO = 0.2
+# Fracción mínima de intervalos que deben caer en el periodo
+REGULARIDAD_MIN = 0.75
+# Desvío relativo mediano máximo del monto respecto del habitual (las facturas de servicios varían)
+VARIACION_MONTO_MAX = 0.25
+REPETICIONES_MIN = 3
+REPETICIONES_MIN_ANUAL = 2
+# Diferencia relativa con el último cargo a partir de la que un cargo anterior tenía otro precio
+CAMBIO_PRECIO_MIN = 0.01
+
+COLUMNAS_RECURRENTES = [
+    "contraparte", "tipo", "periodicidad", "repeticiones", "intervalo_dias", "monto_habitual", "ultimo_monto",
+    "cambio_precio", "fecha_cambio_precio", "costo_anual", "primera_fecha", "ultima_fecha", "proxima_fecha", "activo",
+]
+
+
+def _cargos(movimientos_df, tipos):
+    """Un cargo por (contraparte, tipo, día), ordenados por contraparte/tipo y fecha."""
+    if movimientos_df is None or movimientos_df.empty:
+        return pd.DataFrame(columns=["contraparte", "tipo", "fecha", "monto"])
+    if "contraparte" not in movimientos_df.columns:
+        movimientos_df = agregar_contraparte(movimientos_df)
+    movs = pd.DataFrame({
+        "contraparte": movimientos_df["contraparte"].astype(str),
+        "tipo": movimientos_df["tipo"].astype(str).str.lower(),
+        "fecha": pd.to_datetime(movimientos_df["fecha"], errors="coerce").dt.normalize(),
+        "monto": pd.to_numeric(movimientos_df["monto"], errors="coerce").abs(),
+    }).dropna(subset=["fecha", "monto"])
+    movs = movs[movs["tipo"].isin(tipos) & (movs["contraparte"] != SIN_CONTRAPARTE)]
+    # Varios cargos del mismo día cuentan como uno (p. ej. un cargo y su ajuste)
+    return movs.groupby(["contraparte", "tipo", "fecha"], sort=True)["monto"].sum().reset_index()
+
+
+def detectar_recurrentes(movimientos_df, tipos=("egreso",)):
+    """
+    Cargos periódicos por contraparte. Con los cargos ordenados por (contraparte, tipo, fecha),
+    los intervalos entre cargos consecutivos de un mismo grupo son un `np.diff` y todas las
+    estadísticas (mediana del intervalo, regularidad, variación del monto) salen de groupbys
+    sobre el número de grupo, sin recorrer los grupos en Python.
+
+    Devuelve (resumen con `COLUMNAS_RECURRENTES`, cargos de los grupos recurrentes).
+    """
+    cargos = _cargos(movimientos_df, list(tipos))
+    vacio = pd.DataFrame(columns=COLUMNAS_RECURRENTES)
+    if cargos.empty:
+        return vacio, cargos
+
+    grupo = cargos.groupby(["contraparte", "tipo"], sort=False).ngroup().to_numpy()
+    dias = cargos["fecha"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    montos = cargos["monto"].to_numpy()
+    mismo_grupo = grupo[1:] == grupo[:-1]
+    intervalos = pd.Series(np.diff(dias)[mismo_grupo].astype(float))
+    grupo_intervalo = grupo[1:][mismo_grupo]
+
+    por_grupo = cargos.groupby(grupo).agg(
+        contraparte=("contraparte", "first"), tipo=("tipo", "first"), repeticiones=("monto", "size"),
+        monto_habitual=("monto", "median"), primera_fecha=("fecha", "first"), ultima_fecha=("fecha", "last"),
+    )
+    por_grupo["intervalo_dias"] = intervalos.groupby(grupo_intervalo).median()
+    por_grupo = por_grupo.dropna(subset=["intervalo_dias"])
+    if por_grupo.empty:
+        return vacio, cargos.iloc[:0]
+
+    # Periodicidad más cercana (en escala logarítmica: 20 días está más cerca de 14 que de 30.44)
+    nombres = np.array(list(PERIODICIDADES))
+    periodos = np.array(list(PERIODICIDADES.values()))
+    cercana = np.abs(np.log(por_grupo["intervalo_dias"].to_numpy()[:, None] / periodos)).argmin(axis=1)
+    por_grupo["periodicidad"] = nombres[cercana]
+    por_grupo["periodo"] = periodos[cercana]
+
+    periodo_intervalo = por_grupo["periodo"].reindex(grupo_intervalo).to_numpy()
+    en_periodo = pd.Series(np.abs(intervalos.to_numpy() / periodo_intervalo - 1) <= TOLERANCIA_INTERVALO)
+    por_grupo["regularidad"] = en_periodo.groupby(grupo_intervalo).mean()
+
+    habitual = por_grupo["monto_habitual"].reindex(grupo).to_numpy()
+    desvio_monto = pd.Series(np.abs(montos - habitual) / np.where(habitual > 0, habitual, np.nan))
+    por_grupo["variacion_monto"] = desvio_monto.groupby(grupo).median()
+
+    # Último cargo de cada grupo (los grupos son bloques contiguos) y el último cargo anterior a
+    # un precio distinto: de ahí salen el cambio de precio y desde cuándo rige el precio actual
+    fin = np.flatnonzero(np.r_[grupo[1:] != grupo[:-1], True])
+    por_grupo["ultimo_monto"] = pd.Series(montos[fin], index=grupo[fin])
+    ultimo = por_grupo["ultimo_monto"].reindex(grupo).to_numpy()
+    distintos = np.flatnonzero(np.abs(montos - ultimo) > CAMBIO_PRECIO_MIN * ultimo)
+    anterior = pd.Series(distintos).groupby(grupo[distintos]).last()
+    por_grupo["cambio_precio"] = por_grupo["ultimo_monto"] - pd.Series(montos[anterior], index=anterior.index)
+    por_grupo["fecha_cambio_precio"] = pd.Series(cargos["fecha"].to_numpy()[anterior + 1], index=anterior.index)
+
+    minimo = np.where(por_grupo["periodicidad"] == "anual", REPETICIONES_MIN_ANUAL, REPETICIONES_MIN)
+    recurrentes = por_grupo[
+        (por_grupo["repeticiones"] >= minimo)
+        & (np.abs(por_grupo["intervalo_dias"] / por_grupo["periodo"] - 1) <= TOLERANCIA_INTERVALO)
+        & (por_grupo["regularidad"] >= REGULARIDAD_MIN)
+        & (por_grupo["variacion_monto"] <= VARIACION_MONTO_MAX)
+    ].copy()
+
+    fecha_referencia = cargos["fecha"].max()
+    recurrentes["proxima_fecha"] = recurrentes["ultima_fecha"] + pd.to_timedelta(recurrentes["intervalo_dias"], unit="D")
+    # Activo: el siguiente cargo todavía no se pasó de la tolerancia respecto de los datos cargados
+    holgura = pd.to_timedelta(recurrentes["periodo"] * TOLERANCIA_INTERVALO, unit="D")
+    recurrentes["activo"] = recurrentes["proxima_fecha"] + holgura >= fecha_referencia
+    recurrentes["costo_anual"] = (recurrentes["ultimo_monto"] * 365.25 / recurrentes["periodo"]).round(2)
+    resumen = recurrentes.sort_values("costo_anual", ascending=False)[COLUMNAS_RECURRENTES].reset_index(drop=True)
+    return resumen, cargos[np.isin(grupo, recurrentes.index.to_numpy())].reset_index(drop=True)
+
+
+class CargosRecurrentes:
+    """Cargos recurrentes (suscripciones, servicios) de la versión de datos actual y su historial."""
+
+    def __init__(self, movimientos_df, tipos=("egreso",)):
+        self.resumen, self.cargos = detectar_recurrentes(movimientos_df, tipos)
+
+    def activos(self):
+        return self.resumen[self.resumen["activo"]]
+
+    def costo_mensual(self):
+        """Costo mensual estimado de los cargos activos."""
+        return self.activos()["costo_anual"].sum() / 12
+
+    def historial(self, contraparte, tipo="egreso"):
+        """Cargos de una contraparte en orden de fecha (para ver la evolución del precio)."""
+        cargos = self.cargos
+        return cargos[(cargos["contraparte"] == contraparte) & (cargos["tipo"] == tipo)][["fecha", "monto"]]
+
+
+def get_recurrentes(movimientos_df):
+    """Cargos recurrentes de la versión de datos actual (se detectan la primera vez que se piden)."""
+    return obtener_derivado("recurrentes", lambda: CargosRecurrentes(movimientos_df))
@@ -1,24 +1,49 @@
 import datetime
-import tempfile
-import io
 
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-from reportlab.pdfgen import canvas
 
-from modules.drive_utils import subir_a_drive
+from modules.cubo import get_cubo
+from modules.indice import get_indice
+from modules.graficos import mostrar_grafico, plotly_barras, plotly_torta, selector_motor_graficos
+from modules.conciliacion import conciliar_extractos
+from modules.diferencias import diferencias_extractos, FALTANTE, SOBRANTE, MONTO_DISTINTO
+from modules.data_loader import data_version
+from modules.tabla import tabla_paginada
+from modules.transferencias import get_transferencias, guardar_emparejamientos, CONFIRMADO, VENTANA_DIAS
+from modules.recurrentes import get_recurrentes
+from modules.exportar import (
+    descarga_bajo_demanda, generar_archivo, escribir_csv, escribir_xlsx, escribir_parquet_zip,
+    parquet_disponible, MIME_XLSX, MIME_ZIP
+)
+
+SECCIONES = [
+    "📅 Resumen Mensual",
+    "📊 Análisis por Categoría",
+    "🏦 Conciliación Extractos",
+    "👥 Cliente/Proveedor",
+    "🔁 Transferencias internas",
+    "🔄 Cargos recurrentes",
+    "📤 Exportar",
+]
+
+
+def totales_por_contraparte(df):
+    """
+    Monto total por contraparte, de mayor a menor. Con "contraparte" categórica el groupby
+    agrupa por los códigos enteros; `observed=True` omite las que no aparecen en `df`.
+    """
+    columna = "contraparte" if "contraparte" in df.columns else "descripción"
+    return df.groupby(columna, observed=True)["monto"].sum().sort_values(ascending=False)
+
 
 def render(movimientos_df, extractos_df):
     st.title("📈 Reportes Avanzados")
     st.caption("Genera reportes personalizados, análisis financieros y conciliaciones bancarias.")
 
-    # --- Procesamiento de DataFrames
-    movimientos_df['tipo'] = movimientos_df['tipo'].astype(str).fillna('')
-    movimientos_df['fecha'] = pd.to_datetime(movimientos_df['fecha'], errors="coerce")
-    ingresos_df = movimientos_df[movimientos_df['tipo'].str.lower() == 'ingreso'].copy()
-    egresos_df = movimientos_df[movimientos_df['tipo'].str.lower() == 'egreso'].copy()
+    # --- Procesamiento de DataFrames: el índice normaliza y ordena una vez por versión de datos
+    indice = get_indice(movimientos_df)
 
     # --- Extractos: procesar fechas y validar
     if extractos_df is not None and not extractos_df.empty:
@@ -29,44 +54,36 @@ def render(movimientos_df, extractos_df):
 
     # --- Filtros
     st.sidebar.subheader("Filtros de Reporte")
-    fecha_min = movimientos_df["fecha"].min() if not movimientos_df.empty else datetime.date.today() - datetime.timedelta(days=180)
-    fecha_max = movimientos_df["fecha"].max() if not movimientos_df.empty else datetime.date.today()
+    fecha_min = indice.fecha_min if len(indice) else pd.Timestamp(datetime.date.today() - datetime.timedelta(days=180))
+    fecha_max = indice.fecha_max if len(indice) else pd.Timestamp(datetime.date.today())
     fecha_desde = st.sidebar.date_input("Desde", value=fecha_min.date(), key="report_fecha_desde")
     fecha_hasta = st.sidebar.date_input("Hasta", value=fecha_max.date(), key="report_fecha_hasta")
-    bancos_disp = movimientos_df['banco'].dropna().unique()
+    bancos_disp = indice.bancos
     banco_sel = st.sidebar.multiselect("Banco", bancos_disp, default=list(bancos_disp))
-    categorias_disp = movimientos_df['categoría'].dropna().unique()
+    categorias_disp = list(indice.categorias['categoría'])
     categoria_sel = st.sidebar.multiselect("Categoría", categorias_disp, default=list(categorias_disp))
+    selector_motor_graficos()
+
+    # Resúmenes mensuales y por categoría desde el cubo pre-agregado
+    cubo = get_cubo(movimientos_df)
+    filtros = {
+        "fecha_ini": pd.Timestamp(fecha_desde),
+        "fecha_fin": pd.Timestamp(fecha_hasta),
+        "bancos": list(banco_sel),
+        "categorias": list(categoria_sel),
+    }
 
-    # --- Aplicar filtros
-    mov_filtrados = movimientos_df[
-        (movimientos_df["fecha"] >= pd.Timestamp(fecha_desde)) &
-        (movimientos_df["fecha"] <= pd.Timestamp(fecha_hasta)) &
-        (movimientos_df["banco"].isin(banco_sel)) &
-        (movimientos_df["categoría"].isin(categoria_sel))
-    ]
-    ingresos_filtrados = mov_filtrados[mov_filtrados['tipo'].str.lower() == 'ingreso']
-    egresos_filtrados = mov_filtrados[mov_filtrados['tipo'].str.lower() == 'egreso']
-
-    # --- Tabs de reporte
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "📅 Resumen Mensual", 
-        "📊 Análisis por Categoría", 
-        "🏦 Conciliación Extractos", 
-        "👥 Cliente/Proveedor", 
-        "📤 Exportar"
-    ])
+    # --- Secciones de reporte: a diferencia de st.tabs, solo se calcula la sección visible
+    seccion = st.radio("Sección", SECCIONES, horizontal=True, key="reportes_seccion", label_visibility="collapsed")
 
     # === Tab 1: Resumen Mensual
-    with tab1:
+    if seccion == SECCIONES[0]:
         st.subheader("Resumen Financiero Mensual")
-        if not mov_filtrados.empty:
-            resumen_mensual = mov_filtrados.pivot_table(
-                index=mov_filtrados['fecha'].dt.to_period('M').astype(str),
-                columns='tipo',
-                values='monto',
-                aggfunc='sum'
-            ).fillna(0)
+        resumen_mensual = cubo.por_mes_y_tipo(**filtros)
+        if not resumen_mensual.empty:
+            for col in ['ingreso', 'egreso']:
+                if col not in resumen_mensual.columns:
+                    resumen_mensual[col] = 0.0
             resumen_mensual['Balance'] = resumen_mensual.get('ingreso', 0) - resumen_mensual.get('egreso', 0)
             resumen_mensual['Margen (%)'] = np.where(
                 resumen_mensual.get('ingreso', 0) > 0,
@@ -81,39 +98,38 @@ def render(movimientos_df, extractos_df):
                     'Margen (%)': '{:.1f}%'
                 }), use_container_width=True
             )
-            fig, ax = plt.subplots(figsize=(10, 6))
-            resumen_mensual[['ingreso', 'egreso']].plot(kind="bar", ax=ax)
-            ax.set_title("Evolución Mensual de Ingresos y Egresos")
-            ax.set_ylabel("Monto ($)")
-            ax.grid(True, linestyle="--", alpha=0.7)
-            st.pyplot(fig)
+            def _dibujar_mensual(ax):
+                resumen_mensual[['ingreso', 'egreso']].plot(kind="bar", ax=ax)
+                ax.set_title("Evolución Mensual de Ingresos y Egresos")
+                ax.set_ylabel("Monto ($)")
+                ax.grid(True, linestyle="--", alpha=0.7)
+            mostrar_grafico(
+                "reportes_mensual", filtros, _dibujar_mensual, figsize=(10, 6),
+                plotly=lambda: plotly_barras(resumen_mensual[['ingreso', 'egreso']], "Evolución Mensual de Ingresos y Egresos")
+            )
         else:
             st.warning("No hay movimientos financieros para el período y filtros seleccionados.")
 
     # === Tab 2: Análisis por Categoría
-    with tab2:
+    if seccion == SECCIONES[1]:
         st.subheader("Análisis por Categoría")
 
         tipo_analisis = st.radio("¿Qué analizar?", ["Egresos", "Ingresos"], horizontal=True)
 
         if tipo_analisis == "Egresos":
-            df_tipo = egresos_filtrados
-            color = 'red'
+            tipo_mov = 'egreso'
             kpi_label = "Total Egresos"
         else:
-            df_tipo = ingresos_filtrados
-            color = 'green'
+            tipo_mov = 'ingreso'
             kpi_label = "Total Ingresos"
+        df_tipo = indice.consultar(tipos=[tipo_mov], **filtros)
 
         if df_tipo.empty:
 
             st.warning(f"No hay {tipo_analisis.lower()} para analizar.")
         else:
-            total = df_tipo["monto"].sum()
-            cat_summary = df_tipo.groupby("categoría").agg(
-                Total=("monto", "sum"),
-                Cantidad=("monto", "count")
-            ).sort_values("Total", ascending=False)
+            cat_summary = cubo.por_categoria(tipos=[tipo_mov], **filtros)
+            total = cat_summary["Total"].sum()
             cat_summary["Porcentaje"] = (cat_summary["Total"] / total) * 100
 
             top_cat = cat_summary.index[0] if not cat_summary.empty else "N/A"
@@ -138,22 +154,28 @@ def render(movimientos_df, extractos_df):
                 pie_data = pie_data[pie_data["Porcentaje"] >= 4]
                 if otros > 0:
                     pie_data.loc["Otros"] = [otros, pie_data["Cantidad"].sum(), 100 * otros / total]
-                fig, ax = plt.subplots(figsize=(2.5,2.5))
-                pie_data["Total"].plot.pie(
-                    labels=pie_data.index,
-                    autopct="%1.1f%%",
-                    ax=ax,
-                    startangle=140,
-                    counterclock=False
+                def _dibujar_torta(ax):
+                    pie_data["Total"].plot.pie(
+                        labels=pie_data.index,
+                        autopct="%1.1f%%",
+                        ax=ax,
+                        startangle=140,
+                        counterclock=False
+                    )
+                    ax.set_ylabel("")
+                mostrar_grafico(
+                    "reportes_torta_categorias", dict(filtros, tipo=tipo_mov), _dibujar_torta, figsize=(2.5, 2.5),
+                    plotly=lambda: plotly_torta(pie_data["Total"], kpi_label)
                 )
-                ax.set_ylabel("")
-                st.pyplot(fig)
             with col_bar:
-                fig2, ax2 = plt.subplots(figsize=(2.5,2.5))
-                cat_summary["Total"].plot.barh(ax=ax2)
-                ax2.set_xlabel("Monto ($)")
-                ax2.set_ylabel("Categoría")
-                st.pyplot(fig2)
+                def _dibujar_barras(ax):
+                    cat_summary["Total"].plot.barh(ax=ax)
+                    ax.set_xlabel("Monto ($)")
+                    ax.set_ylabel("Categoría")
+                mostrar_grafico(
+                    "reportes_barras_categorias", dict(filtros, tipo=tipo_mov), _dibujar_barras, figsize=(2.5, 2.5),
+                    plotly=lambda: plotly_barras(cat_summary["Total"], kpi_label, horizontal=True)
+                )
 
             # Detalle interactivo
             st.markdown("---")
@@ -164,13 +186,11 @@ def render(movimientos_df, extractos_df):
             st.markdown(f"- N° transacciones: **{df_detalle.shape[0]}**")
             st.markdown(f"- Promedio por transacción: **${df_detalle['monto'].mean():,.2f}**")
 
-            # Top 5 fuente/cliente/proveedor/desc
-            if tipo_analisis == "Ingresos" and "fuente" in df_detalle.columns:
-                top5 = df_detalle["fuente"].value_counts().head(5)
-                st.markdown("**Top 5 fuentes:**")
-            elif tipo_analisis == "Egresos" and "proveedor" in df_detalle.columns:
-                top5 = df_detalle["proveedor"].value_counts().head(5)
-                st.markdown("**Top 5 proveedores:**")
+            # Top 5 clientes/proveedores (contraparte canónica) o descripciones
+            if "contraparte" in df_detalle.columns:
+                top5 = df_detalle["contraparte"].value_counts().head(5)
+                top5 = top5[top5 > 0]
+                st.markdown(f"**Top 5 {'clientes' if tipo_analisis == 'Ingresos' else 'proveedores'}:**")
             else:
                 top5 = df_detalle["descripción"].value_counts().head(5)
                 st.markdown("**Top 5 descripciones:**")
@@ -194,81 +214,195 @@ def render(movimientos_df, extractos_df):
             st.dataframe(df_mostrar[mostrar_cols], use_container_width=True)
 
             # Exportar
-            st.download_button(
+            descarga_bajo_demanda(
                 f"📥 Descargar {tipo_analisis.lower()} '{categoria_selec}' (CSV)",
-                data=df_detalle.to_csv(index=False).encode('utf-8'),
-                file_name=f"{tipo_analisis.lower()}_{categoria_selec}.csv",
-                mime="text/csv"
+                f"{tipo_analisis.lower()}_{categoria_selec}.csv",
+                lambda: generar_archivo(escribir_csv, df_detalle),
+                filtros
             )
 
     # === Tab 3: Conciliación Extractos
-    with tab3:
+    if seccion == SECCIONES[2]:
         st.subheader("Conciliación de Extractos Bancarios")
         if extractos_df is not None and not extractos_df.empty:
-            cols = ["banco", "fecha_inicio", "fecha_fin", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "archivo_fuente"]
-            st.dataframe(extractos_df[cols], use_container_width=True)
-            # Conciliación rápida
-            for _, row in extractos_df.iterrows():
-                movs_periodo = movimientos_df[
-                    (movimientos_df["banco"] == row["banco"]) &
-                    (movimientos_df["fecha"] >= row["fecha_inicio"]) &
-                    (movimientos_df["fecha"] <= row["fecha_fin"])
-                ]
-                ingresos = movs_periodo[movs_periodo["tipo"].str.lower() == "ingreso"]["monto"].sum()
-                egresos = movs_periodo[movs_periodo["tipo"].str.lower() == "egreso"]["monto"].sum()
-                calculado = row["saldo_inicial"] + ingresos - egresos if not pd.isna(row["saldo_inicial"]) else None
-                if not pd.isna(row["saldo_final"]) and calculado is not None:
-                    diff = row["saldo_final"] - calculado
-                    if abs(diff) < 0.01:
-                        st.success(f"✅ Extracto '{row['archivo_fuente']}' **CONCILIADO**.")
-                    else:
-                        st.warning(f"⚠️ Extracto '{row['archivo_fuente']}': Diferencia detectada de ${diff:,.2f}.")
+            conciliacion = conciliar_extractos(extractos_df, movimientos_df)
+            n_ok = int(conciliacion["conciliado"].sum())
+            n_dif = int((conciliacion["conciliado"] == False).sum())
+            colC1, colC2, colC3 = st.columns(3)
+            colC1.metric("Extractos", len(conciliacion))
+            colC2.metric("✅ Conciliados", n_ok)
+            colC3.metric("⚠️ Con diferencia", n_dif)
+
+            solo_diferencias = st.checkbox("Mostrar solo extractos con diferencia", value=False)
+            tabla = conciliacion[conciliacion["conciliado"] == False] if solo_diferencias else conciliacion
+            cols = ["banco", "archivo_fuente", "fecha_inicio", "fecha_fin", "saldo_inicial", "ingresos_calc",
+                    "egresos_calc", "saldo_calculado", "saldo_final", "diferencia", "n_movimientos", "conciliado"]
+            st.dataframe(
+                tabla[cols].style.format({
+                    c: "${:,.2f}" for c in ["saldo_inicial", "ingresos_calc", "egresos_calc", "saldo_calculado", "saldo_final", "diferencia"]
+                }, na_rep="-"),
+                use_container_width=True
+            )
+
+            # Drill-down: qué movimientos explican la diferencia
+            st.markdown("---")
+            st.markdown("#### 🔎 Detalle de diferencias por movimiento")
+            st.caption("Re-parsea el PDF de cada extracto y lo cruza con los movimientos guardados por id.")
+            años = sorted(conciliacion["fecha_fin"].dt.year.dropna().astype(int).unique(), reverse=True)
+            colD1, colD2 = st.columns([3, 1])
+            alcance = colD1.selectbox(
+                "Extractos a analizar", ["Solo extractos con diferencia"] + [f"Todos los extractos de {a}" for a in años]
+            )
+            if colD2.button("🔍 Analizar", use_container_width=True):
+                if alcance.startswith("Solo"):
+                    mascara = (conciliacion["conciliado"] == False).fillna(False)
+                else:
+                    mascara = conciliacion["fecha_fin"].dt.year == int(alcance.rsplit(" ", 1)[-1])
+                seleccion = extractos_df.reset_index(drop=True)[mascara.to_numpy()]
+                barra = st.progress(0.0, text="Obteniendo PDFs...")
+                diferencias, errores = diferencias_extractos(
+                    seleccion, movimientos_df,
+                    on_progreso=lambda hechos, total, nombre: barra.progress(hechos / total, text=f"Re-parseando {nombre}")
+                )
+                barra.empty()
+                st.session_state["diferencias_conciliacion"] = (data_version(), alcance, len(seleccion), diferencias, errores)
+
+            guardado = st.session_state.get("diferencias_conciliacion")
+            if guardado and guardado[0] == data_version():
+                _, alcance_guardado, n_extractos, diferencias, errores = guardado
+                st.caption(f"Resultado para: {alcance_guardado} ({n_extractos} extractos)")
+                conteo = diferencias["estado"].value_counts()
+                colE1, colE2, colE3 = st.columns(3)
+                colE1.metric("Faltantes (en PDF, no guardados)", int(conteo.get(FALTANTE, 0)))
+                colE2.metric("Sobrantes (guardados, no en PDF)", int(conteo.get(SOBRANTE, 0)))
+                colE3.metric("Monto distinto", int(conteo.get(MONTO_DISTINTO, 0)))
+                if errores:
+                    st.warning("No se pudieron re-parsear:\n" + "\n".join(f"{n}: {e}" for n, e in errores.items()))
+                if diferencias.empty:
+                    st.success("✅ Los movimientos guardados coinciden con los PDFs analizados.")
+                else:
+                    st.dataframe(
+                        diferencias.style.format({
+                            "monto_pdf": "${:,.2f}", "monto_guardado": "${:,.2f}", "diferencia": "${:,.2f}"
+                        }, na_rep="-"),
+                        use_container_width=True, hide_index=True
+                    )
+                    descarga_bajo_demanda(
+                        "📥 Descargar diferencias (CSV)",
+                        "diferencias_conciliacion.csv",
+                        lambda: generar_archivo(escribir_csv, diferencias),
+                        {"alcance": alcance_guardado}
+                    )
         else:
             st.info("No hay extractos disponibles para conciliación.")
 
     # === Tab 4: Cliente/Proveedor
-    with tab4:
+    if seccion == SECCIONES[3]:
         st.subheader("Análisis por Cliente/Proveedor")
+        ingresos_filtrados = indice.consultar(tipos=['ingreso'], **filtros)
+        egresos_filtrados = indice.consultar(tipos=['egreso'], **filtros)
         col1, col2 = st.columns(2)
         with col1:
             st.markdown("**Top 5 Clientes (Ingresos)**")
-            if "fuente" in ingresos_filtrados.columns and not ingresos_filtrados.empty:
-                top_clientes = ingresos_filtrados.groupby("fuente")["monto"].sum().sort_values(ascending=False).head(5)
+            if not ingresos_filtrados.empty:
+                top_clientes = totales_por_contraparte(ingresos_filtrados).head(5)
                 st.dataframe(
-                    top_clientes.reset_index().rename(columns={"fuente": "Cliente", "monto": "Total"}).style.format({"Total": "${:,.2f}"}),
+                    top_clientes.rename_axis("Cliente").reset_index(name="Total").style.format({"Total": "${:,.2f}"}),
                     use_container_width=True
                 )
-                fig, ax = plt.subplots(figsize=(6, 4))
-                top_clientes.plot(kind="barh", ax=ax)
-                ax.set_title("Principales Clientes")
-                ax.set_xlabel("Monto ($)")
-                st.pyplot(fig)
+                def _dibujar_clientes(ax):
+                    top_clientes.plot(kind="barh", ax=ax)
+                    ax.set_title("Principales Clientes")
+                    ax.set_xlabel("Monto ($)")
+                mostrar_grafico(
+                    "reportes_clientes", filtros, _dibujar_clientes,
+                    plotly=lambda: plotly_barras(top_clientes, "Principales Clientes", horizontal=True)
+                )
             else:
-                st.info("No hay datos de fuente en ingresos.")
+                st.info("No hay ingresos en el periodo.")
         with col2:
             st.markdown("**Top 5 Proveedores (Egresos)**")
-            if "proveedor" in egresos_filtrados.columns and not egresos_filtrados.empty:
-                top_proveedores = egresos_filtrados.groupby("proveedor")["monto"].sum().sort_values(ascending=False).head(5)
+            if not egresos_filtrados.empty:
+                top_proveedores = totales_por_contraparte(egresos_filtrados).head(5)
                 st.dataframe(
-                    top_proveedores.reset_index().rename(columns={"proveedor": "Proveedor", "monto": "Total"}).style.format({"Total": "${:,.2f}"}),
+                    top_proveedores.rename_axis("Proveedor").reset_index(name="Total").style.format({"Total": "${:,.2f}"}),
                     use_container_width=True
                 )
-                fig, ax = plt.subplots(figsize=(6, 4))
-                top_proveedores.plot(kind="barh", ax=ax, color="orange")
-                ax.set_title("Principales Proveedores")
-                ax.set_xlabel("Monto ($)")
-                st.pyplot(fig)
+                def _dibujar_proveedores(ax):
+                    top_proveedores.plot(kind="barh", ax=ax, color="orange")
+                    ax.set_title("Principales Proveedores")
+                    ax.set_xlabel("Monto ($)")
+                mostrar_grafico(
+                    "reportes_proveedores", filtros, _dibujar_proveedores,
+                    plotly=lambda: plotly_barras(top_proveedores, "Principales Proveedores", horizontal=True, color="orange")
+                )
             else:
-                st.info("No hay datos de proveedor en egresos.")
+                st.info("No hay egresos en el periodo.")
 
 
-    # === Tab 5: Exportar Datos
-    with tab5:
+    # === Tab 5: Transferencias internas emparejadas entre cuentas propias
+    if seccion == SECCIONES[4]:
+        st.subheader("Transferencias internas")
+        st.caption(
+            "Pares egreso/ingreso entre cuentas propias: mismo monto en bancos distintos dentro de "
+            f"{VENTANA_DIAS} días, o con tolerancia de tipo de cambio para cuentas en otra moneda."
+        )
+        transferencias = get_transferencias(movimientos_df)
+        pares = transferencias.pares
+        pares = pares[
+            (pares["fecha_egreso"] >= filtros["fecha_ini"]) & (pares["fecha_egreso"] <= filtros["fecha_fin"])
+            & (pares["banco_egreso"].isin(banco_sel) | pares["banco_ingreso"].isin(banco_sel))
+        ]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Pares", f"{len(pares):,}")
+        col2.metric("Monto transferido", f"${pares['monto_egreso'].sum():,.2f}")
+        col3.metric("Confirmados", f"{(pares['metodo'] == CONFIRMADO).sum():,}")
+        if not pares.empty:
+            tabla_paginada(
+                pares, "reportes_transferencias", filtros=filtros, orden_inicial=("fecha_egreso", False),
+                columnas_busqueda=["id_egreso", "id_ingreso", "banco_egreso", "banco_ingreso"]
+            )
+        else:
+            st.info("No hay transferencias internas emparejadas con estos filtros.")
+        if not transferencias.pares.empty and st.button("💾 Guardar emparejamientos", key="guardar_transferencias"):
+            ok, msg = guardar_emparejamientos(transferencias.pares)
+            if ok:
+                st.success(msg)
+            else:
+                st.error(msg)
+
+    # === Tab 6: Suscripciones y cargos periódicos detectados en todo el historial
+    if seccion == SECCIONES[5]:
+        st.subheader("Cargos recurrentes")
+        st.caption(
+            "Egresos que se repiten con periodicidad regular (semanal a anual) para una misma contraparte, "
+            "detectados sobre todo el historial. El costo anual usa el último precio cobrado."
+        )
+        recurrentes = get_recurrentes(movimientos_df)
+        solo_activos = st.toggle("Solo activos", value=True, key="recurrentes_activos")
+        resumen = recurrentes.activos() if solo_activos else recurrentes.resumen
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Cargos recurrentes", f"{len(resumen):,}")
+        col2.metric("Costo mensual estimado (activos)", f"${recurrentes.costo_mensual():,.2f}")
+        col3.metric("Con cambio de precio", f"{resumen['cambio_precio'].notna().sum():,}")
+        if not resumen.empty:
+            tabla_paginada(
+                resumen, "reportes_recurrentes", filtros={"activos": solo_activos},
+                orden_inicial=("costo_anual", False), columnas_busqueda=["contraparte", "periodicidad"]
+            )
+            contraparte_sel = st.selectbox("Historial de cobros", resumen["contraparte"], key="recurrentes_contraparte")
+            historial = recurrentes.historial(contraparte_sel)
+            st.line_chart(historial, x="fecha", y="monto")
+        else:
+            st.info("No se detectaron cargos recurrentes.")
+
+    # === Tab 7: Exportar Datos
+    if seccion == SECCIONES[6]:
         st.subheader("Exportar Datos Filtrados")
 
         # Subset para exportar (con los mismos filtros aplicados)
-        ingresos_export = mov_filtrados[mov_filtrados["tipo"].str.lower() == "ingreso"]
-        egresos_export = mov_filtrados[mov_filtrados["tipo"].str.lower() == "egreso"]
+        ingresos_export = indice.consultar(tipos=["ingreso"], **filtros)
+        egresos_export = indice.consultar(tipos=["egreso"], **filtros)
         extractos_filtrados = extractos_df[
             (extractos_df["fecha_inicio"] >= pd.Timestamp(fecha_desde)) &
             (extractos_df["fecha_fin"] <= pd.Timestamp(fecha_hasta)) &
@@ -289,18 +423,13 @@ def render(movimientos_df, extractos_df):
         st.markdown("### Ingresos filtrados")
         if not ingresos_export.empty:
             st.dataframe(ingresos_export.head(), use_container_width=True)
-            st.download_button(
-                "📥 Descargar Ingresos (CSV)",
-                ingresos_export.to_csv(index=False).encode("utf-8"),
-                "ingresos_export.csv"
+            descarga_bajo_demanda(
+                "📥 Descargar Ingresos (CSV)", "ingresos_export.csv",
+                lambda: generar_archivo(escribir_csv, ingresos_export), filtros
             )
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                ingresos_export.to_excel(writer, index=False)
-            st.download_button(
-                "📊 Descargar Ingresos (Excel)",
-                output.getvalue(),
-                "ingresos_export.xlsx"
+            descarga_bajo_demanda(
+                "📊 Descargar Ingresos (Excel)", "ingresos_export.xlsx",
+                lambda: generar_archivo(escribir_xlsx, {"ingresos": ingresos_export}), filtros, mime=MIME_XLSX
             )
         else:
             st.info("No hay ingresos filtrados para exportar.")
@@ -309,18 +438,13 @@ def render(movimientos_df, extractos_df):
         st.markdown("### Egresos filtrados")
         if not egresos_export.empty:
             st.dataframe(egresos_export.head(), use_container_width=True)
-            st.download_button(
-                "📥 Descargar Egresos (CSV)",
-                egresos_export.to_csv(index=False).encode("utf-8"),
-                "egresos_export.csv"
+            descarga_bajo_demanda(
+                "📥 Descargar Egresos (CSV)", "egresos_export.csv",
+                lambda: generar_archivo(escribir_csv, egresos_export), filtros
             )
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                egresos_export.to_excel(writer, index=False)
-            st.download_button(
-                "📊 Descargar Egresos (Excel)",
-                output.getvalue(),
-                "egresos_export.xlsx"
+            descarga_bajo_demanda(
+                "📊 Descargar Egresos (Excel)", "egresos_export.xlsx",
+                lambda: generar_archivo(escribir_xlsx, {"egresos": egresos_export}), filtros, mime=MIME_XLSX
             )
         else:
             st.info("No hay egresos filtrados para exportar.")
@@ -329,18 +453,26 @@ def render(movimientos_df, extractos_df):
         st.markdown("### Extractos filtrados")
         if not extractos_filtrados.empty:
             st.dataframe(extractos_filtrados.head(), use_container_width=True)
-            st.download_button(
-                "📥 Descargar Extractos (CSV)",
-                extractos_filtrados.to_csv(index=False).encode("utf-8"),
-                "extractos_export.csv"
+            descarga_bajo_demanda(
+                "📥 Descargar Extractos (CSV)", "extractos_export.csv",
+                lambda: generar_archivo(escribir_csv, extractos_filtrados), filtros
             )
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                extractos_filtrados.to_excel(writer, index=False)
-            st.download_button(
-                "📊 Descargar Extractos (Excel)",
-                output.getvalue(),
-                "extractos_export.xlsx"
+            descarga_bajo_demanda(
+                "📊 Descargar Extractos (Excel)", "extractos_export.xlsx",
+                lambda: generar_archivo(escribir_xlsx, {"extractos": extractos_filtrados}), filtros, mime=MIME_XLSX
             )
         else:
             st.info("No hay extractos filtrados para exportar.")
+
+        st.divider()
+        st.markdown("### Todo en un archivo")
+        hojas = {"ingresos": ingresos_export, "egresos": egresos_export, "extractos": extractos_filtrados}
+        descarga_bajo_demanda(
+            "📚 Descargar libro Excel (ingresos, egresos, extractos)", "reporte_completo.xlsx",
+            lambda: generar_archivo(escribir_xlsx, hojas), filtros, mime=MIME_XLSX
+        )
+        if parquet_disponible():
+            descarga_bajo_demanda(
+                "🗜️ Descargar Parquet (zip)", "reporte_completo_parquet.zip",
+                lambda: generar_archivo(escribir_parquet_zip, hojas), filtros, mime=MIME_ZIP
+            )
@@ -0,0 +1,231 @@
+"""
+Respaldo y restauración completos. El respaldo es un zip con un .parquet (zstd) por hoja
+(movimientos, extractos, transferencias y el historial de cambios) y un manifest.json con la
+versión del formato, las filas, las columnas, la clave y el SHA-256 de cada archivo.
+
+Escribir y leer van por row groups: la memoria no depende del número de filas. Restaurar
+primero valida todo el archivo (checksums, columnas, claves) y solo entonces hace upsert por
+clave en Sheets, un lote a la vez.
+"""
+import datetime
+import hashlib
+import json
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.exportar import copiar_a_zip, escribir_parquet
+from modules.sheets_utils import generar_id_compuesto, load_hoja_opcional, upsert_filas
+
+FORMATO = 1
+MANIFIESTO = "manifest.json"
+# Filas por row group al escribir y por lote al validar/restaurar (una llamada a Sheets por lote)
+FILAS_POR_LOTE = 5_000
+# Hoja -> columna clave del upsert
+HOJAS = {
+    "movimientos": "id",
+    "extractos": "extracto_id",
+    "transferencias": "id_egreso",
+    "cambios": "evento_id",
+    "cambios_archivo": "evento_id",
+    "snapshots": "snapshot_id",
+}
+COLUMNAS_REQUERIDAS = {
+    "movimientos": ["id", "fecha", "banco", "monto", "tipo"],
+    "extractos": ["extracto_id", "banco"],
+}
+# Errores que se muestran como máximo al validar
+ERRORES_MAX = 10
+
+
+def hojas_respaldo():
+    """Las hojas a respaldar: las de la sesión y el historial de cambios (se lee de Sheets)."""
+    hojas = {
+        "movimientos": st.session_state.get("movimientos_df"),
+        "extractos": st.session_state.get("extractos_df"),
+        "transferencias": st.session_state.get("transferencias_df"),
+        "cambios": load_hoja_opcional("cambios"),
+        "cambios_archivo": load_hoja_opcional("cambios_archivo"),
+        "snapshots": load_hoja_opcional("snapshots"),
+    }
+    return {nombre: df for nombre, df in hojas.items() if df is not None and not df.empty}
+
+
+def escribir_respaldo(hojas, destino, filas_por_lote=FILAS_POR_LOTE):
+    """Escribe en `destino` el zip de respaldo de `hojas` (dict nombre -> DataFrame) con su manifiesto."""
+    manifiesto = {
+        "formato": FORMATO,
+        "creado": datetime.datetime.now().isoformat(timespec="seconds"),
+        "usuario": st.session_state.get("username", "anon"),
+        "hojas": {},
+    }
+    # El parquet ya va comprimido: el zip solo los empaqueta
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zf:
+        for nombre, df in hojas.items():
+            archivo = f"{nombre}.parquet"
+            suma = hashlib.sha256()
+            with tempfile.TemporaryFile() as tmp:
+                escribir_parquet(df, tmp, filas_por_lote, compression="zstd")
+                tmp.seek(0)
+                copiar_a_zip(tmp, zf, archivo, al_leer=suma.update)
+            manifiesto["hojas"][nombre] = {
+                "archivo": archivo,
+                "clave": HOJAS.get(nombre, "id"),
+                "filas": len(df),
+                "columnas": [str(c) for c in df.columns],
+                "sha256": suma.hexdigest(),
+            }
+        zf.writestr(MANIFIESTO, json.dumps(manifiesto, ensure_ascii=False, indent=2))
+
+
+def leer_manifiesto(zf):
+    """Manifiesto del zip abierto `zf`; ValueError si falta o es de un formato desconocido."""
+    try:
+        manifiesto = json.loads(zf.read(MANIFIESTO))
+    except KeyError:
+        raise ValueError(f"El archivo no es un respaldo (falta {MANIFIESTO})")
+    if manifiesto.get("formato", 0) > FORMATO:
+        raise ValueError(f"Respaldo de un formato más nuevo ({manifiesto['formato']}) que el soportado ({FORMATO})")
+    return manifiesto
+
+
+def _sha256(zf, archivo):
+    suma = hashlib.sha256()
+    with zf.open(archivo) as entrada:
+        while bloque := entrada.read(1024 * 1024):
+            suma.update(bloque)
+    return suma.hexdigest()
+
+
+def lotes_parquet(zf, archivo, filas_por_lote=FILAS_POR_LOTE):
+    """DataFrames de `filas_por_lote` filas leídos de un .parquet del zip, sin cargarlo entero."""
+    import pyarrow.parquet as pq
+
+    with zf.open(archivo) as entrada:
+        for lote in pq.ParquetFile(entrada).iter_batches(batch_size=filas_por_lote):
+            yield lote.to_pandas()
+
+
+def lotes_csv(archivo, filas_por_lote=FILAS_POR_LOTE):
+    """Movimientos de un CSV por lotes; a las filas sin `id` se les genera el id compuesto."""
+    archivo.seek(0)
+    for lote in pd.read_csv(archivo, chunksize=filas_por_lote, dtype={"id": str}):
+        if "id" not in lote.columns:
+            lote["id"] = None
+        sin_id = lote["id"].isna() | (lote["id"].astype(str).str.strip() == "")
+        if sin_id.any() and {"fecha", "banco", "descripción", "monto"}.issubset(lote.columns):
+            lote.loc[sin_id, "id"] = [
+                generar_id_compuesto(f["fecha"], f["banco"], f["descripción"], f["monto"])
+                for f in lote.loc[sin_id].to_dict("records")
+            ]
+        yield lote
+
+
+def validar_lotes(nombre, lotes, clave):
+    """
+    Recorre los lotes de una hoja y devuelve (filas, errores): columnas requeridas, claves
+    vacías o repetidas y, en movimientos, montos no numéricos y fechas inválidas. Solo se
+    guardan las claves vistas (para detectar repetidas), no las filas.
+    """
+    filas, errores, vistas = 0, [], set()
+    requeridas = COLUMNAS_REQUERIDAS.get(nombre, [clave])
+    for lote in lotes:
+        faltantes = [c for c in requeridas if c not in lote.columns]
+        if faltantes:
+            return filas, [f"'{nombre}': faltan las columnas {', '.join(faltantes)}"]
+        claves = lote[clave].astype(str).str.strip()
+        vacias = lote[clave].isna() | (claves == "")
+        if vacias.any():
+            errores.append(f"'{nombre}': {int(vacias.sum())} filas sin {clave} (desde la fila {filas + int(vacias.argmax()) + 2})")
+        # Pertenencia al set por elemento: isin(vistas) copiaría el set entero en cada lote
+        ya_vistas = np.fromiter((c in vistas for c in claves), dtype=bool, count=len(claves))
+        repetidas = claves[~vacias & (claves.duplicated().to_numpy() | ya_vistas)]
+        if not repetidas.empty:
+            errores.append(f"'{nombre}': {clave} repetido: {', '.join(repetidas.unique()[:3])}")
+        vistas.update(claves[~vacias])
+        if nombre == "movimientos":
+            monto = pd.to_numeric(lote["monto"], errors="coerce")
+            malos = monto.isna() & lote["monto"].notna()
+            if malos.any():
+                errores.append(f"'{nombre}': monto no numérico en {int(malos.sum())} filas (p. ej. {lote.loc[malos, 'monto'].iloc[0]!r})")
+            fecha = pd.to_datetime(lote["fecha"], errors="coerce", format="mixed")
+            malas = fecha.isna() & lote["fecha"].notna()
+            if malas.any():
+                errores.append(f"'{nombre}': fecha inválida en {int(malas.sum())} filas (p. ej. {lote.loc[malas, 'fecha'].iloc[0]!r})")
+        filas += len(lote)
+        if len(errores) >= ERRORES_MAX:
+            break
+    return filas, errores[:ERRORES_MAX]
+
+
+def validar_respaldo(archivo):
+    """
+    Valida un zip de respaldo sin escribir nada: manifiesto, checksums, filas declaradas y el
+    contenido de cada hoja. Devuelve (ok, errores, manifiesto).
+    """
+    try:
+        with zipfile.ZipFile(archivo) as zf:
+            manifiesto = leer_manifiesto(zf)
+            errores = []
+            for nombre, info in manifiesto["hojas"].items():
+                if info["archivo"] not in zf.namelist():
+                    errores.append(f"'{nombre}': falta {info['archivo']}")
+                    continue
+                if _sha256(zf, info["archivo"]) != info["sha256"]:
+                    errores.append(f"'{nombre}': el checksum no coincide (archivo dañado o modificado)")
+                    continue
+                filas, errores_hoja = validar_lotes(nombre, lotes_parquet(zf, info["archivo"]), info["clave"])
+                errores += errores_hoja
+                if not errores_hoja and filas != info["filas"]:
+                    errores.append(f"'{nombre}': tiene {filas:,} filas y el manifiesto dice {info['filas']:,}")
+            return not errores, errores, manifiesto
+    except (zipfile.BadZipFile, ValueError, KeyError) as e:
+        return False, [f"Respaldo inválido: {e}"], None
+
+
+def restaurar_respaldo(archivo, hojas=None, progreso=None, forzar=False):
+    """
+    Valida el respaldo y hace upsert por clave de las `hojas` pedidas (todas por defecto).
+    Las filas editadas después del respaldo son conflictos salvo con `forzar` (ver `upsert_filas`).
+    `progreso(hoja, filas, total)` se llama después de cada lote. Devuelve (ok, mensaje).
+    """
+    ok, errores, manifiesto = validar_respaldo(archivo)
+    if not ok:
+        return False, "; ".join(errores)
+    mensajes = []
+    with zipfile.ZipFile(archivo) as zf:
+        for nombre, info in manifiesto["hojas"].items():
+            if hojas is not None and nombre not in hojas:
+                continue
+            ok, msg = upsert_filas(
+                lotes_parquet(zf, info["archivo"]), nombre, info["clave"],
+                progreso=None if progreso is None else lambda n, h=nombre, t=info["filas"]: progreso(h, n, t),
+                forzar=forzar,
+            )
+            mensajes.append(msg)
+            if not ok:
+                return False, "; ".join(mensajes)
+    return True, "; ".join(mensajes)
+
+
+def importar_csv(archivo, progreso=None, forzar=False):
+    """Valida un CSV de movimientos y hace upsert por `id`, un lote a la vez. Devuelve (ok, mensaje)."""
+    filas, errores = validar_lotes("movimientos", lotes_csv(archivo), "id")
+    if errores:
+        return False, "; ".join(errores)
+    return upsert_filas(
+        lotes_csv(archivo), "movimientos", "id",
+        progreso=None if progreso is None else lambda n: progreso("movimientos", n, filas),
+        forzar=forzar,
+    )
+
+
+def resumen_manifiesto(manifiesto):
+    """Tabla con las hojas de un respaldo (para mostrar antes de restaurar)."""
+    return pd.DataFrame([
+        {"hoja": nombre, "filas": info["filas"], "columnas": len(info["columnas"]), "clave": info["clave"]}
+        for nombre, info in manifiesto["hojas"].items()
+    ])
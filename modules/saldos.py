@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from modules.data_loader import completar_filas, obtener_derivado
+
+
+def _netos_diarios(movimientos_df):
+    """Monto neto con signo (ingreso +, egreso -) por banco y día."""
+    if movimientos_df is None or movimientos_df.empty:
+        return pd.Series(dtype=float, index=pd.MultiIndex.from_arrays([[], []], names=["banco", "fecha"]))
+    fechas = pd.to_datetime(movimientos_df["fecha"], errors="coerce").dt.normalize()
+    montos = pd.to_numeric(movimientos_df["monto"], errors="coerce").fillna(0.0)
+    signo = np.where(movimientos_df["tipo"].astype(str).str.lower() == "ingreso", 1.0, -1.0)
+    netos = pd.DataFrame({
+        "banco": movimientos_df["banco"].fillna("").astype(str).to_numpy(),
+        "fecha": fechas.to_numpy(),
+        "neto": montos.to_numpy() * signo,
+    }).dropna(subset=["fecha"])
+    return netos.groupby(["banco", "fecha"])["neto"].sum()
+
+
+def _anclas(extractos_df):
+    """Por banco: (fecha_inicio, saldo_inicial) de cada extracto con saldo, ordenados por fecha."""
+    if extractos_df is None or extractos_df.empty:
+        return {}
+    ext = pd.DataFrame({
+        "banco": extractos_df["banco"].fillna("").astype(str),
+        "fecha_inicio": pd.to_datetime(extractos_df["fecha_inicio"], errors="coerce").dt.normalize(),
+        "fecha_fin": pd.to_datetime(extractos_df["fecha_fin"], errors="coerce").dt.normalize(),
+        "saldo_inicial": pd.to_numeric(extractos_df["saldo_inicial"], errors="coerce"),
+    }).dropna(subset=["fecha_inicio", "saldo_inicial"])
+    # Si un periodo está cargado dos veces se queda el último
+    ext = ext.sort_values("fecha_inicio", kind="stable").drop_duplicates(["banco", "fecha_inicio"], keep="last")
+    return {banco: grupo.reset_index(drop=True) for banco, grupo in ext.groupby("banco")}
+
+
+def saldo_diario_banco(netos, anclas):
+    """
+    Saldo al cierre de cada día para un banco.
+
+    Cada día toma como ancla el último extracto que empezó en o antes de ese día: su
+    saldo_inicial más la suma de los netos desde fecha_inicio hasta el día. Con la suma
+    acumulada C, eso es saldo_inicial[a] + C[día] - C[fecha_inicio[a] - 1], todo vectorizado.
+    Los días posteriores al último extracto siguen acumulando los movimientos ya cargados.
+    """
+    if anclas.empty:
+        return pd.Series(dtype=float)
+    inicio = anclas["fecha_inicio"].iloc[0]
+    fin = max(anclas["fecha_fin"].max(), netos.index.max() if not netos.empty else inicio)
+    dias = pd.date_range(inicio, fin if pd.notna(fin) else inicio, freq="D")
+    neto = netos.reindex(dias, fill_value=0.0).to_numpy()
+    acumulado = np.cumsum(neto)
+    previo = acumulado - neto  # suma acumulada hasta el día anterior
+
+    inicios = anclas["fecha_inicio"].to_numpy()
+    ancla = np.searchsorted(inicios, dias.to_numpy(), side="right") - 1
+    posicion_ancla = (inicios - inicios[0]).astype("timedelta64[D]").astype(int)
+    saldos = anclas["saldo_inicial"].to_numpy()[ancla] + acumulado - previo[posicion_ancla[ancla]]
+    return pd.Series(np.round(saldos, 2), index=dias, name="saldo")
+
+
+class SaldosDiarios:
+    """
+    Serie de saldo diario por banco anclada en el saldo_inicial de cada extracto.
+
+    Se construye una vez por versión de datos. Al anexar/editar movimientos o anexar extractos
+    solo se recalculan los bancos afectados (las sumas diarias por banco se mantienen).
+    """
+
+    def __init__(self, movimientos_df, extractos_df):
+        self._netos = _netos_diarios(movimientos_df)
+        self._anclas = _anclas(extractos_df)
+        self._series = {}
+        for banco in self._anclas:
+            self._recalcular(banco)
+
+    def _netos_banco(self, banco):
+        if banco in self._netos.index.get_level_values("banco"):
+            return self._netos.xs(banco, level="banco")
+        return pd.Series(dtype=float)
+
+    def _recalcular(self, banco):
+        if banco in self._anclas:
+            self._series[banco] = saldo_diario_banco(self._netos_banco(banco), self._anclas[banco])
+
+    def _sumar_netos(self, delta):
+        if delta.empty:
+            return
+        self._netos = self._netos.add(delta, fill_value=0.0)
+        for banco in delta.index.get_level_values("banco").unique():
+            self._recalcular(banco)
+
+    def anexar(self, nuevos_df):
+        self._sumar_netos(_netos_diarios(nuevos_df))
+
+    def actualizar(self, antes_df, despues_df):
+        delta = _netos_diarios(completar_filas(antes_df, despues_df)).sub(_netos_diarios(antes_df), fill_value=0.0)
+        self._sumar_netos(delta)
+
+    def anexar_extractos(self, nuevos_df):
+        for banco, nuevas in _anclas(nuevos_df).items():
+            actuales = self._anclas.get(banco)
+            combinadas = nuevas if actuales is None else pd.concat([actuales, nuevas], ignore_index=True)
+            self._anclas[banco] = (
+                combinadas.sort_values("fecha_inicio", kind="stable")
+                .drop_duplicates("fecha_inicio", keep="last").reset_index(drop=True)
+            )
+            self._recalcular(banco)
+
+    @property
+    def bancos(self):
+        return sorted(self._series)
+
+    def consultar(self, fecha_ini=None, fecha_fin=None, bancos=None):
+        """
+        DataFrame indexado por día con una columna por banco y "Total". Un banco sin extracto
+        anterior a un día no tiene saldo ese día (NaN) y no suma al total; después de su último
+        movimiento mantiene el último saldo.
+        """
+        bancos = self.bancos if bancos is None else [b for b in bancos if b in self._series]
+        if not bancos:
+            return pd.DataFrame()
+        saldos = pd.concat({b: self._series[b] for b in bancos}, axis=1).sort_index().ffill()
+        saldos["Total"] = saldos.sum(axis=1, min_count=1)
+        return saldos.loc[fecha_ini:fecha_fin]
+
+
+def get_saldos(movimientos_df, extractos_df):
+    """Saldos diarios de la versión de datos actual (se construyen la primera vez que se piden)."""
+    return obtener_derivado("saldos", lambda: SaldosDiarios(movimientos_df, extractos_df))
@@ -1,11 +1,22 @@
 import gspread
-from gspread_dataframe import get_as_dataframe, set_with_dataframe
+from gspread_dataframe import get_as_dataframe
+import numpy as np
 import pandas as pd
 import streamlit as st
 import datetime
+import threading
 import uuid
+from gspread.utils import rowcol_to_a1
 
 from modules.auth import get_credentials
+from modules.metricas import instrumentado
+
+# Versión de cada fila: cada escritura la incrementa y una edición solo se aplica si la fila
+# sigue en la versión que se leyó (control de concurrencia optimista)
+COLUMNA_VERSION = "version"
+# Token de la última escritura de cada fila: después de escribir se vuelve a leer para detectar
+# si otra escritura (de otro proceso) pisó la fila entre la comprobación y la escritura
+COLUMNA_ESCRITURA = "escritura"
 
 @st.cache_resource
 def get_google_sheets_client():
@@ -32,30 +43,8 @@ def save_to_google_sheets(data, sheet_type):
     data["registrado_por"] = st.session_state["username"]
     data["fecha_registro"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    # En modo producción:
-    gc = get_google_sheets_client()
-    if gc:
-        try:
-            # Abrir hoja de cálculo
-            sheet_id = st.secrets["google"]["spreadsheet_id"]  # En producción
-            sh = gc.open_by_key(sheet_id)
-            worksheet = sh.worksheet(sheet_type)
-            
-            # Leer datos existentes
-            existing_data = pd.DataFrame(worksheet.get_all_records())
-            
-            # Añadir nueva fila
-            new_row = pd.DataFrame([data])
-            updated_data = pd.concat([existing_data, new_row], ignore_index=True)
-            
-            # Actualizar hoja
-            set_with_dataframe(worksheet, updated_data)
-            return True, "Datos guardados correctamente en Google Sheets"
-        except Exception as e:
-            return False, f"Error al guardar en Google Sheets: {e}"
-    else:
-        # Modo demo - guardamos en datos temporales
-        return False, "Solo se permite guardar en Google Sheets real."
+    ok, msg, _ = anexar_filas(pd.DataFrame([data]), sheet_type)
+    return ok, "Datos guardados correctamente en Google Sheets" if ok else msg
 
 # @st.cache_data
 # def load_demo_data():
@@ -116,25 +105,15 @@ def save_to_unificada(data, sheet_name="movimientos"):
     data["registrado_por"] = st.session_state.get("username", "anon")
     data["fecha_registro"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    gc = get_google_sheets_client()
-    if gc:
-        try:
-            sheet_id = st.secrets["google"]["spreadsheet_id"]
-            sh = gc.open_by_key(sheet_id)
-            worksheet = sh.worksheet(sheet_name)
-            existing_data = pd.DataFrame(worksheet.get_all_records())
-            if not existing_data.empty and data["id"] in existing_data["id"].values:
-                return False, f"Registro duplicado: {data['id']}"
-            # Añadir nueva fila
-            new_row = pd.DataFrame([data])
-            updated_data = pd.concat([existing_data, new_row], ignore_index=True)
-            set_with_dataframe(worksheet, updated_data)
-            return True, f"Registro guardado: {data['id']}"
-        except Exception as e:
-            return False, f"Error al guardar en Google Sheets: {e}"
-    else:
-        return False, "No se pudo conectar a Google Sheets"
+    ok, msg, anexadas = anexar_filas(pd.DataFrame([data]), sheet_name)
+    if not ok:
+        return False, msg
+    if anexadas.empty:
+        return False, f"Registro duplicado: {data['id']}"
+    data[COLUMNA_VERSION] = 1
+    return True, f"Registro guardado: {data['id']}"
 
+@instrumentado("sheets")
 def load_movimientos_data(sheet_name="movimientos"):
     gc = get_google_sheets_client()
     if gc:
@@ -150,3 +129,355 @@ def load_movimientos_data(sheet_name="movimientos"):
     else:
         st.error("No se pudo conectar a Google Sheets")
         return pd.DataFrame()
+
+@instrumentado("sheets")
+def load_hoja_opcional(sheet_name):
+    """Como `load_movimientos_data`, pero una hoja que todavía no existe devuelve un DataFrame vacío."""
+    gc = get_google_sheets_client()
+    if not gc:
+        return pd.DataFrame()
+    try:
+        sh = gc.open_by_key(st.secrets["google"]["spreadsheet_id"])
+        worksheet = sh.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        return pd.DataFrame()
+    except Exception as e:
+        st.error(f"Error al cargar la hoja '{sheet_name}': {e}")
+        return pd.DataFrame()
+    return get_as_dataframe(worksheet).dropna(how='all')
+
+def _valor_celda(valor):
+    """Valor serializable para la API de Sheets (numpy, NaN y fechas de pandas no lo son)."""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ""
+    if isinstance(valor, (pd.Timestamp, datetime.date)):
+        return valor.strftime("%Y-%m-%d")
+    return valor.item() if hasattr(valor, "item") else valor
+
+def _version(valor):
+    """Versión de una fila; las filas anteriores a la columna (celda vacía) están en la 0."""
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return 0
+
+def _columna(posicion):
+    """Rango A1 de una columna entera ("C:C")."""
+    letra = rowcol_to_a1(1, posicion)[:-1]
+    return f"{letra}:{letra}"
+
+def _abrir_hoja(sheet_name, crear=False):
+    gc = get_google_sheets_client()
+    if not gc:
+        raise ConnectionError("No se pudo conectar a Google Sheets")
+    sh = gc.open_by_key(st.secrets["google"]["spreadsheet_id"])
+    try:
+        return sh.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        if not crear:
+            raise
+        return sh.add_worksheet(title=sheet_name, rows=100, cols=10)
+
+def _ampliar_encabezado(worksheet, encabezado, columnas):
+    """Agrega al encabezado las `columnas` que faltan; devuelve las celdas a escribir para ello."""
+    datos = []
+    for col in dict.fromkeys(columnas):
+        if col not in encabezado:
+            encabezado.append(col)
+            datos.append({"range": rowcol_to_a1(1, len(encabezado)), "values": [[col]]})
+    if len(encabezado) > worksheet.col_count:
+        worksheet.add_cols(len(encabezado) - worksheet.col_count)
+    return datos
+
+@st.cache_resource
+def _bloqueo_hoja(sheet_name):
+    """
+    Lock del proceso para una hoja: las sesiones de este servidor hacen leer-comprobar-escribir
+    de a una. Entre procesos no hay lock (Sheets no tiene escrituras condicionales): eso lo cubre
+    la relectura de `COLUMNA_ESCRITURA` después de escribir.
+    """
+    return threading.Lock()
+
+def _leer_claves(worksheet, encabezado, columna_clave):
+    """Listas (claves, versiones, escrituras) de las filas de datos, leyendo solo esas tres columnas."""
+    if columna_clave not in encabezado:
+        return [], [], []
+    columnas = [c for c in (columna_clave, COLUMNA_VERSION, COLUMNA_ESCRITURA) if c in encabezado]
+    leidas = dict(zip(columnas, worksheet.batch_get([_columna(encabezado.index(c) + 1) for c in columnas])))
+    n = len(leidas[columna_clave])
+
+    def _valores(col):
+        # batch_get omite las celdas vacías al final de la columna
+        celdas = [str(fila[0]) if fila else "" for fila in leidas.get(col, [])[:n]]
+        return (celdas + [""] * (n - len(celdas)))[1:]
+    return _valores(columna_clave), [_version(v) for v in _valores(COLUMNA_VERSION)], _valores(COLUMNA_ESCRITURA)
+
+def _filas_por_clave(worksheet, encabezado, columna_clave):
+    """{clave: (número de fila, versión)} de la primera fila de cada clave."""
+    claves, versiones, _ = _leer_claves(worksheet, encabezado, columna_clave)
+    fila_de_id = {}
+    for fila, (clave, version) in enumerate(zip(claves, versiones), start=2):
+        fila_de_id.setdefault(clave, (fila, version))
+    return fila_de_id
+
+def _pisadas(worksheet, encabezado, columna_clave, claves, token):
+    """
+    Relee la hoja después de escribir: (claves de `claves` cuya primera fila no quedó con la
+    escritura `token`, números de nuestras filas repetidas). Una clave pisada la escribió otro
+    proceso después; una fila repetida es un append nuestro de una clave que otro anexó antes.
+    """
+    leidas, _, escrituras = _leer_claves(worksheet, encabezado, columna_clave)
+    primera, repetidas = {}, []
+    for fila, (clave, escritura) in enumerate(zip(leidas, escrituras), start=2):
+        if clave in primera:
+            if escritura == token:
+                repetidas.append(fila)
+        else:
+            primera[clave] = escritura
+    return [c for c in claves if primera.get(c) != token], repetidas
+
+def _limpiar_filas(worksheet, filas, columnas):
+    """Vacía las `filas` (sin borrarlas, para no mover los números de fila de otras escrituras)."""
+    if filas:
+        worksheet.batch_clear([f"{rowcol_to_a1(f, 1)}:{rowcol_to_a1(f, columnas)}" for f in filas])
+
+def _mensaje_conflicto(claves, detalle):
+    return (
+        f"Conflicto: {len(claves)} filas {detalle} "
+        f"({', '.join(claves[:3])}{'...' if len(claves) > 3 else ''}). "
+    )
+
+def _valores_filas(df):
+    """Como `_valor_celda` para un DataFrame entero, por columnas en lugar de celda a celda."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+    # astype(object) convierte los escalares de numpy en int/float de Python
+    return df.astype(object).where(df.notna(), "").to_numpy().tolist()
+
+def _tramos(posiciones):
+    """Agrupa posiciones de columna ordenadas en tramos contiguos [(primera, última), ...]."""
+    tramos = []
+    for p in posiciones:
+        if tramos and p == tramos[-1][1] + 1:
+            tramos[-1] = (tramos[-1][0], p)
+        else:
+            tramos.append((p, p))
+    return tramos
+
+@instrumentado("sheets")
+def anexar_filas(df, sheet_name="movimientos", columna_clave="id"):
+    """
+    Agrega al final de la hoja las filas de `df` cuya clave todavía no existe, con versión 1.
+    Si `df` repite una clave (p. ej. un movimiento en dos chunks solapados) queda la primera.
+    Solo lee la columna de claves y escribe con append_rows (se agregan a continuación de lo
+    que haya en ese momento), así dos sesiones que anexan a la vez no se pisan.
+
+    Las sesiones de este servidor anexan de a una (`_bloqueo_hoja`). Si otro proceso anexó la
+    misma clave entre la lectura y el append, la relectura posterior lo detecta: queda la primera
+    fila de la clave y las nuestras repetidas se vacían (no se devuelven como anexadas).
+    Devuelve (ok, mensaje, filas anexadas).
+    """
+    vacio = df.iloc[:0]
+    try:
+        worksheet = _abrir_hoja(sheet_name, crear=True)
+        with _bloqueo_hoja(sheet_name):
+            encabezado = worksheet.row_values(1)
+            existentes = set(_leer_claves(worksheet, encabezado, columna_clave)[0])
+            claves = df[columna_clave].astype(str)
+            token = uuid.uuid4().hex
+            nuevos = df[~claves.duplicated() & ~claves.isin(existentes)].assign(
+                **{COLUMNA_VERSION: 1, COLUMNA_ESCRITURA: token}
+            )
+            if nuevos.empty:
+                return True, "No hay filas nuevas para guardar", vacio
+            datos = _ampliar_encabezado(worksheet, encabezado, list(nuevos.columns))
+            if datos:
+                worksheet.batch_update(datos, value_input_option="USER_ENTERED")
+            filas = [[_valor_celda(v) for v in fila] for fila in nuevos.reindex(columns=encabezado).itertuples(index=False)]
+            worksheet.append_rows(filas, value_input_option="USER_ENTERED", table_range="A1")
+
+            claves_nuevas = nuevos[columna_clave].astype(str).tolist()
+            pisadas, repetidas = _pisadas(worksheet, encabezado, columna_clave, claves_nuevas, token)
+            _limpiar_filas(worksheet, repetidas, len(encabezado))
+        if pisadas:
+            nuevos = nuevos[~nuevos[columna_clave].astype(str).isin(pisadas)]
+            return True, (
+                f"{len(nuevos)} filas guardadas en '{sheet_name}'; otra sesión guardó al mismo tiempo "
+                f"{len(pisadas)} de las mismas filas (se conservan las suyas)"
+            ), nuevos
+        return True, f"{len(nuevos)} filas guardadas en '{sheet_name}'", nuevos
+    except Exception as e:
+        return False, f"Error al guardar en Google Sheets: {e}", vacio
+
+@instrumentado("sheets")
+def archivar_filas(sheet_name, archivo, columna_clave, archivar):
+    """
+    Mueve a la hoja `archivo` el bloque inicial de filas de `sheet_name` que cumplen `archivar`
+    (función DataFrame -> máscara; las filas vacías se archivan siempre) y lo borra de la hoja.
+    Primero se anexa al archivo por `columna_clave` (repetirlo después de un error no duplica) y
+    después se borran las filas; lo que se anexe mientras tanto queda detrás del bloque.
+    Devuelve (ok, mensaje, filas movidas).
+    """
+    try:
+        worksheet = _abrir_hoja(sheet_name)
+        with _bloqueo_hoja(sheet_name):
+            # El índice es posicional (fila i -> fila i + 2 de la hoja); se rellenan las filas vacías
+            df = get_as_dataframe(worksheet)
+            df = df.loc[:, [c for c in df.columns if not str(c).startswith("Unnamed:")]]
+            df = df.reindex(pd.RangeIndex(int(df.index.max()) + 1 if len(df) else 0))
+            mover = (archivar(df) | df.isna().all(axis=1)).to_numpy()
+            k = len(df) if mover.all() else int(np.argmin(mover))
+            bloque = df.iloc[:k].dropna(how="all")
+            if k == 0:
+                return True, "No hay filas para archivar", 0
+            if not bloque.empty:
+                ok, msg, _ = anexar_filas(bloque, archivo, columna_clave)
+                if not ok:
+                    return False, msg, 0
+            worksheet.delete_rows(2, k + 1)
+        return True, f"{len(bloque):,} filas de '{sheet_name}' archivadas en '{archivo}'", len(bloque)
+    except Exception as e:
+        return False, f"Error al archivar '{sheet_name}': {e}", 0
+
+@instrumentado("sheets")
+def actualizar_celdas(cambios, sheet_name="movimientos", columna_clave="id", versiones=None):
+    """
+    Escribe solo las celdas cambiadas: `cambios` es {id: {columna: valor}}. Lee el encabezado,
+    la columna de ids y la de versiones, y manda todas las celdas en un único batch_update,
+    sin reescribir la hoja. Las columnas que la hoja todavía no tiene se agregan al encabezado.
+
+    Control de versión por fila: si se pasa `versiones` ({id: versión leída}) y alguna fila ya
+    no está en esa versión (otra sesión la modificó), no se escribe nada y se informa el conflicto.
+    Cada fila escrita sube de versión y lleva un token de escritura nuevo; ambos quedan en
+    `cambios[id]`. Si algún id no está en la hoja tampoco se escribe nada.
+
+    Sheets no tiene escrituras condicionales: comprobar y escribir son dos peticiones. Las
+    sesiones de este servidor las hacen de a una (`_bloqueo_hoja`); entre procesos, después de
+    escribir se relee el token de cada fila y, si otra escritura la pisó, se informa el conflicto.
+    """
+    if not cambios:
+        return True, "No hay cambios para guardar"
+    try:
+        worksheet = _abrir_hoja(sheet_name)
+        with _bloqueo_hoja(sheet_name):
+            encabezado = worksheet.row_values(1)
+            datos = _ampliar_encabezado(worksheet, encabezado, [COLUMNA_VERSION, COLUMNA_ESCRITURA])
+            fila_de_id = _filas_por_clave(worksheet, encabezado, columna_clave)
+            faltantes = [str(i) for i in cambios if str(i) not in fila_de_id]
+            if faltantes:
+                return False, f"{len(faltantes)} movimientos ya no están en la hoja (p. ej. {faltantes[0]}); no se guardó nada"
+            conflictos = [
+                str(i) for i, leida in (versiones or {}).items()
+                if str(i) in fila_de_id and fila_de_id[str(i)][1] != _version(leida)
+            ]
+            if conflictos:
+                return False, _mensaje_conflicto(conflictos, "cambiaron en la hoja desde que se cargaron") + (
+                    "No se guardó nada: recarga los datos y vuelve a aplicar los cambios."
+                )
+
+            datos += _ampliar_encabezado(worksheet, encabezado, [c for valores in cambios.values() for c in valores])
+            posicion = {col: i + 1 for i, col in enumerate(encabezado)}
+            token = uuid.uuid4().hex
+            for id_mov, valores in cambios.items():
+                fila, version = fila_de_id[str(id_mov)]
+                valores[COLUMNA_VERSION] = version + 1
+                valores[COLUMNA_ESCRITURA] = token
+                for col, valor in valores.items():
+                    datos.append({"range": rowcol_to_a1(fila, posicion[col]), "values": [[_valor_celda(valor)]]})
+            worksheet.batch_update(datos, value_input_option="USER_ENTERED")
+            pisadas, _ = _pisadas(worksheet, encabezado, columna_clave, [str(i) for i in cambios], token)
+        if pisadas:
+            return False, _mensaje_conflicto(pisadas, "fueron escritas por otra sesión al mismo tiempo y quedaron sus valores") + (
+                "Recarga los datos y revisa esos movimientos."
+            )
+        return True, f"{len(cambios)} movimientos actualizados ({len(datos)} celdas)"
+    except Exception as e:
+        return False, f"Error al guardar en Google Sheets: {e}"
+
+@instrumentado("sheets")
+def upsert_filas(lotes, sheet_name="movimientos", columna_clave="id", progreso=None, forzar=False):
+    """
+    Inserta o actualiza por `columna_clave` las filas de `lotes` (un iterable de DataFrames, p. ej.
+    los row groups de un respaldo). Las claves y versiones de la hoja se leen una sola vez; por
+    lote hay un batch_update con las filas existentes y un append_rows con las nuevas, así que
+    solo un lote está en memoria a la vez. Las claves de `lotes` tienen que ser únicas.
+
+    Las filas existentes pasan a la versión siguiente a la de la hoja (una sesión que las tenía
+    cargadas verá conflicto al editarlas); las nuevas conservan su versión o quedan en la 1.
+    Solo se escriben las columnas de los lotes: las demás columnas de la hoja no se tocan.
+    `progreso(filas)` se llama después de cada lote con las filas procesadas hasta entonces.
+
+    Si los lotes traen `COLUMNA_VERSION`, una fila existente cuya versión en la hoja no es la del
+    lote (se editó después del respaldo) no se escribe y se informa como conflicto, igual que en
+    `actualizar_celdas`; `forzar=True` las sobrescribe igual. Como en `actualizar_celdas`, las
+    sesiones de este servidor escriben de a una y al final se relee el token de escritura para
+    informar las filas que otro proceso pisó mientras tanto.
+    Devuelve (ok, mensaje).
+    """
+    actualizadas = nuevas = 0
+    conflictos, escritas = [], []
+    try:
+        worksheet = _abrir_hoja(sheet_name, crear=True)
+        with _bloqueo_hoja(sheet_name):
+            encabezado = worksheet.row_values(1)
+            fila_de_id = _filas_por_clave(worksheet, encabezado, columna_clave)
+            token = uuid.uuid4().hex
+            for lote in lotes:
+                claves = lote[columna_clave].astype(str).tolist()
+                # Búsqueda por elemento en el dict: isin/map con el dict lo copiarían entero en cada lote
+                en_hoja = [fila_de_id.get(c) for c in claves]
+                existe = np.array([f is not None for f in en_hoja], dtype=bool)
+                version_hoja = np.array([f[1] if f else 0 for f in en_hoja])
+                leidas = lote[COLUMNA_VERSION].map(_version).to_numpy() if COLUMNA_VERSION in lote.columns else 0
+                if COLUMNA_VERSION in lote.columns and not forzar:
+                    en_conflicto = existe & (leidas != version_hoja)
+                    if en_conflicto.any():
+                        conflictos += [c for c, conflicto in zip(claves, en_conflicto) if conflicto]
+                        lote, existe = lote[~en_conflicto], existe[~en_conflicto]
+                        leidas, version_hoja = leidas[~en_conflicto], version_hoja[~en_conflicto]
+                        en_hoja = [f for f, conflicto in zip(en_hoja, en_conflicto) if not conflicto]
+                        claves = [c for c, conflicto in zip(claves, en_conflicto) if not conflicto]
+                lote = lote.assign(**{
+                    COLUMNA_VERSION: np.where(existe, version_hoja + 1, np.maximum(leidas, 1)),
+                    COLUMNA_ESCRITURA: token,
+                })
+                escritas += claves
+
+                datos = _ampliar_encabezado(worksheet, encabezado, list(lote.columns))
+                columnas = sorted(lote.columns, key=encabezado.index)
+                existentes = lote.loc[existe, columnas]
+                tramos = _tramos([encabezado.index(c) + 1 for c in columnas])
+                for (fila, _), valores in zip([f for f in en_hoja if f], _valores_filas(existentes)):
+                    inicio = 0
+                    for primera, ultima in tramos:
+                        datos.append({
+                            "range": f"{rowcol_to_a1(fila, primera)}:{rowcol_to_a1(fila, ultima)}",
+                            "values": [valores[inicio:inicio + ultima - primera + 1]],
+                        })
+                        inicio += ultima - primera + 1
+                if datos:
+                    worksheet.batch_update(datos, value_input_option="USER_ENTERED")
+                if not existe.all():
+                    filas = _valores_filas(lote.loc[~existe].reindex(columns=encabezado))
+                    worksheet.append_rows(filas, value_input_option="USER_ENTERED", table_range="A1")
+                actualizadas += int(existe.sum())
+                nuevas += int((~existe).sum())
+                if progreso is not None:
+                    progreso(actualizadas + nuevas + len(conflictos))
+            pisadas, repetidas = _pisadas(worksheet, encabezado, columna_clave, escritas, token) if escritas else ([], [])
+            _limpiar_filas(worksheet, repetidas, len(encabezado))
+        mensaje = f"'{sheet_name}': {actualizadas:,} filas actualizadas y {nuevas:,} nuevas"
+        if conflictos:
+            return False, mensaje + ". " + _mensaje_conflicto(conflictos, "cambiaron en la hoja después de exportarse y no se escribieron") + (
+                "Revísalas o vuelve a restaurar sobrescribiendo los cambios posteriores."
+            )
+        if pisadas:
+            return False, mensaje + ". " + _mensaje_conflicto(pisadas, "fueron escritas por otra sesión al mismo tiempo y quedaron sus valores")
+        return True, mensaje
+    except Exception as e:
+        return False, (
+            f"Error al restaurar '{sheet_name}' después de {actualizadas + nuevas:,} filas "
+            f"({actualizadas:,} actualizadas, {nuevas:,} nuevas): {e}"
+        )
@@ -1,16 +1,19 @@
 import tempfile
 from pathlib import Path
-import json
 
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
 
-from modules.drive_utils import get_google_drive_service, subir_a_drive, crear_carpeta_en_drive
-from modules.sheets_utils import (
-    get_google_sheets_client, load_movimientos_data
+from modules.drive_utils import (
+    get_google_drive_service, obtener_o_crear_carpetas, archivos_existentes_en_drive,
+    GestorSubidasDrive, barras_progreso_subida
 )
-from gspread_dataframe import set_with_dataframe
+from modules.gemini_engine import get_motor_gemini
+from modules.sheets_utils import anexar_filas
+from modules.data_loader import anexar_movimientos, anexar_extractos
+from modules.historial import registrar_eventos, eventos_alta
+from modules.diferencias import guardar_pdf_local
+from modules.exportar import descarga_bajo_demanda, generar_archivo, escribir_csv
 import hashlib
 
 
@@ -19,32 +22,20 @@ def get_file_hash(file):
 
 
 def extract_data_from_pdf_gemini(pdf_path, filename=None):
-    """Extrae información del PDF usando la API de Gemini Flash."""
-    try:
-        genai.configure(api_key=st.secrets["gemini"]["api_key"])
-        model = genai.GenerativeModel("models/gemini-1.5-flash")
+    """
+    Extrae información del PDF usando la API de Gemini Flash (con caché por hash del PDF).
+    Los PDFs largos se procesan por chunks de páginas en paralelo.
+    """
+    resultado = get_motor_gemini().extraer_documentos([(pdf_path, filename or "pdf")])[0]
+    return _resultado_a_dataframes(resultado)
 
-        uploaded = genai.upload_file(path=pdf_path, display_name=filename or "pdf")
 
-        prompt = (
-            "Eres un asistente que lee extractos bancarios en formato PDF y "
-            "devuelve la información estructurada en formato JSON con las claves "
-            "'movimientos' y 'extractos'."
-        )
-
-        response = model.generate_content([prompt, uploaded])
-
-        # Borrar el archivo subido para evitar acumularlo en la cuenta
-        genai.delete_file(uploaded.name)
-
-        data = json.loads(response.text)
-        df_mov = pd.DataFrame(data.get("movimientos", []))
-        df_ext = pd.DataFrame(data.get("extractos", []))
-        banco = data.get("banco")
-        return df_mov, df_ext, banco, response.text
-    except Exception as e:
-        st.error(f"Error al usar Gemini: {e}")
+def _resultado_a_dataframes(resultado):
+    if resultado.error:
+        st.error(f"Error al usar Gemini ({resultado.nombre}): {resultado.error}")
         return None, None, None, None
+    textos = [c.texto for c in resultado.chunks]
+    return resultado.df_movimientos, resultado.df_extractos, resultado.banco, textos
 
 
 
@@ -62,30 +53,15 @@ def render(movimientos_df):
             st.session_state["processed_files"] = set()
 
         guardar_en_drive = True
-        drive_success = 0
-        drive_errors = []
-        folder_id = None
         # Usar siempre la misma carpeta llamada "Extractos"
         nombre_carpeta = "Extractos"
-        from modules.drive_utils import listar_pdfs_en_drive
-        # Buscar si ya existe la carpeta "Extractos" en la raíz/unidad compartida
-        drive_service = get_google_drive_service()
+        # Buscar (o crear) la carpeta "Extractos" en la raíz/unidad compartida con una petición batch
         folder_id = None
-        if drive_service:
-            # Buscar carpeta con ese nombre
-            parent_id = st.secrets["google"]["drive_folder_id"]
-            query = f"'{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and name='{nombre_carpeta}' and trashed=false"
-            results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-            folders = results.get('files', [])
-            if folders:
-                folder_id = folders[0]['id']
-            else:
-                ok, folder_id_or_msg = crear_carpeta_en_drive(nombre_carpeta)
-                if ok:
-                    folder_id = folder_id_or_msg
-                else:
-                    st.warning(f"No se pudo crear la carpeta en Drive: {folder_id_or_msg}")
-                    guardar_en_drive = False
+        if get_google_drive_service():
+            folder_id = obtener_o_crear_carpetas([nombre_carpeta]).get(nombre_carpeta)
+            if not folder_id:
+                st.warning("No se pudo localizar ni crear la carpeta en Drive.")
+                guardar_en_drive = False
         else:
             st.warning("No se pudo conectar con Google Drive.")
             guardar_en_drive = False
@@ -96,34 +72,78 @@ def render(movimientos_df):
             movimientos_list = []
             extractos_list = []
             errores_archivos = []
-            # Obtener lista de PDFs ya existentes en la carpeta
-            pdfs_en_drive = listar_pdfs_en_drive(folder_id)
-            nombres_pdfs_drive = set(pdf['name'] for pdf in pdfs_en_drive)
+            # Comprobar en batch qué PDFs ya existen en la carpeta
+            nombres_pdfs_drive, sin_verificar = archivos_existentes_en_drive(
+                [f.name for f in uploaded_files], folder_id
+            ) if guardar_en_drive else (set(), set())
+            pendientes = []
             for uploaded_file in uploaded_files:
                 file_name = uploaded_file.name
                 file_hash = get_file_hash(uploaded_file)
                 if file_name in nombres_pdfs_drive:
                     st.info(f"El archivo '{file_name}' ya existe en la carpeta de Drive y no será procesado para evitar duplicados.")
                     continue
+                if file_name in sin_verificar:
+                    st.warning(f"No se pudo comprobar si '{file_name}' ya existe en Drive; no se procesa para no duplicarlo. Vuelve a intentarlo.")
+                    continue
 
                 if file_hash in st.session_state["processed_files"]:
                     st.info(f"{file_name} ya fue procesado.")
                     continue
+                pendientes.append((uploaded_file, file_hash))
+
+            # Las subidas a Drive corren en segundo plano mientras se parsean los PDFs
+            gestor_subidas = None
+            if guardar_en_drive and folder_id and pendientes:
+                gestor_subidas = GestorSubidasDrive()
+                gestor_subidas.iniciar(
+                    [(f.name, f.getvalue(), 'application/pdf') for f, _ in pendientes],
+                    folder_id=folder_id
+                )
 
+            # Todos los PDFs pendientes se envían a Gemini a la vez (concurrencia acotada por el motor)
+            tmp_paths = []
+            for uploaded_file, _ in pendientes:
                 with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
                     tmp_file.write(uploaded_file.getbuffer())
-                    tmp_path = tmp_file.name
-
-                if guardar_en_drive and folder_id:
-                    success, result = subir_a_drive(file_name, uploaded_file.getvalue(), 'application/pdf', folder_id=folder_id)
-                    if success:
-                        drive_success += 1
-                    else:
-                        drive_errors.append(f"{uploaded_file.name}: {result}")
-
-                with st.spinner(f"Procesando {uploaded_file.name} con Gemini..."):
-                    df_movimientos, df_extractos, banco, _ = extract_data_from_pdf_gemini(tmp_path, filename=file_name)
+                    tmp_paths.append(tmp_file.name)
+            resultados_gemini = []
+            if pendientes:
+                # Los movimientos se muestran a medida que llegan en el stream de Gemini
+                vivo = st.empty()
+                recibidos = []
+                intentos = {}
+
+                def _on_movimiento(nombre, movimiento, intento=None):
+                    chunk, n = intento or (nombre, 0)
+                    if intentos.setdefault(chunk, n) != n:
+                        # Reintento del chunk: las filas del intento que falló ya no valen
+                        intentos[chunk] = n
+                        recibidos[:] = [(c, fila) for c, fila in recibidos if c != chunk]
+                    recibidos.append((chunk, dict(movimiento, archivo=nombre)))
+                    if len(recibidos) % 10 == 1:
+                        vivo.dataframe(pd.DataFrame([fila for _, fila in recibidos[-20:]]), use_container_width=True)
+
+                with st.spinner(f"Procesando {len(pendientes)} archivo(s) con Gemini..."):
+                    resultados_gemini = get_motor_gemini().extraer_documentos(
+                        [(tmp_path, f.name) for tmp_path, (f, _) in zip(tmp_paths, pendientes)],
+                        on_movimiento=_on_movimiento
+                    )
+                vivo.empty()
+            for tmp_path in tmp_paths:
                 Path(tmp_path).unlink()
+            cacheados = sum(1 for r in resultados_gemini if r.desde_cache)
+            if cacheados:
+                st.caption(f"♻️ {cacheados} archivo(s) recuperados de la caché de Gemini.")
+            uso_llamadas = [dict(r.uso, archivo=r.nombre, segundos=round(r.segundos, 2), cache=r.desde_cache)
+                            for r in resultados_gemini if r.uso]
+            if uso_llamadas:
+                with st.expander("Uso de tokens por archivo"):
+                    st.dataframe(pd.DataFrame(uso_llamadas), use_container_width=True, hide_index=True)
+
+            for (uploaded_file, file_hash), resultado in zip(pendientes, resultados_gemini):
+                file_name = uploaded_file.name
+                df_movimientos, df_extractos, banco, _ = _resultado_a_dataframes(resultado)
                 if df_movimientos is not None and df_extractos is not None:
                     st.session_state["processed_files"].add(file_hash)
 
@@ -134,9 +154,19 @@ def render(movimientos_df):
                 movimientos_list.append(df_movimientos)
                 extractos_list.append(df_extractos)
 
-            # Mostrar resumen de subida a Drive
-            if guardar_en_drive:
-                st.info(f"Archivos subidos a Drive: {drive_success}/{len(uploaded_files)}")
+            # Mostrar progreso y resumen de subida a Drive
+            if gestor_subidas:
+                st.caption("Subida a Google Drive")
+                resultados_drive = gestor_subidas.esperar(
+                    on_progreso=barras_progreso_subida([f.name for f, _ in pendientes])
+                )
+                drive_success = sum(1 for ok, _ in resultados_drive.values() if ok)
+                # Copia local del PDF para re-parsearlo en la conciliación sin descargarlo de Drive
+                for f, _ in pendientes:
+                    if resultados_drive.get(f.name, (False, None))[0]:
+                        guardar_pdf_local(f.name, f.getvalue())
+                drive_errors = [f"{nombre}: {msg}" for nombre, (ok, msg) in resultados_drive.items() if not ok]
+                st.info(f"Archivos subidos a Drive: {drive_success}/{len(pendientes)}")
                 if drive_errors:
                     st.warning("Errores al subir a Drive:\n" + "\n".join(drive_errors))
             # Mostrar errores de extracción
@@ -149,69 +179,42 @@ def render(movimientos_df):
                 st.success(f"✅ Archivos procesados: {len(movimientos_list)}. Total de movimientos: {len(df_total_mov)}")
                 st.subheader("Movimientos detectados")
                 st.dataframe(df_total_mov)
-                csv_mov = df_total_mov.to_csv(index=False).encode("utf-8-sig")
-                st.download_button(
-                    label="Descargar movimientos en CSV",
-                    data=csv_mov,
-                    file_name="movimientos_combinados.csv",
-                    mime="text/csv"
+                descarga_bajo_demanda(
+                    "Descargar movimientos en CSV", "movimientos_combinados.csv",
+                    lambda: generar_archivo(escribir_csv, df_total_mov, encoding="utf-8-sig"),
+                    {"archivos": [h for _, h in pendientes]}, preparar=False,
                 )
                 st.subheader("Extractos detectados (resúmenes)")
                 st.dataframe(df_total_ext)
-                csv_ext = df_total_ext.to_csv(index=False).encode("utf-8-sig")
-                st.download_button(
-                    label="Descargar extractos en CSV",
-                    data=csv_ext,
-                    file_name="extractos_combinados.csv",
-                    mime="text/csv"
+                descarga_bajo_demanda(
+                    "Descargar extractos en CSV", "extractos_combinados.csv",
+                    lambda: generar_archivo(escribir_csv, df_total_ext, encoding="utf-8-sig"),
+                    {"archivos": [h for _, h in pendientes]}, preparar=False,
                 )
 
                 # --- Botón para anexar movimientos a la base de datos principal ---
                 st.subheader("Anexar movimientos y extractos a la base de datos")
                 if st.button("Subir"):
-                    # Guardar movimientos
-                    movimientos_df = load_movimientos_data()
-                    ids_existentes = set(movimientos_df["id"]) if not movimientos_df.empty else set()
-                    from modules.sheets_utils import generar_id_compuesto, get_google_sheets_client
-                    nuevos = []
-                    for _, row in df_total_mov.iterrows():
-                        id_mov = row.get("id")
-                        if id_mov not in ids_existentes:
-                            data = row.to_dict()
-                            nuevos.append(data)
-                    gc = get_google_sheets_client()
-                    sheet_id = st.secrets["google"]["spreadsheet_id"]
-                    sh = gc.open_by_key(sheet_id)
-                    # Guardar movimientos
-                    mov_guardados = 0
-                    mov_duplicados = 0
-                    if nuevos:
-                        worksheet_mov = sh.worksheet("movimientos")
-                        df_actual_mov = pd.DataFrame(worksheet_mov.get_all_records())
-                        df_final_mov = pd.concat([df_actual_mov, pd.DataFrame(nuevos)], ignore_index=True)
-                        set_with_dataframe(worksheet_mov, df_final_mov)
-                        mov_guardados = len(nuevos)
-                        mov_duplicados = len(df_total_mov) - mov_guardados
-                        st.success(f"Movimientos guardados: {mov_guardados} | Duplicados: {mov_duplicados} de {len(df_total_mov)} movimientos.")
+                    # Solo se anexan las filas nuevas (append_rows): no se reescribe la hoja
+                    ok, msg, nuevos = anexar_filas(df_total_mov, "movimientos")
+                    if not ok:
+                        st.error(msg)
+                    elif not nuevos.empty:
+                        # Actualiza la sesión (y el cubo/derivados) sin recargar todo desde Sheets
+                        anexar_movimientos(nuevos)
+                        registrar_eventos(eventos_alta(nuevos))
+                        mov_duplicados = len(df_total_mov) - len(nuevos)
+                        st.success(f"Movimientos guardados: {len(nuevos)} | Duplicados: {mov_duplicados} de {len(df_total_mov)} movimientos.")
                     else:
                         st.info("No hay movimientos nuevos para guardar.")
 
-                    # Guardar extractos
-                    worksheet_ext = sh.worksheet("extractos")
-                    df_actual_ext = pd.DataFrame(worksheet_ext.get_all_records())
-                    nuevos_ext = []
-                    extracto_ids_existentes = set(df_actual_ext["extracto_id"]) if "extracto_id" in df_actual_ext.columns else set()
-                    for _, row in df_total_ext.iterrows():
-                        if row.get("extracto_id") not in extracto_ids_existentes:
-                            nuevos_ext.append(row.to_dict())
-                    ext_guardados = 0
-                    ext_duplicados = 0
-                    if nuevos_ext:
-                        df_final_ext = pd.concat([df_actual_ext, pd.DataFrame(nuevos_ext)], ignore_index=True)
-                        set_with_dataframe(worksheet_ext, df_final_ext)
-                        ext_guardados = len(nuevos_ext)
-                        ext_duplicados = len(df_total_ext) - ext_guardados
-                        st.success(f"Extractos guardados: {ext_guardados} | Duplicados: {ext_duplicados} de {len(df_total_ext)} extractos.")
+                    ok, msg, nuevos_ext = anexar_filas(df_total_ext, "extractos", columna_clave="extracto_id")
+                    if not ok:
+                        st.error(msg)
+                    elif not nuevos_ext.empty:
+                        anexar_extractos(nuevos_ext)
+                        ext_duplicados = len(df_total_ext) - len(nuevos_ext)
+                        st.success(f"Extractos guardados: {len(nuevos_ext)} | Duplicados: {ext_duplicados} de {len(df_total_ext)} extractos.")
                     else:
                         st.info("No hay extractos nuevos para guardar.")
             else:
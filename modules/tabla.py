@@ -0,0 +1,131 @@
+import math
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.data_loader import data_version, obtener_derivado
+from modules.graficos import huella_filtros, CacheLRU
+
+OPCIONES_FILAS = [25, 50, 100, 250]
+COLUMNAS_MONTO = [
+    "monto", "saldo_inicial", "saldo_final", "total_ingresos", "total_egresos", "monto_egreso", "monto_ingreso",
+    "monto_habitual", "ultimo_monto", "cambio_precio", "costo_anual",
+]
+COLUMNAS_BUSQUEDA = ["descripción", "banco", "categoría"]
+# Órdenes (arrays de posiciones) cacheados: cambiar de página no vuelve a ordenar
+ORDENES_MAX = 16
+
+
+def configurar_columnas(df):
+    """Formato por columna (los montos siguen siendo numéricos, solo cambia cómo se muestran)."""
+    config = {}
+    for col in df.columns:
+        if col in COLUMNAS_MONTO:
+            config[col] = st.column_config.NumberColumn(col, format="dollar")
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            config[col] = st.column_config.DateColumn(col, format="YYYY-MM-DD")
+    return config
+
+
+def buscar(df, texto, columnas=COLUMNAS_BUSQUEDA):
+    """Posiciones de las filas que contienen `texto` (sin distinguir mayúsculas) en alguna columna."""
+    mascara = np.zeros(len(df), dtype=bool)
+    for col in columnas:
+        if col in df.columns:
+            mascara |= df[col].astype(str).str.contains(texto, case=False, regex=False, na=False).to_numpy()
+    return np.flatnonzero(mascara)
+
+
+def ordenar(df, posiciones, columna, ascendente=True):
+    """Reordena `posiciones` según `columna` (orden estable, nulos al final)."""
+    valores = pd.Series(df[columna].to_numpy()[posiciones])
+    try:
+        orden = valores.sort_values(ascending=ascendente, kind="stable", na_position="last").index.to_numpy()
+    except TypeError:
+        # Columnas con tipos mezclados (p. ej. números y texto desde Sheets)
+        orden = valores.astype(str).sort_values(ascending=ascendente, kind="stable").index.to_numpy()
+    return posiciones[orden]
+
+
+def tabla_paginada(df, clave, columnas=None, filtros=None, orden_inicial=("fecha", False),
+                   columnas_busqueda=COLUMNAS_BUSQUEDA, filas_por_pagina=50, busqueda=None, editable=None,
+                   column_config=None):
+    """
+    Tabla paginada con búsqueda y orden en el servidor. Solo se arma y se envía al navegador la
+    página visible, así que el costo de pintar no depende del tamaño del historial.
+
+    `filtros` identifica el contenido de `df` (los filtros que lo generaron): si se pasa, las
+    posiciones buscadas/ordenadas se cachean y cambiar de página solo corta el array.
+    `busqueda` (opcional, ver `modules.busqueda`) resuelve la búsqueda con el índice invertido;
+    en ese caso el índice de `df` debe ser la posición de cada fila en movimientos_df, como en
+    las consultas de `IndiceMovimientos`. Sin él se busca por subcadena en `columnas_busqueda`.
+    `editable` (lista de columnas) muestra la página en un st.data_editor; las ediciones se
+    descartan al cambiar de página o de consulta. `column_config` se suma al formato por defecto.
+    Devuelve el DataFrame de la página visible (con las ediciones, si es editable).
+    """
+    columnas = [c for c in (columnas or list(df.columns)) if c in df.columns]
+    columna_inicial, ascendente_inicial = orden_inicial
+    col_buscar, col_orden, col_dir, col_filas = st.columns([3, 2, 1, 1])
+    texto = col_buscar.text_input(
+        "🔍 Buscar", key=f"{clave}_buscar", placeholder="Descripción, banco, categoría...",
+        help="Todas las palabras deben aparecer; basta el comienzo de cada una (\"amaz mkt\")." if busqueda else None
+    )
+    columna = col_orden.selectbox(
+        "Ordenar por", columnas,
+        index=columnas.index(columna_inicial) if columna_inicial in columnas else 0,
+        key=f"{clave}_orden"
+    )
+    descendente = col_dir.toggle("Desc.", value=not ascendente_inicial, key=f"{clave}_desc")
+    filas = col_filas.selectbox(
+        "Filas", OPCIONES_FILAS,
+        index=OPCIONES_FILAS.index(filas_por_pagina) if filas_por_pagina in OPCIONES_FILAS else 0,
+        key=f"{clave}_filas"
+    )
+
+    def _posiciones():
+        if not texto.strip():
+            posiciones = np.arange(len(df))
+        elif busqueda is not None:
+            posiciones = np.flatnonzero(busqueda.coincidencias(texto)[df.index.to_numpy()])
+        else:
+            posiciones = buscar(df, texto.strip(), columnas_busqueda)
+        return ordenar(df, posiciones, columna, not descendente) if columna else posiciones
+
+    if filtros is None:
+        posiciones = _posiciones()
+    else:
+        cache = obtener_derivado("tablas", lambda: CacheLRU(ORDENES_MAX, tamano=lambda a: a.nbytes))
+        clave_cache = (data_version(), clave, huella_filtros(filtros), texto.strip().lower(), columna, descendente)
+        posiciones = cache.obtener(clave_cache)
+        if posiciones is None:
+            posiciones = _posiciones()
+            cache.guardar(clave_cache, posiciones)
+
+    total = len(posiciones)
+    paginas = max(1, math.ceil(total / filas))
+    # Con otra búsqueda, orden o tamaño de página se vuelve a la primera página
+    clave_pagina = f"{clave}_pagina"
+    consulta = (data_version(), huella_filtros(filtros), texto.strip().lower(), columna, descendente, filas)
+    if st.session_state.get(f"{clave}_consulta") != consulta:
+        st.session_state[f"{clave}_consulta"] = consulta
+        st.session_state[clave_pagina] = 1
+
+    hueco = st.empty()
+    col_info, col_pagina = st.columns([4, 1])
+    pagina = col_pagina.number_input("Página", min_value=1, max_value=paginas, step=1, key=clave_pagina)
+    inicio = (pagina - 1) * filas
+    col_info.caption(
+        f"{total:,} filas · mostrando {min(inicio + 1, total):,}–{min(inicio + filas, total):,} · "
+        f"página {pagina} de {paginas}"
+    )
+    pagina_df = df.iloc[posiciones[inicio:inicio + filas]][columnas]
+    config = {**configurar_columnas(pagina_df), **(column_config or {})}
+    if editable:
+        # La clave depende de la consulta y la página: las ediciones son por posición de fila
+        return hueco.data_editor(
+            pagina_df, column_config=config, disabled=[c for c in columnas if c not in editable],
+            hide_index=True, use_container_width=True, key=f"{clave}_editor_{hash(consulta)}_{pagina}"
+        )
+    hueco.dataframe(pagina_df, column_config=config, hide_index=True, use_container_width=True)
+    return pagina_df
@@ -0,0 +1,227 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.data_loader import obtener_derivado, descartar_derivado
+from modules.sheets_utils import anexar_filas
+
+HOJA_TRANSFERENCIAS = "transferencias"
+VENTANA_DIAS = 5
+RONDAS_MAX = 5
+# Moneda de cada banco (por defecto USD) y tasa aproximada a USD para emparejar con tolerancia
+MONEDA_BANCO = {"Wise EUR": "EUR"}
+TASAS_A_USD = {"USD": 1.0, "EUR": 1.10}
+TOLERANCIA_FX = 0.05
+# Solo estas categorías se consideran posibles patas de una transferencia entre cuentas propias
+CATEGORIAS_TRANSFERENCIA = ["Internal Transfer", "Transfers", "Deposit", "Conversion"]
+
+EXACTO = "exacto"
+FX = "fx"
+CONFIRMADO = "confirmado"
+COLUMNAS_PARES = [
+    "id_egreso", "id_ingreso", "banco_egreso", "banco_ingreso", "fecha_egreso", "fecha_ingreso",
+    "monto_egreso", "monto_ingreso", "metodo",
+]
+
+
+def _preparar(movimientos_df):
+    """Mismas reglas que `cubo.preparar_movimientos`, sin la columna de mes (no hace falta aquí)."""
+    return pd.DataFrame({
+        "id": movimientos_df["id"] if "id" in movimientos_df.columns else None,
+        "fecha": pd.to_datetime(movimientos_df["fecha"], errors="coerce"),
+        "banco": movimientos_df["banco"].fillna("").astype(str),
+        "categoría": movimientos_df["categoría"].fillna("Sin Categoría"),
+        "tipo": movimientos_df["tipo"].fillna("").astype(str).str.lower(),
+        "monto": pd.to_numeric(movimientos_df["monto"], errors="coerce"),
+    }, index=movimientos_df.index)
+
+
+def _patas(movimientos_df):
+    movs = _preparar(movimientos_df).dropna(subset=["fecha", "monto"])
+    movs = movs[movs["id"].notna() & movs["tipo"].isin(["ingreso", "egreso"])]
+    movs = movs.assign(
+        id=movs["id"].astype(str),
+        moneda=movs["banco"].map(MONEDA_BANCO).fillna("USD"),
+        centavos=np.round(movs["monto"].abs() * 100).astype("int64"),
+    )
+    return movs[["id", "banco", "fecha", "monto", "tipo", "categoría", "moneda", "centavos"]]
+
+
+def _renombrar(df, sufijo):
+    return df.rename(columns={c: f"{c}_{sufijo}" for c in df.columns})
+
+
+def _resolver(candidatos, clave_a, clave_b, *orden):
+    """Emparejamiento 1:1 voraz: el mejor candidato de cada lado según `orden`."""
+    candidatos = candidatos.sort_values(list(orden), kind="stable")
+    return candidatos.drop_duplicates(clave_a).drop_duplicates(clave_b)
+
+
+def _emparejar_exactos(egresos, ingresos, ventana):
+    """
+    Mismo monto (en centavos) y misma moneda, fecha más cercana dentro de la ventana y bancos
+    distintos. Cada ronda hace un merge_asof por banco de egreso contra los ingresos de los
+    demás bancos; los conflictos (dos egresos con el mismo ingreso) se resuelven por cercanía y
+    los que pierden vuelven a intentarlo en la ronda siguiente.
+    """
+    pares = []
+    egresos = _renombrar(egresos, "egreso").sort_values("fecha_egreso", kind="stable")
+    ingresos = _renombrar(ingresos, "ingreso").sort_values("fecha_ingreso", kind="stable")
+    for _ in range(RONDAS_MAX):
+        candidatos = []
+        for banco, grupo in egresos.groupby("banco_egreso", sort=False):
+            otros = ingresos[ingresos["banco_ingreso"] != banco]
+            if otros.empty:
+                continue
+            cruce = pd.merge_asof(
+                grupo, otros, left_on="fecha_egreso", right_on="fecha_ingreso",
+                left_by=["centavos_egreso", "moneda_egreso"], right_by=["centavos_ingreso", "moneda_ingreso"],
+                direction="nearest", tolerance=pd.Timedelta(days=ventana),
+            )
+            candidatos.append(cruce.dropna(subset=["id_ingreso"]))
+        candidatos = pd.concat(candidatos, ignore_index=True) if candidatos else pd.DataFrame()
+        if candidatos.empty:
+            break
+        candidatos["distancia"] = (candidatos["fecha_ingreso"] - candidatos["fecha_egreso"]).abs()
+        elegidos = _resolver(candidatos, "id_ingreso", "id_egreso", "distancia")
+        pares.append(elegidos)
+        egresos = egresos[~egresos["id_egreso"].isin(elegidos["id_egreso"])]
+        ingresos = ingresos[~ingresos["id_ingreso"].isin(elegidos["id_ingreso"])]
+    return pd.concat(pares, ignore_index=True).assign(metodo=EXACTO) if pares else pd.DataFrame()
+
+
+def _emparejar_fx(egresos, ingresos, ventana, tolerancia, tasas):
+    """
+    Patas en monedas distintas (p. ej. Wise EUR contra una cuenta en USD): se convierten a USD
+    con una tasa aproximada y se aceptan si la diferencia relativa no supera `tolerancia`.
+    Los candidatos salen de unir por día: cada pata extranjera se expande a los días de la
+    ventana, así el cruce es un merge por igualdad y no una comparación de todos contra todos.
+    """
+    pares = []
+    desfases = pd.to_timedelta(np.arange(-ventana, ventana + 1), unit="D")
+    for lado, contrario in (("egreso", "ingreso"), ("ingreso", "egreso")):
+        patas = {"egreso": egresos, "ingreso": ingresos}
+        extranjeras, otras = patas[lado][patas[lado]["moneda"] != "USD"], patas[contrario]
+        if extranjeras.empty or otras.empty:
+            continue
+        extr = _renombrar(extranjeras, lado)
+        extr = extr.iloc[np.repeat(np.arange(len(extr)), len(desfases))].assign(
+            dia=np.repeat(extr[f"fecha_{lado}"].to_numpy(), len(desfases)) + np.tile(desfases.to_numpy(), len(extr))
+        )
+        otras = _renombrar(otras, contrario).assign(dia=lambda d: d[f"fecha_{contrario}"])
+        candidatos = extr.merge(otras, on="dia")
+        candidatos = candidatos[
+            (candidatos[f"moneda_{lado}"] != candidatos[f"moneda_{contrario}"])
+            & (candidatos["banco_egreso"] != candidatos["banco_ingreso"])
+        ]
+        usd_egreso = candidatos["monto_egreso"].abs() * candidatos["moneda_egreso"].map(tasas).fillna(1.0)
+        usd_ingreso = candidatos["monto_ingreso"].abs() * candidatos["moneda_ingreso"].map(tasas).fillna(1.0)
+        candidatos = candidatos.assign(
+            # Con montos convertidos muchos movimientos caen dentro de la tolerancia: se prefieren
+            # las patas de la misma categoría (p. ej. las dos "Conversion" de Wise) y las más
+            # cercanas en fecha; la tasa es aproximada, así que el desvío solo desempata
+            otra_categoria=candidatos["categoría_egreso"] != candidatos["categoría_ingreso"],
+            desvio=(usd_egreso - usd_ingreso).abs() / np.maximum(usd_egreso, usd_ingreso),
+            distancia=(candidatos["fecha_ingreso"] - candidatos["fecha_egreso"]).abs(),
+        )
+        candidatos = candidatos[candidatos["desvio"] <= tolerancia]
+        if candidatos.empty:
+            continue
+        elegidos = _resolver(candidatos, "id_egreso", "id_ingreso", "otra_categoria", "distancia", "desvio")
+        # Una pata no puede quedar en dos pares entre las dos direcciones del cruce
+        egresos = egresos[~egresos["id"].isin(elegidos["id_egreso"])]
+        ingresos = ingresos[~ingresos["id"].isin(elegidos["id_ingreso"])]
+        pares.append(elegidos.assign(metodo=FX))
+    return pd.concat(pares, ignore_index=True) if pares else pd.DataFrame()
+
+
+def emparejar_transferencias(movimientos_df, confirmados_df=None, ventana_dias=VENTANA_DIAS,
+                             tolerancia_fx=TOLERANCIA_FX, tasas=TASAS_A_USD, categorias=CATEGORIAS_TRANSFERENCIA):
+    """
+    Empareja egresos e ingresos entre cuentas propias (transferencias internas).
+
+    1. Los pares confirmados (hoja "transferencias") se respetan tal cual si ambas patas existen.
+    2. Con el resto: mismo monto exacto y misma moneda en bancos distintos dentro de la ventana.
+    3. Lo que queda en monedas distintas se empareja con tolerancia de tipo de cambio.
+
+    Devuelve un DataFrame con `COLUMNAS_PARES`.
+    """
+    patas = _patas(movimientos_df)
+    pares = []
+    if confirmados_df is not None and not confirmados_df.empty:
+        confirmados = confirmados_df[["id_egreso", "id_ingreso"]].astype(str)
+        confirmados = confirmados.merge(_renombrar(patas, "egreso"), on="id_egreso")
+        confirmados = confirmados.merge(_renombrar(patas, "ingreso"), on="id_ingreso")
+        pares.append(confirmados.assign(metodo=CONFIRMADO))
+
+    candidatas = patas if categorias is None else patas[patas["categoría"].isin(categorias)]
+    if pares:
+        candidatas = candidatas[~candidatas["id"].isin(pares[0]["id_egreso"]) & ~candidatas["id"].isin(pares[0]["id_ingreso"])]
+    egresos = candidatas[candidatas["tipo"] == "egreso"]
+    ingresos = candidatas[candidatas["tipo"] == "ingreso"]
+
+    exactos = _emparejar_exactos(egresos, ingresos, ventana_dias)
+    if not exactos.empty:
+        pares.append(exactos)
+        egresos = egresos[~egresos["id"].isin(exactos["id_egreso"])]
+        ingresos = ingresos[~ingresos["id"].isin(exactos["id_ingreso"])]
+    pares.append(_emparejar_fx(egresos, ingresos, ventana_dias, tolerancia_fx, tasas))
+
+    pares = [p for p in pares if not p.empty]
+    if not pares:
+        return pd.DataFrame(columns=COLUMNAS_PARES)
+    return pd.concat([p[COLUMNAS_PARES] for p in pares], ignore_index=True).sort_values("fecha_egreso", ignore_index=True)
+
+
+class TransferenciasInternas:
+    """Pares de transferencias internas de la versión de datos actual y sus patas."""
+
+    def __init__(self, movimientos_df, confirmados_df=None):
+        self.pares = emparejar_transferencias(movimientos_df, confirmados_df)
+        ids = pd.concat([self.pares["id_egreso"], self.pares["id_ingreso"]])
+        movs = _preparar(movimientos_df)
+        self.patas = movs[movs["id"].astype(str).isin(ids)]
+
+    @property
+    def ids(self):
+        return set(self.patas["id"].astype(str))
+
+    def totales_excluidos(self, fecha_ini=None, fecha_fin=None, bancos=None, categorias=None, tipos=None):
+        """Suma por tipo de las patas emparejadas que caen dentro de los filtros (mismos que el cubo)."""
+        patas = self.patas
+        if fecha_ini is not None:
+            patas = patas[patas["fecha"] >= pd.Timestamp(fecha_ini)]
+        if fecha_fin is not None:
+            patas = patas[patas["fecha"] <= pd.Timestamp(fecha_fin)]
+        for col, valores in (("banco", bancos), ("categoría", categorias), ("tipo", tipos)):
+            if valores is not None:
+                patas = patas[patas[col].isin(valores)]
+        return patas.groupby("tipo")["monto"].sum()
+
+
+def get_transferencias(movimientos_df):
+    """Transferencias internas de la versión de datos actual (se calculan la primera vez)."""
+    return obtener_derivado(
+        "transferencias",
+        lambda: TransferenciasInternas(movimientos_df, st.session_state.get("transferencias_df")),
+    )
+
+
+def guardar_emparejamientos(pares_df):
+    """
+    Anexa a la hoja "transferencias" los pares que todavía no están confirmados (un egreso está
+    en un solo par, así que id_egreso es la clave); desde ahí se respetan como confirmados.
+    """
+    guardar = pares_df[["id_egreso", "id_ingreso", "metodo"]].copy()
+    guardar["confirmado_por"] = st.session_state.get("username", "anon")
+    guardar["fecha_confirmacion"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ok, msg, nuevos = anexar_filas(guardar, HOJA_TRANSFERENCIAS, columna_clave="id_egreso")
+    if ok and not nuevos.empty:
+        confirmados = st.session_state.get("transferencias_df")
+        st.session_state["transferencias_df"] = (
+            nuevos if confirmados is None or confirmados.empty else pd.concat([confirmados, nuevos], ignore_index=True)
+        )
+        descartar_derivado("transferencias")
+    return ok, msg
@@ -1,5 +1,5 @@
 import streamlit as st
-from modules.drive_utils import listar_pdfs_en_drive
+from modules.drive_utils import listar_pdfs_en_drive, obtener_o_crear_carpetas
 import pandas as pd
 
 
@@ -9,18 +9,8 @@ def render(movimientos_df):
     st.caption("Selecciona un PDF de la carpeta 'Extractos' en Drive para ver los movimientos asociados.")
 
     # Buscar el folder_id de la carpeta Extractos igual que en subir.py
-    drive_service = None
-    folder_id = None
     try:
-        from modules.drive_utils import get_google_drive_service
-        drive_service = get_google_drive_service()
-        nombre_carpeta = "Extractos"
-        parent_id = st.secrets["google"]["drive_folder_id"]
-        query = f"'{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and name='{nombre_carpeta}' and trashed=false"
-        results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-        folders = results.get('files', [])
-        if folders:
-            folder_id = folders[0]['id']
+        folder_id = obtener_o_crear_carpetas(["Extractos"], crear=False).get("Extractos")
     except Exception as e:
         st.warning(f"No se pudo localizar la carpeta 'Extractos' en Drive: {e}")
         return